@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Order Archive
+Moves old closed orders and their payments to an archive database, with read-through lookups
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import sqlite3
+
+from database import DATABASE_PATH, ConnectionPool, Database, db
+from orders import load_order_items
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DB_PATH = os.getenv(
+    'SEATSERVE_ARCHIVE_DB_PATH', f"{os.path.splitext(DATABASE_PATH)[0]}_archive.db"
+)
+# Closed orders older than this move to the archive
+ARCHIVE_AFTER_HOURS = float(os.getenv('SEATSERVE_ARCHIVE_AFTER_HOURS', '48'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('SEATSERVE_ARCHIVE_BATCH_SIZE', '500'))
+# How often the background job runs; 0 disables it
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('SEATSERVE_ARCHIVE_INTERVAL_SECONDS', '3600'))
+
+# Orders the kitchen is done with. Paid orders this old were never claimed.
+ARCHIVE_STATUSES = ('paid', 'ready')
+# Only settled payments move with their order; pending and review payments
+# stay live where webhooks and reconciliation can still settle them
+SETTLED_PAYMENT_STATUSES = ('completed', 'failed')
+
+_ORDER_COLUMNS = "id, table_number, stand, subtotal, tax, total, status, timestamp, paid_at"
+_ITEM_COLUMNS = "id, order_id, line_no, menu_item_id, name, qty, unit_price, extra"
+_PAYMENT_COLUMNS = "id, order_id, amount, payment_method, status, transaction_id, timestamp"
+
+
+def create_archive_schema(conn: sqlite3.Connection, schema: str = "main") -> None:
+    """Archive tables mirror the live ones, keeping their ids"""
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.orders (
+            id INTEGER PRIMARY KEY,
+            table_number INTEGER NOT NULL,
+            stand TEXT,
+            subtotal REAL,
+            tax REAL,
+            total REAL NOT NULL,
+            status TEXT,
+            timestamp TEXT,
+            paid_at TEXT,
+            archived_at TEXT NOT NULL
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.order_items (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            line_no INTEGER NOT NULL,
+            menu_item_id,
+            name TEXT,
+            qty INTEGER,
+            unit_price REAL,
+            extra TEXT
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema}.payments (
+            id INTEGER PRIMARY KEY,
+            order_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            payment_method TEXT,
+            status TEXT,
+            transaction_id TEXT,
+            timestamp TEXT
+        )
+    ''')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_order_items_order ON order_items (order_id, line_no)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_payments_order ON payments (order_id)')
+    # Keyset order for exports
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_orders_timestamp ON orders (timestamp, id)')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_payments_timestamp ON payments (timestamp, id)')
+
+
+# Archive files this process has created the schema in; attaching one
+# again (e.g. for every export chunk) skips the DDL
+_schema_created: Set[str] = set()
+
+
+@contextmanager
+def attached_archive(conn: sqlite3.Connection, archive_path: str) -> Iterator[sqlite3.Connection]:
+    """Attach the archive to a live connection as ``archive`` for the duration of the block"""
+    conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    try:
+        if archive_path not in _schema_created:
+            create_archive_schema(conn, "archive")
+            _schema_created.add(archive_path)
+        yield conn
+    finally:
+        conn.execute('DETACH DATABASE archive')
+
+
+def archive_batch(conn: sqlite3.Connection, archive_path: str, cutoff: str, batch_size: int) -> int:
+    """Move up to ``batch_size`` closed orders placed before ``cutoff``; returns how many.
+
+    Settled payments move with their order; any other payment stays live.
+
+    The archive is attached to the live connection, and rows are copied
+    and deleted in one transaction. SQLite only guarantees atomicity per
+    database file in WAL mode, so a crash can leave a batch in both files;
+    copies replace by id, so the next run finishes the move, and reads
+    prefer the live database.
+    """
+    with attached_archive(conn, archive_path):
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            statuses = ",".join("?" * len(ARCHIVE_STATUSES))
+            order_ids = [row[0] for row in conn.execute(
+                f'SELECT id FROM main.orders WHERE status IN ({statuses}) AND timestamp < ? LIMIT ?',
+                (*ARCHIVE_STATUSES, cutoff, batch_size)
+            )]
+            if order_ids:
+                ids = ",".join("?" * len(order_ids))
+                settled = ",".join("?" * len(SETTLED_PAYMENT_STATUSES))
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO archive.orders ({_ORDER_COLUMNS}, archived_at)
+                    SELECT {_ORDER_COLUMNS}, ? FROM main.orders WHERE id IN ({ids})
+                ''', (datetime.now().isoformat(), *order_ids))
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO archive.order_items ({_ITEM_COLUMNS})
+                    SELECT {_ITEM_COLUMNS} FROM main.order_items WHERE order_id IN ({ids})
+                ''', order_ids)
+                conn.execute(f'''
+                    INSERT OR REPLACE INTO archive.payments ({_PAYMENT_COLUMNS})
+                    SELECT {_PAYMENT_COLUMNS} FROM main.payments
+                    WHERE order_id IN ({ids}) AND status IN ({settled})
+                ''', (*order_ids, *SETTLED_PAYMENT_STATUSES))
+                conn.execute(
+                    f'DELETE FROM main.payments WHERE order_id IN ({ids}) AND status IN ({settled})',
+                    (*order_ids, *SETTLED_PAYMENT_STATUSES)
+                )
+                conn.execute(f'DELETE FROM main.order_items WHERE order_id IN ({ids})', order_ids)
+                conn.execute(f'DELETE FROM main.orders WHERE id IN ({ids})', order_ids)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    return len(order_ids)
+
+
+def _load_order(conn: sqlite3.Connection, order_id: int) -> Optional[Tuple[tuple, List[dict]]]:
+    row = conn.execute(
+        'SELECT id, table_number, stand, subtotal, tax, total, status, timestamp FROM orders WHERE id = ?',
+        (order_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return row, load_order_items(conn, [order_id])[order_id]
+
+
+def _load_payment(conn: sqlite3.Connection, payment_id: int) -> Optional[tuple]:
+    return conn.execute(
+        f'SELECT {_PAYMENT_COLUMNS} FROM payments WHERE id = ?', (payment_id,)
+    ).fetchone()
+
+
+class OrderArchive:
+    """The archive database, and lookups that fall back to it.
+
+    Lookups by id read the live database first and only touch the archive
+    on a miss. The archive has its own small connection pool, so archive
+    reads never take connections from live traffic.
+    """
+
+    def __init__(self, database: Database, path: str = ARCHIVE_DB_PATH):
+        self.database = database
+        self.path = path
+        self.archive_db = Database(ConnectionPool(path, size=2), max_concurrency=2)
+        self._schema_ready = False
+
+    async def _archived(self, fn, *args, name: str):
+        if not self._schema_ready:
+            await self.archive_db.run(create_archive_schema, name="archive_schema")
+            self._schema_ready = True
+        return await self.archive_db.run(fn, *args, name=name)
+
+    async def get_order(self, order_id: int) -> Optional[Tuple[tuple, List[dict]]]:
+        """(id, table_number, stand, subtotal, tax, total, status, timestamp) row and items"""
+        found = await self.database.run(_load_order, order_id, name="get_order")
+        if found is None:
+            found = await self._archived(_load_order, order_id, name="archive_get_order")
+        return found
+
+    async def get_payment(self, payment_id: int) -> Optional[tuple]:
+        found = await self.database.run(_load_payment, payment_id, name="get_payment")
+        if found is None:
+            found = await self._archived(_load_payment, payment_id, name="archive_get_payment")
+        return found
+
+    async def run(self, older_than_hours: float = ARCHIVE_AFTER_HOURS, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """Archive every eligible order, one short transaction per batch"""
+        cutoff = (datetime.now() - timedelta(hours=older_than_hours)).isoformat()
+        total = 0
+        while True:
+            moved = await self.database.run(archive_batch, self.path, cutoff, batch_size, name="archive_batch")
+            total += moved
+            if moved < batch_size:
+                break
+            # Let live writes in between batches
+            await asyncio.sleep(0)
+        self._schema_ready = True
+        return total
+
+    def open(self) -> None:
+        self.archive_db.open()
+
+    def close(self) -> None:
+        self.archive_db.close()
+
+
+class ArchiveWorker:
+    """Runs the archive job on a fixed interval on the app's event loop"""
+
+    def __init__(self, archive: OrderArchive, interval: float = ARCHIVE_INTERVAL_SECONDS):
+        self.archive = archive
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                moved = await self.archive.run()
+                if moved:
+                    logger.info(f"🗄️ Ordenes archivadas: {moved}")
+            except Exception as e:
+                logger.error(f"❌ Error archivando ordenes: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+order_archive = OrderArchive(db)
+archive_worker = ArchiveWorker(order_archive)
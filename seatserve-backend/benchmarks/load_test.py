@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Load Test
+Drives realistic request mixes against a throwaway database and reports
+throughput and p50/p95/p99 latency per endpoint as JSON
+
+Usage:
+    python benchmarks/load_test.py --mix mixed --concurrency 32 --duration 30
+    python benchmarks/load_test.py --output after.json --compare before.json
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative weights of each scenario in a mix
+MIXES = {
+    "browse": {"menu": 6, "menu_revalidate": 6, "categories": 2, "tables": 1},
+    "checkout": {"create_order": 4, "payment": 4, "orders": 1, "menu_revalidate": 1},
+    "host": {"tables": 4, "table_status": 4, "orders": 2},
+    "mixed": {
+        "menu": 4, "menu_revalidate": 6, "categories": 1, "create_order": 3,
+        "payment": 2, "orders": 1, "tables": 1, "table_status": 1,
+    },
+}
+
+TABLE_STATUSES = ("available", "occupied", "reserved")
+
+
+class Recorder:
+    """Latency samples and error counts per endpoint label"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.total = 0
+
+    def record(self, label: str, seconds: float, ok: bool) -> None:
+        self.samples[label].append(seconds)
+        self.total += 1
+        if not ok:
+            self.errors[label] += 1
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Scenarios:
+    """User journeys; each records one sample per HTTP request it makes"""
+
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.menu: List[dict] = []
+        self.tables: List[dict] = []
+        self.menu_etag: Optional[str] = None
+
+    async def request(self, label: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        response = None
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        self.recorder.record(label, time.perf_counter() - started, ok)
+        return response
+
+    async def setup(self) -> None:
+        menu = await self.client.get("/api/menu")
+        menu.raise_for_status()
+        self.menu = menu.json()
+        self.menu_etag = menu.headers.get("etag")
+        tables = await self.client.get("/api/tables")
+        tables.raise_for_status()
+        self.tables = tables.json()
+
+    def _cart(self) -> dict:
+        # Only ids and quantities, as the app sends them; the server prices the order
+        picks = self.rng.sample(self.menu, k=min(len(self.menu), self.rng.randint(1, 4)))
+        return {
+            "table_number": self.rng.choice(self.tables)["number"],
+            "items": [{"id": item["id"], "qty": self.rng.randint(1, 3)} for item in picks],
+        }
+
+    async def menu_full(self) -> None:
+        await self.request("GET /api/menu", "GET", "/api/menu")
+
+    async def menu_revalidate(self) -> None:
+        headers = {"If-None-Match": self.menu_etag} if self.menu_etag else {}
+        await self.request("GET /api/menu (revalidate)", "GET", "/api/menu", headers=headers)
+
+    async def categories(self) -> None:
+        await self.request("GET /api/menu/categories", "GET", "/api/menu/categories")
+
+    async def create_order(self) -> Optional[dict]:
+        response = await self.request("POST /api/orders", "POST", "/api/orders", json=self._cart())
+        return response.json() if response is not None and response.status_code == 200 else None
+
+    async def payment(self) -> None:
+        order = await self.create_order()
+        if order is None:
+            return
+        response = await self.request("POST /api/payments", "POST", "/api/payments", json={
+            "order_id": order["id"], "amount": order["total"], "payment_method": "card",
+        })
+        if response is None or response.status_code != 200:
+            return
+        payment_id = response.json()["id"]
+        await self.request("PUT /api/payments/{id}/confirm", "PUT", f"/api/payments/{payment_id}/confirm")
+
+    async def orders(self) -> None:
+        await self.request("GET /api/orders", "GET", "/api/orders", params={"limit": 50})
+
+    async def tables_list(self) -> None:
+        await self.request("GET /api/tables", "GET", "/api/tables")
+
+    async def table_status(self) -> None:
+        table = self.rng.choice(self.tables)
+        await self.request(
+            "PUT /api/tables/{id}/status", "PUT", f"/api/tables/{table['id']}/status",
+            params={"status": self.rng.choice(TABLE_STATUSES)},
+        )
+
+    def pick(self, mix: Dict[str, int]) -> Callable:
+        handlers = {
+            "menu": self.menu_full,
+            "menu_revalidate": self.menu_revalidate,
+            "categories": self.categories,
+            "create_order": self.create_order,
+            "payment": self.payment,
+            "orders": self.orders,
+            "tables": self.tables_list,
+            "table_status": self.table_status,
+        }
+        name = self.rng.choices(list(mix), weights=list(mix.values()))[0]
+        return handlers[name]
+
+
+async def run_load(
+    client_factory: Callable[[], httpx.AsyncClient],
+    mix: str = "mixed",
+    concurrency: int = 16,
+    duration: float = 10.0,
+    max_requests: Optional[int] = None,
+    seed: int = 1234,
+) -> dict:
+    """Run ``concurrency`` virtual users until ``duration`` or ``max_requests``"""
+    weights = MIXES[mix]
+    recorder = Recorder()
+
+    async with client_factory() as client:
+        users = [Scenarios(client, recorder, random.Random(seed + i)) for i in range(concurrency)]
+        # Setup traffic is not part of the measurement
+        await asyncio.gather(*(scenarios.setup() for scenarios in users))
+
+        started = time.perf_counter()
+        deadline = started + duration
+
+        async def user(scenarios: Scenarios) -> None:
+            while time.perf_counter() < deadline:
+                if max_requests is not None and recorder.total >= max_requests:
+                    break
+                await scenarios.pick(weights)()
+
+        await asyncio.gather(*(user(scenarios) for scenarios in users))
+        elapsed = time.perf_counter() - started
+
+    return build_report(recorder, elapsed, {
+        "mix": mix,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "seed": seed,
+    })
+
+
+def build_report(recorder: Recorder, elapsed: float, meta: dict) -> dict:
+    endpoints = {}
+    for label, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        endpoints[label] = {
+            "count": len(ordered),
+            "errors": recorder.errors.get(label, 0),
+            "throughput_rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        }
+    total = sum(len(samples) for samples in recorder.samples.values())
+    return {
+        "meta": {
+            **meta,
+            "commit": _git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+        },
+        "summary": {
+            "requests": total,
+            "errors": sum(recorder.errors.values()),
+            "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        },
+        "endpoints": endpoints,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path: str, port: int, extra_env: Optional[dict] = None) -> subprocess.Popen:
+    """Initialize a throwaway database and boot uvicorn against it"""
+    env = {**os.environ, "SEATSERVE_DB_PATH": db_path, **(extra_env or {})}
+    subprocess.run(
+        [sys.executable, "-c", "from main import init_db; init_db()"],
+        cwd=BACKEND_DIR, env=env, check=True,
+    )
+    log_path = os.path.join(os.path.dirname(db_path), "server.log")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env, stdout=open(log_path, "w"), stderr=subprocess.STDOUT,
+    )
+    print(f"🚀 Servidor de prueba en :{port}, log en {log_path}")
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not become healthy within 30s")
+
+
+def compare(current: dict, baseline: dict) -> str:
+    """Human-readable latency/throughput deltas against a previous report"""
+    lines = [f"{'endpoint':<36} {'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>16} {'rps':>16}"]
+    for label, now in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(label)
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if before is None or not before[key]:
+                cells.append(f"{now[key]:>16}")
+            else:
+                change = (now[key] - before[key]) / before[key] * 100
+                cells.append(f"{now[key]:>9} {change:+5.0f}%")
+        lines.append(f"{label:<36} " + " ".join(cells))
+    return "\n".join(lines)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="SeatServe load test")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--url", help="target an already running server instead of booting one")
+    parser.add_argument("--in-process", action="store_true",
+                        help="call the ASGI app directly (no sockets); useful for quick comparisons")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="previous report to diff against")
+    args = parser.parse_args()
+
+    server = None
+    tmp_dir = tempfile.mkdtemp(prefix="seatserve-bench-")
+    db_path = os.path.join(tmp_dir, "bench.db")
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    if args.in_process:
+        os.environ["SEATSERVE_DB_PATH"] = db_path
+        sys.path.insert(0, BACKEND_DIR)
+        from main import app, init_db
+        init_db()
+        factory = lambda: httpx.AsyncClient(app=app, base_url="http://bench")
+        target = "in-process"
+    else:
+        if args.url:
+            base_url = args.url
+        else:
+            port = _free_port()
+            server = start_server(db_path, port)
+            base_url = f"http://127.0.0.1:{port}"
+        factory = lambda: httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30)
+        target = base_url
+
+    try:
+        report = asyncio.run(run_load(
+            factory, args.mix, args.concurrency, args.duration, args.requests, args.seed
+        ))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report["meta"]["target"] = target
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    summary = report["summary"]
+    print(f"📊 {summary['requests']} requests, {summary['errors']} errors, "
+          f"{summary['throughput_rps']} req/s -> {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(report, json.load(f)))
+    else:
+        for label, stats in report["endpoints"].items():
+            print(f"  {label:<36} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  "
+                  f"p99 {stats['p99_ms']:>8} ms  {stats['throughput_rps']:>8} req/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Serialization Benchmark
+Per-row cost of turning database rows into a JSON response body, comparing
+Pydantic models + response_model validation against direct row encoding
+
+Usage:
+    python benchmarks/serialization_bench.py --rows 100 1000 10000
+    python benchmarks/serialization_bench.py --output serialization.json
+"""
+
+from typing import Callable, Dict, List
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+# Importing main opens the database pool; keep it away from the real one
+os.environ.setdefault("SEATSERVE_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="seatserve-bench-"), "bench.db"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from main import Order, Payment, Table, _order_json  # noqa: E402
+from serialization import RowsResponse  # noqa: E402
+
+
+def order_rows(count: int):
+    items = [{"id": 1, "name": "Hot Dog", "price": 6.5, "qty": 2}, {"id": 7, "name": "Soda", "price": 3.0, "qty": 1}]
+    rows = [
+        (i, i % 40 + 1, "main", 16.0, 1.12, 17.12, "pending", f"2024-06-01T18:{i % 60:02d}:00.{i:06d}")
+        for i in range(count)
+    ]
+    return rows, {row[0]: items for row in rows}
+
+
+def payment_rows(count: int):
+    return [(i, i, 16.0, "card", "completed", f"TXN-{i}-1717264800", "2024-06-01T18:00:00") for i in range(count)]
+
+
+def table_rows(count: int):
+    return [(i, i, 4, "available") for i in range(count)]
+
+
+# serialize_response is a coroutine; reuse one loop so loop setup isn't timed
+_loop = asyncio.new_event_loop()
+
+
+def _models_body(model, build: Callable[[], list]) -> bytes:
+    # What FastAPI did before: one model per row, then response_model
+    # validation, jsonable_encoder and json.dumps
+    field = create_response_field(name="Response", type_=List[model])
+    content = _loop.run_until_complete(serialize_response(field=field, response_content=build()))
+    return JSONResponse(content).body
+
+
+def cases(count: int) -> Dict[str, Dict[str, Callable[[], bytes]]]:
+    orders, items = order_rows(count)
+    payments = payment_rows(count)
+    tables = table_rows(count)
+    return {
+        "orders": {
+            "models": lambda: _models_body(Order, lambda: [
+                Order(id=r[0], table_number=r[1], stand=r[2], items=items[r[0]], subtotal=r[3], tax=r[4],
+                      total=r[5], status=r[6], timestamp=r[7])
+                for r in orders
+            ]),
+            "rows": lambda: RowsResponse([_order_json(r, items[r[0]]) for r in orders]).body,
+        },
+        "payments": {
+            "models": lambda: _models_body(Payment, lambda: [
+                Payment(id=r[0], order_id=r[1], amount=r[2], payment_method=r[3], status=r[4],
+                        transaction_id=r[5], timestamp=r[6])
+                for r in payments
+            ]),
+            "rows": lambda: RowsResponse([
+                {"id": r[0], "order_id": r[1], "amount": r[2], "payment_method": r[3],
+                 "status": r[4], "transaction_id": r[5], "timestamp": r[6]}
+                for r in payments
+            ]).body,
+        },
+        "tables": {
+            "models": lambda: _models_body(Table, lambda: [
+                Table(id=r[0], number=r[1], seats=r[2], status=r[3]) for r in tables
+            ]),
+            "rows": lambda: RowsResponse([
+                {"id": r[0], "number": r[1], "seats": r[2], "status": r[3]} for r in tables
+            ]).body,
+        },
+    }
+
+
+def best_of(fn: Callable[[], bytes], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def run(row_counts: List[int], repeat: int) -> dict:
+    results = {}
+    for count in row_counts:
+        for endpoint, paths in cases(count).items():
+            # Both paths must produce the same document
+            assert json.loads(paths["models"]()) == json.loads(paths["rows"]()), endpoint
+            before = best_of(paths["models"], repeat)
+            after = best_of(paths["rows"], repeat)
+            results[f"{endpoint}/{count}"] = {
+                "rows": count,
+                "models_us_per_row": round(before / count * 1e6, 3),
+                "rows_us_per_row": round(after / count * 1e6, 3),
+                "speedup": round(before / after, 2),
+            }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="SeatServe serialization benchmark")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per case; the fastest is kept")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.repeat)
+    print(f"{'case':<18}{'models µs/row':>15}{'rows µs/row':>14}{'speedup':>10}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['models_us_per_row']:>15.3f}{result['rows_us_per_row']:>14.3f}{result['speedup']:>9.2f}x")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,12 @@
+"""
+Pytest configuration for the SeatServe FastAPI backend
+
+Points the app at a throwaway SQLite file so test runs never touch the
+committed seatserve.db.
+"""
+
+import os
+import tempfile
+
+_test_db_dir = tempfile.mkdtemp(prefix="seatserve-test-")
+os.environ.setdefault("SEATSERVE_DB_PATH", os.path.join(_test_db_dir, "seatserve.db"))
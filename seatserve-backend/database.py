@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Database Access Layer
+Shared, pre-tuned SQLite connections and an async-safe query runner
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Sequence, Tuple
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from metrics import db_query_duration, db_query_wait
+
+logger = logging.getLogger(__name__)
+
+# Database settings (overridable through the environment)
+DATABASE_PATH = os.getenv('SEATSERVE_DB_PATH', 'seatserve.db')
+POOL_SIZE = int(os.getenv('SEATSERVE_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.getenv('SEATSERVE_DB_POOL_TIMEOUT', '10'))
+BUSY_TIMEOUT_MS = int(os.getenv('SEATSERVE_DB_BUSY_TIMEOUT_MS', '5000'))
+MMAP_SIZE = int(os.getenv('SEATSERVE_DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+STATEMENT_CACHE_SIZE = int(os.getenv('SEATSERVE_DB_STATEMENT_CACHE', '256'))
+MAX_CONCURRENCY = int(os.getenv('SEATSERVE_DB_MAX_CONCURRENCY', str(POOL_SIZE)))
+SLOW_QUERY_MS = float(os.getenv('SEATSERVE_DB_SLOW_QUERY_MS', '100'))
+
+WAL_SIZE_LIMIT = int(os.getenv('SEATSERVE_DB_WAL_SIZE_LIMIT', str(64 * 1024 * 1024)))
+
+# Applied to every new connection. WAL lets readers run alongside the single
+# writer, and busy_timeout makes writers wait instead of failing with
+# "database is locked" when they collide, including writers in other
+# worker processes. journal_size_limit truncates the WAL after checkpoints
+# so a write burst doesn't leave a huge file behind.
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}',
+    f'PRAGMA mmap_size={MMAP_SIZE}',
+    'PRAGMA temp_store=MEMORY',
+    f'PRAGMA journal_size_limit={WAL_SIZE_LIMIT}',
+)
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free in time"""
+
+
+class ConnectionPool:
+    """Fixed-size pool of long-lived SQLite connections.
+
+    Connections are opened lazily up to ``size`` and reused afterwards, so
+    the open/PRAGMA/schema-load cost is paid once per connection instead of
+    once per request. Each connection keeps its own prepared statement
+    cache (``cached_statements``), which is what makes reuse pay off.
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            # Implicit transactions take the write lock up front. A deferred
+            # one starts out reading, and if another process commits before it
+            # upgrades to writing, SQLite fails it at once (busy_timeout doesn't
+            # apply) with "database is locked".
+            isolation_level='IMMEDIATE',
+        )
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take a connection from the pool, opening one if below capacity"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, rolling back any open transaction"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            # Broken connection: drop it so a fresh one is opened next time
+            logger.warning(f"⚠️ Descartando conexión dañada: {e}")
+            self._discard(conn)
+            return
+
+        if self._closed:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Context manager that always hands the connection back"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def open(self) -> None:
+        """Accept acquisitions again after ``close()``"""
+        self._closed = False
+
+    def warm(self, count: Optional[int] = None) -> int:
+        """Open connections up to ``count`` (default: the pool size) ahead of traffic.
+
+        Returns how many were opened. Each new connection also reads the
+        schema once, so the first queries on it don't pay for that.
+        """
+        count = self.size if count is None else min(count, self.size)
+        opened = []
+        while True:
+            with self._lock:
+                if self._created >= count:
+                    break
+                self._created += 1
+            try:
+                conn = self._connect()
+                conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                for conn in opened:
+                    self.release(conn)
+                raise
+            opened.append(conn)
+        for conn in opened:
+            self._idle.put(conn)
+        return len(opened)
+
+    def close(self) -> None:
+        """Close every idle connection; busy ones are closed on release"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+class Database:
+    """Runs blocking SQLite work off the event loop.
+
+    Every call is executed on a dedicated thread pool whose size is the
+    concurrency limit, using a connection borrowed from ``pool`` for the
+    duration of the call. Calls beyond the limit queue in the executor
+    instead of stalling the event loop. Time spent queued and time spent
+    executing are recorded per query name in the ``db_query_wait`` and
+    ``db_query_duration`` histograms.
+    """
+
+    def __init__(self, pool: ConnectionPool, max_concurrency: int = MAX_CONCURRENCY):
+        self.pool = pool
+        self.max_concurrency = max_concurrency
+        self._executor = self._new_executor()
+        self._closed = False
+
+    def _new_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="seatserve-db")
+
+    async def run(self, fn: Callable[..., Any], *args: Any, name: Optional[str] = None) -> Any:
+        """Run ``fn(conn, *args)`` on a worker thread and return its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self._call, fn, args, name or fn.__name__, time.perf_counter()
+        )
+
+    def _call(self, fn: Callable[..., Any], args: Tuple[Any, ...], name: str, submitted: float) -> Any:
+        started = time.perf_counter()
+        try:
+            with self.pool.connection() as conn:
+                return fn(conn, *args)
+        finally:
+            duration = time.perf_counter() - started
+            db_query_wait.labels(name).observe(started - submitted)
+            db_query_duration.labels(name).observe(duration)
+            if duration * 1000 >= SLOW_QUERY_MS:
+                logger.warning(f"🐢 Consulta lenta '{name}': {duration * 1000:.1f} ms")
+
+    async def fetchall(self, sql: str, params: Sequence[Any] = (), name: Optional[str] = None) -> List[tuple]:
+        """Run a read query and return every row"""
+        return await self.run(_fetchall, sql, params, name=name or sql)
+
+    async def fetchone(self, sql: str, params: Sequence[Any] = (), name: Optional[str] = None) -> Optional[tuple]:
+        """Run a read query and return the first row, if any"""
+        return await self.run(_fetchone, sql, params, name=name or sql)
+
+    async def execute(self, sql: str, params: Sequence[Any] = (), name: Optional[str] = None) -> Tuple[int, int]:
+        """Run a single write statement and commit; returns (lastrowid, rowcount)"""
+        return await self.run(_execute, sql, params, name=name or sql)
+
+    async def warm(self) -> int:
+        """Open every pooled connection before traffic arrives; returns how many were opened"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.pool.warm)
+
+    def open(self) -> None:
+        """Make the runner usable again after ``close()``, e.g. when the app restarts in-process"""
+        if self._closed:
+            self._executor = self._new_executor()
+            self._closed = False
+        self.pool.open()
+
+    def close(self) -> None:
+        """Wait for in-flight queries, then close pooled connections"""
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+
+def _fetchall(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> List[tuple]:
+    return conn.execute(sql, params).fetchall()
+
+
+def _fetchone(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> Optional[tuple]:
+    return conn.execute(sql, params).fetchone()
+
+
+def _execute(conn: sqlite3.Connection, sql: str, params: Sequence[Any]) -> Tuple[int, int]:
+    cursor = conn.execute(sql, params)
+    conn.commit()
+    return cursor.lastrowid, cursor.rowcount
+
+
+pool = ConnectionPool(DATABASE_PATH)
+db = Database(pool)
+
+
+def get_database() -> Database:
+    """FastAPI dependency returning the shared async database runner"""
+    return db
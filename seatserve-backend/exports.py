@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Exports
+Streaming NDJSON and CSV exports of orders and payments, read in keyset chunks
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import os
+import sqlite3
+
+from archive import attached_archive
+from orders import load_order_items
+from serialization import dumps
+
+# Rows read per query; memory use is bounded by one chunk, not the table size
+EXPORT_CHUNK_SIZE = int(os.getenv('SEATSERVE_EXPORT_CHUNK_SIZE', '1000'))
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+ORDER_COLUMNS = ("id", "table_number", "stand", "items", "subtotal", "tax", "total", "status", "timestamp", "paid_at")
+PAYMENT_COLUMNS = ("id", "order_id", "amount", "payment_method", "status", "transaction_id", "timestamp")
+
+# Last (timestamp, id) of the previous chunk
+After = Optional[Tuple[str, int]]
+
+
+def parse_bound(value: Optional[str]) -> Optional[str]:
+    """Normalize an ISO date or timestamp filter; raises ValueError"""
+    if value is None:
+        return None
+    return datetime.fromisoformat(value).isoformat()
+
+
+def _range_sql(since: Optional[str], until: Optional[str], after: After) -> Tuple[str, list]:
+    clauses, params = [], []
+    if since is not None:
+        clauses.append('timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('timestamp < ?')
+        params.append(until)
+    if after is not None:
+        clauses.append('(timestamp, id) > (?, ?)')
+        params.extend(after)
+    return (f"WHERE {' AND '.join(clauses)} " if clauses else ""), params
+
+
+@contextmanager
+def _reading_archive(conn: sqlite3.Connection, archive_path: Optional[str]) -> Iterator[bool]:
+    """Attach the archive, if there is one; yields whether it was attached"""
+    if archive_path is None or not os.path.exists(archive_path):
+        yield False
+        return
+    with attached_archive(conn, archive_path):
+        yield True
+
+
+def _chunk_rows(conn: sqlite3.Connection, table: str, columns: str, through_archive: bool,
+                since: Optional[str], until: Optional[str], after: After, limit: int) -> List[tuple]:
+    """One keyset page of ``table``, each row ending in an ``archived`` flag.
+
+    With the archive attached, the live and archived tables are merged in
+    (timestamp, id) order. Rows an interrupted archive batch left in both
+    files are read from the live copy.
+    """
+    where, params = _range_sql(since, until, after)
+    sql = f'SELECT {columns}, 0 AS archived FROM main.{table} {where}'
+    if through_archive:
+        sql += (
+            f'UNION ALL SELECT {columns}, 1 FROM archive.{table} {where + "AND" if where else "WHERE"} '
+            f'id NOT IN (SELECT id FROM main.{table}) '
+        )
+        params = params + params
+    return conn.execute(f'{sql}ORDER BY timestamp, id LIMIT ?', params + [limit]).fetchall()
+
+
+def fetch_orders_chunk(conn: sqlite3.Connection, since: Optional[str], until: Optional[str],
+                       after: After, limit: int, archive_path: Optional[str] = None) -> List[dict]:
+    with _reading_archive(conn, archive_path) as through_archive:
+        rows = _chunk_rows(
+            conn, "orders", "id, table_number, stand, subtotal, tax, total, status, timestamp, paid_at",
+            through_archive, since, until, after, limit
+        )
+        items = load_order_items(conn, [row[0] for row in rows if not row[9]])
+        if through_archive:
+            items.update(load_order_items(conn, [row[0] for row in rows if row[9]], schema="archive"))
+    return [
+        {"id": row[0], "table_number": row[1], "stand": row[2], "items": items[row[0]], "subtotal": row[3],
+         "tax": row[4], "total": row[5], "status": row[6], "timestamp": row[7], "paid_at": row[8]}
+        for row in rows
+    ]
+
+
+def fetch_payments_chunk(conn: sqlite3.Connection, since: Optional[str], until: Optional[str],
+                         after: After, limit: int, archive_path: Optional[str] = None) -> List[dict]:
+    with _reading_archive(conn, archive_path) as through_archive:
+        rows = _chunk_rows(conn, "payments", ", ".join(PAYMENT_COLUMNS), through_archive, since, until, after, limit)
+    return [dict(zip(PAYMENT_COLUMNS, row)) for row in rows]
+
+
+def _csv_value(value):
+    if isinstance(value, (list, dict)):
+        return dumps(value).decode()
+    return "" if value is None else value
+
+
+def _encode_csv(rows: List[dict], columns: Tuple[str, ...], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    writer.writerows([_csv_value(row[column]) for column in columns] for row in rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _encode_ndjson(rows: List[dict]) -> bytes:
+    return b"".join(dumps(row) + b"\n" for row in rows)
+
+
+EXPORTS: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {
+    "orders": (fetch_orders_chunk, ORDER_COLUMNS),
+    "payments": (fetch_payments_chunk, PAYMENT_COLUMNS),
+}
+
+
+async def stream_export(database, kind: str, fmt: str, since: Optional[str], until: Optional[str],
+                        chunk_size: int = EXPORT_CHUNK_SIZE,
+                        archive_path: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Yield an export of ``kind`` in ``fmt``, oldest first, one chunk per query.
+
+    Each chunk is a short keyset query on (timestamp, id), so no connection
+    or read transaction is held while the client downloads, and writers
+    are never blocked by a long export. Given ``archive_path``, archived
+    orders and payments are included too.
+    """
+    fetch, columns = EXPORTS[kind]
+    after: After = None
+    header = fmt == "csv"
+    while True:
+        rows = await database.run(fetch, since, until, after, chunk_size, archive_path, name=f"export_{kind}")
+        if rows or header:
+            yield _encode_csv(rows, columns, header) if fmt == "csv" else _encode_ndjson(rows)
+            header = False
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1]["timestamp"], rows[-1]["id"])
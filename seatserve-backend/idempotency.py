@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Idempotency
+Idempotency-Key support so client retries replay a request's first response
+"""
+
+from typing import Any, Awaitable, Callable, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+
+from database import Database, db
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# How long a key's response is kept
+IDEMPOTENCY_TTL = float(os.getenv('SEATSERVE_IDEMPOTENCY_TTL', '86400'))
+# How long a claim holds a key before a retry may take it over, in case
+# the process running the first request died
+IDEMPOTENCY_LEASE_SECONDS = float(os.getenv('SEATSERVE_IDEMPOTENCY_LEASE_SECONDS', '60'))
+# How often a duplicate checks whether the first request has finished
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv('SEATSERVE_IDEMPOTENCY_POLL_SECONDS', '0.05'))
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of a request payload, to spot a key reused for a different request"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def claim_key(conn: sqlite3.Connection, scope: str, key: str, request_fingerprint: str,
+              owner: str, lease: float) -> Optional[Tuple[str, int, Optional[str]]]:
+    """Claim (scope, key) for ``owner``, or return the existing row's (fingerprint, status code, response).
+
+    Expired rows, whether finished responses past their TTL or claims whose
+    lease ran out, are deleted first. Returns None if the claim was taken.
+    """
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM idempotency_keys WHERE expires_at <= ?', (now,))
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO idempotency_keys (scope, key, fingerprint, owner, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (scope, key, request_fingerprint, owner, now + lease))
+        row = None
+        if cursor.rowcount == 0:
+            row = conn.execute(
+                'SELECT fingerprint, status_code, response FROM idempotency_keys WHERE scope = ? AND key = ?',
+                (scope, key)
+            ).fetchone()
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return row
+
+
+def finish_key(conn: sqlite3.Connection, scope: str, key: str, owner: str,
+               status_code: Optional[int], response: Optional[str], ttl: float) -> None:
+    """Store the claimed key's response, or release the key when ``status_code`` is None"""
+    if status_code is None:
+        conn.execute('DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND owner = ?', (scope, key, owner))
+    else:
+        conn.execute('''
+            UPDATE idempotency_keys
+            SET owner = NULL, status_code = ?, response = ?, expires_at = ?
+            WHERE scope = ? AND key = ? AND owner = ?
+        ''', (status_code, response, time.time() + ttl, scope, key, owner))
+    conn.commit()
+
+
+class IdempotencyStore:
+    """Record of recent Idempotency-Key requests, kept in the database.
+
+    The first request for a key claims it with a unique insert and runs the
+    handler; duplicates that arrive while it is in flight wait for it, and
+    later duplicates get its stored response until the TTL runs out.
+    Successes and client errors (4xx) are stored; server errors release
+    the key so a retry can run again. Keys are scoped per endpoint and
+    shared by every worker process, across restarts.
+    """
+
+    def __init__(self, database: Database = db, ttl: float = IDEMPOTENCY_TTL,
+                 lease: float = IDEMPOTENCY_LEASE_SECONDS, poll_interval: float = IDEMPOTENCY_POLL_SECONDS):
+        self._db = database
+        self.ttl = ttl
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+    async def _finish(self, scope: str, key: str, owner: str, status_code: Optional[int] = None,
+                      body: Any = None) -> None:
+        response = None if status_code is None else json.dumps(body)
+        await self._db.run(finish_key, scope, key, owner, status_code, response, self.ttl, name="idempotency_finish")
+
+    async def run(
+        self,
+        scope: str,
+        key: Optional[str],
+        payload: Any,
+        response: Response,
+        handler: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """Run ``handler`` once per (scope, key) and replay its result to duplicates"""
+        if key is None:
+            return await handler()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters")
+
+        request_fingerprint = fingerprint(payload)
+        owner = uuid.uuid4().hex
+        while True:
+            existing = await self._db.run(
+                claim_key, scope, key, request_fingerprint, owner, self.lease, name="idempotency_claim"
+            )
+            if existing is None:
+                break
+            stored_fingerprint, status_code, stored = existing
+            if stored_fingerprint != request_fingerprint:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+                )
+            if status_code is None:
+                # Same request in flight, here or in another worker: wait, then look again
+                await asyncio.sleep(self.poll_interval)
+                continue
+            body = json.loads(stored)
+            if status_code >= 400:
+                headers = dict(body.get("headers") or {}, **{REPLAYED_HEADER: "true"})
+                raise HTTPException(status_code=status_code, detail=body["detail"], headers=headers)
+            response.headers[REPLAYED_HEADER] = "true"
+            return body
+
+        try:
+            result = await handler()
+        except HTTPException as e:
+            if e.status_code < 500:
+                await self._finish(scope, key, owner, e.status_code, {"detail": e.detail, "headers": e.headers})
+            else:
+                await self._finish(scope, key, owner)
+            raise
+        except BaseException:
+            await asyncio.shield(self._finish(scope, key, owner))
+            raise
+        # Store an encoded copy so later changes to the returned object can't leak into replays
+        await self._finish(scope, key, owner, 200, jsonable_encoder(result))
+        return result
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Kitchen Queue
+Per-stand priority queues of paid orders waiting to be prepared
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+
+from order_events import broker
+from orders import load_order_items
+from sales_rollups import PAID_STATUSES, record_paid
+
+DEFAULT_STAND = "main"
+STAND_PATTERN = r"^[a-z0-9][a-z0-9-]{0,63}$"
+
+# Prep estimate for a ticket: a fixed setup time plus time per item
+PREP_SECONDS_BASE = int(os.getenv('SEATSERVE_PREP_SECONDS_BASE', '60'))
+PREP_SECONDS_PER_ITEM = int(os.getenv('SEATSERVE_PREP_SECONDS_PER_ITEM', '30'))
+# Reload the queues from the database this often (0: never). Needed with
+# several worker processes, which don't see each other's paid orders.
+KITCHEN_REFRESH_SECONDS = float(os.getenv('SEATSERVE_KITCHEN_REFRESH_SECONDS', '0'))
+
+
+def prep_estimate(item_count: int) -> int:
+    return PREP_SECONDS_BASE + PREP_SECONDS_PER_ITEM * item_count
+
+
+@dataclass(frozen=True)
+class Ticket:
+    order_id: int
+    stand: str
+    table_number: int
+    paid_at: str
+    prep_seconds: int
+
+    @property
+    def ready_by(self) -> float:
+        """Earliest the order could be ready if started when paid (epoch seconds)"""
+        return datetime.fromisoformat(self.paid_at).timestamp() + self.prep_seconds
+
+    def to_dict(self) -> dict:
+        return {
+            "order_id": self.order_id,
+            "stand": self.stand,
+            "table_number": self.table_number,
+            "paid_at": self.paid_at,
+            "prep_seconds": self.prep_seconds,
+        }
+
+
+class StandQueue:
+    """Binary heap of one stand's waiting tickets plus the tickets being made.
+
+    Tickets are ordered by ready-by time (paid time + prep estimate), so
+    quick orders are not stuck behind large ones paid moments earlier,
+    while older orders still rise to the top as time passes. Removal is
+    lazy: entries are marked dead and skipped when they reach the top.
+    """
+
+    def __init__(self):
+        self._heap: List[list] = []
+        self._entries: Dict[int, list] = {}
+        self.in_progress: Dict[int, Ticket] = {}
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._entries or order_id in self.in_progress
+
+    def push(self, ticket: Ticket) -> None:
+        entry = [ticket.ready_by, next(self._seq), ticket]
+        self._entries[ticket.order_id] = entry
+        heapq.heappush(self._heap, entry)
+
+    def pop(self) -> Optional[Ticket]:
+        while self._heap:
+            _, _, ticket = heapq.heappop(self._heap)
+            if ticket is not None:
+                del self._entries[ticket.order_id]
+                return ticket
+        return None
+
+    def remove(self, order_id: int) -> Optional[Ticket]:
+        entry = self._entries.pop(order_id, None)
+        if entry is None:
+            return None
+        ticket, entry[2] = entry[2], None
+        return ticket
+
+    def waiting(self, limit: int) -> List[Ticket]:
+        return [entry[2] for entry in heapq.nsmallest(limit, self._entries.values())]
+
+
+class KitchenQueues:
+    """Process-local work queues for every stand.
+
+    Paid orders are added as ``order.paid`` events are published, and the
+    queues are rebuilt from the database at startup. Claiming the next
+    ticket and completing one are O(log n) and O(1).
+    """
+
+    def __init__(self):
+        self._stands: Dict[str, StandQueue] = {DEFAULT_STAND: StandQueue()}
+        self._lock = threading.Lock()
+
+    def _stand(self, stand: str, create: bool = False) -> StandQueue:
+        # Only paid orders add stands; lookups for other names get a
+        # throwaway empty queue, so they can't grow the table
+        queue = self._stands.get(stand)
+        if queue is None:
+            queue = StandQueue()
+            if create:
+                self._stands[stand] = queue
+        return queue
+
+    def has_stand(self, stand: str) -> bool:
+        """Whether any paid order has been queued at ``stand``"""
+        return stand in self._stands
+
+    def add(self, ticket: Ticket) -> bool:
+        """Queue a paid order; False if its stand already has it"""
+        with self._lock:
+            queue = self._stand(ticket.stand, create=True)
+            if ticket.order_id in queue:
+                return False
+            queue.push(ticket)
+            return True
+
+    def claim(self, stand: str) -> Optional[Ticket]:
+        """Take the stand's highest-priority ticket and mark it in progress"""
+        with self._lock:
+            queue = self._stand(stand)
+            ticket = queue.pop()
+            if ticket is not None:
+                queue.in_progress[ticket.order_id] = ticket
+            return ticket
+
+    def started(self, stand: str, order_id: int) -> None:
+        """Move a waiting ticket to in progress, after a claim made by another worker"""
+        with self._lock:
+            queue = self._stand(stand)
+            ticket = queue.remove(order_id)
+            if ticket is not None:
+                queue.in_progress[order_id] = ticket
+
+    def unclaim(self, ticket: Ticket) -> None:
+        """Put a claimed ticket back, e.g. when recording the claim failed"""
+        with self._lock:
+            queue = self._stand(ticket.stand)
+            if queue.in_progress.pop(ticket.order_id, None) is not None:
+                queue.push(ticket)
+
+    def discard(self, stand: str, order_id: int) -> None:
+        """Forget a ticket that is no longer waiting or in progress"""
+        with self._lock:
+            queue = self._stand(stand)
+            queue.remove(order_id)
+            queue.in_progress.pop(order_id, None)
+
+    def in_progress(self, stand: str, order_id: int) -> Optional[Ticket]:
+        with self._lock:
+            return self._stand(stand).in_progress.get(order_id)
+
+    def complete(self, stand: str, order_id: int) -> Optional[Ticket]:
+        with self._lock:
+            return self._stand(stand).in_progress.pop(order_id, None)
+
+    def snapshot(self, stand: str, limit: int) -> dict:
+        with self._lock:
+            queue = self._stand(stand)
+            return {
+                "stand": stand,
+                "waiting": len(queue),
+                "queue": [ticket.to_dict() for ticket in queue.waiting(limit)],
+                "in_progress": [ticket.to_dict() for ticket in queue.in_progress.values()],
+            }
+
+    def rebuild(self, rows: List[tuple]) -> int:
+        """Replace every queue with open orders loaded by ``load_open_tickets``
+
+        Stands seen before stay known, with empty queues if nothing is open.
+        """
+        stands: Dict[str, StandQueue] = {}
+        for order_id, stand, table_number, paid_at, status, item_count in rows:
+            ticket = Ticket(order_id, stand, table_number, paid_at, prep_estimate(item_count))
+            queue = stands.get(stand)
+            if queue is None:
+                queue = stands[stand] = StandQueue()
+            if status == "preparing":
+                queue.in_progress[order_id] = ticket
+            else:
+                queue.push(ticket)
+        with self._lock:
+            for name in self._stands:
+                stands.setdefault(name, StandQueue())
+            self._stands = stands
+        return len(rows)
+
+    def on_event(self, event: dict) -> None:
+        """Broker listener: queue orders as they are paid, and follow claims and completions.
+
+        Claims and completions made in this process have already updated
+        the queues; the events matter for the ones relayed from other workers.
+        """
+        if event["type"] == "order.paid" and event["status"] == "paid" and event.get("paid_at"):
+            self.add(Ticket(
+                event["order_id"], event["stand"], event["table_number"],
+                event["paid_at"], event["prep_seconds"],
+            ))
+        elif event["type"] == "order.preparing" and event.get("stand"):
+            self.started(event["stand"], event["order_id"])
+        elif event["type"] == "order.ready" and event.get("stand"):
+            self.discard(event["stand"], event["order_id"])
+
+
+def _item_count(conn: sqlite3.Connection, order_id: int) -> int:
+    return conn.execute(
+        'SELECT COALESCE(SUM(qty), 0) FROM order_items WHERE order_id = ?', (order_id,)
+    ).fetchone()[0]
+
+
+def mark_paid(conn: sqlite3.Connection, order_id: int) -> Optional[dict]:
+    """Mark an order paid inside the caller's transaction.
+
+    Returns the order's event fields (table_number, status, stand, paid_at,
+    prep_seconds), or None if the order does not exist. Orders already
+    being prepared or ready keep their status. The first time an order is
+    paid it is also counted in the sales rollups.
+    """
+    row = conn.execute(
+        'SELECT table_number, status, stand, paid_at FROM orders WHERE id = ?', (order_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    table_number, status, stand, paid_at = row
+    if status not in ('preparing', 'ready'):
+        paid_at = paid_at or datetime.now().isoformat()
+        conn.execute("UPDATE orders SET status = 'paid', paid_at = ? WHERE id = ?", (paid_at, order_id))
+        if status not in PAID_STATUSES:
+            record_paid(conn, order_id, table_number, paid_at)
+        status = 'paid'
+    return {
+        "table_number": table_number,
+        "status": status,
+        "stand": stand,
+        "paid_at": paid_at,
+        "prep_seconds": prep_estimate(_item_count(conn, order_id)),
+    }
+
+
+def load_open_tickets(conn: sqlite3.Connection) -> List[tuple]:
+    """Paid and in-progress orders, for rebuilding the queues at startup"""
+    return conn.execute('''
+        SELECT o.id, o.stand, o.table_number, o.paid_at, o.status,
+               COALESCE((SELECT SUM(qty) FROM order_items i WHERE i.order_id = o.id), 0)
+        FROM orders o
+        WHERE o.status IN ('paid', 'preparing') AND o.paid_at IS NOT NULL
+    ''').fetchall()
+
+
+def load_preparing_ticket(conn: sqlite3.Connection, stand: str, order_id: int) -> Optional[Ticket]:
+    """The ticket for an order being prepared at ``stand``, whichever worker claimed it"""
+    row = conn.execute(
+        "SELECT table_number, paid_at FROM orders WHERE id = ? AND stand = ? AND status = 'preparing'",
+        (order_id, stand)
+    ).fetchone()
+    if row is None:
+        return None
+    return Ticket(order_id, stand, row[0], row[1], prep_estimate(_item_count(conn, order_id)))
+
+
+def start_order(conn: sqlite3.Connection, order_id: int) -> Optional[List[dict]]:
+    """Record a claim; returns the order's items, or None if it is no longer paid"""
+    cursor = conn.execute(
+        "UPDATE orders SET status = 'preparing' WHERE id = ? AND status = 'paid'", (order_id,)
+    )
+    if cursor.rowcount == 0:
+        conn.rollback()
+        return None
+    items = load_order_items(conn, [order_id])[order_id]
+    conn.commit()
+    return items
+
+
+def finish_order(conn: sqlite3.Connection, order_id: int) -> bool:
+    cursor = conn.execute(
+        "UPDATE orders SET status = 'ready' WHERE id = ? AND status = 'preparing'", (order_id,)
+    )
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+kitchen = KitchenQueues()
+broker.add_listener(kitchen.on_event)
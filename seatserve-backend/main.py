@@ -4,18 +4,23 @@ SeatServe Backend - Main Application Entry Point
 Restaurant table service management system
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Depends, Header, Path, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
-from fastapi.responses import JSONResponse, HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from contextlib import asynccontextmanager
 from typing import List, Optional
 import sqlite3
 import json
-from datetime import datetime
+import base64
+import csv
+import io
+from datetime import datetime, timedelta
 import uvicorn
 import logging
+import time
+import asyncio
 import stripe
 import os
 from dotenv import load_dotenv
@@ -23,17 +28,47 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+from database import pool, db, Database, get_database
+from migrate import upgrade as upgrade_schema
+from menu_cache import menu_cache, conditional_response
+from serialization import RowsResponse
+from exports import EXPORT_FORMATS, parse_bound, stream_export
+from archive import order_archive, archive_worker, ARCHIVE_AFTER_HOURS
+from pricing import PricingError, price_order, tax_rules
+from table_index import table_index
+from kitchen import kitchen, KITCHEN_REFRESH_SECONDS, DEFAULT_STAND, STAND_PATTERN, load_open_tickets, load_preparing_ticket, start_order, finish_order
+from sales_rollups import REPORTS, record_order, report_range, load_report
+from orders import insert_order_items, load_order_items
+from metrics import registry, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE, monitor_event_loop
+from order_events import broker, event_relay, event_stream, order_topic, table_topic
+from idempotency import idempotency_store, IDEMPOTENCY_HEADER, REPLAYED_HEADER
+from payment_gateway import PaymentGateway, GatewayError, gateway, get_payment_gateway
+from reconciliation import Reconciler, RECONCILE_LOOKBACK_HOURS
+from payments import order_total_cents, settle_payment
+from webhook_inbox import webhook_worker, enqueue_event, requeue_events
+from request_logging import RequestLoggingMiddleware, start_queue_logging, stop_queue_logging
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+start_queue_logging()
 
 # Configure Stripe
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY', '')
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up before the server accepts connections; drain on shutdown"""
+    await startup(app)
+    try:
+        yield
+    finally:
+        await shutdown(app)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="SeatServe API",
@@ -48,7 +83,8 @@ app = FastAPI(
     - Real-time updates
     """,
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan,
 )
 
 # Configure CORS
@@ -58,33 +94,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", REPLAYED_HEADER],
 )
 
-# Middleware para logging de todas las peticiones
-
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Log de petición entrante
-        logger.info(f"📨 [{request.method}] {request.url.path}")
-        
-        # Capturar body si existe
-        if request.method in ["POST", "PUT"]:
-            try:
-                body = await request.body()
-                if body:
-                    logger.info(f"📦 Body recibido: {body.decode()}")
-                # Recrear el stream para que FastAPI lo pueda leer
-                async def receive():
-                    return {"type": "http.request", "body": body}
-                request._receive = receive
-            except Exception as e:
-                logger.error(f"Error leyendo body: {e}")
-        
-        response = await call_next(request)
-        logger.info(f"✅ Respuesta enviada: {response.status_code}")
-        return response
+# Middleware para logging de todas las peticiones (ASGI puro, sin buffer del body)
+app.add_middleware(RequestLoggingMiddleware)
 
-app.add_middleware(LoggingMiddleware)
+# Metricas de latencia por ruta (ASGI puro, contadores pre-asignados)
+app.add_middleware(MetricsMiddleware)
 
 # Pydantic models
 class MenuItem(BaseModel):
@@ -98,8 +115,12 @@ class MenuItem(BaseModel):
 class Order(BaseModel):
     id: Optional[int] = None
     table_number: int
+    stand: str = Field(DEFAULT_STAND, pattern=STAND_PATTERN)  # concession preparing the order
     items: List[dict]
-    total: float
+    # Priced by the server from the menu; client-sent amounts are ignored
+    subtotal: Optional[float] = None
+    tax: Optional[float] = None
+    total: Optional[float] = None
     status: str = "pending"
     timestamp: Optional[str] = None
 
@@ -124,58 +145,20 @@ class StripePaymentIntent(BaseModel):
 
 # Database initialization
 def init_db():
-    """Initialize SQLite database with sample data"""
-    conn = sqlite3.connect('seatserve.db')
+    """Migrate the database to the latest schema and add sample data.
+
+    Schema changes are Alembic revisions in migrations/ (see migrate.py).
+    """
+    upgrade_schema(pool.path)
+    with pool.connection() as conn:
+        _insert_sample_data(conn)
+
+
+def _insert_sample_data(conn: sqlite3.Connection):
+    # Hold the write lock throughout, so workers starting together seed once
+    conn.execute('BEGIN IMMEDIATE')
     cursor = conn.cursor()
     
-    # Create menu table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS menu_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            description TEXT,
-            price REAL NOT NULL,
-            category TEXT NOT NULL,
-            available BOOLEAN DEFAULT 1
-        )
-    ''')
-    
-    # Create orders table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            table_number INTEGER NOT NULL,
-            items TEXT NOT NULL,
-            total REAL NOT NULL,
-            status TEXT DEFAULT 'pending',
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Create tables table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS restaurant_tables (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            number INTEGER UNIQUE NOT NULL,
-            seats INTEGER NOT NULL,
-            status TEXT DEFAULT 'available'
-        )
-    ''')
-    
-    # Create payments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS payments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
-            amount REAL NOT NULL,
-            payment_method TEXT DEFAULT 'card',
-            status TEXT DEFAULT 'pending',
-            transaction_id TEXT,
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (order_id) REFERENCES orders(id)
-        )
-    ''')
-    
     # Insert sample menu items if table is empty
     cursor.execute('SELECT COUNT(*) FROM menu_items')
     if cursor.fetchone()[0] == 0:
@@ -207,7 +190,6 @@ def init_db():
         )
     
     conn.commit()
-    conn.close()
 
 # Root endpoint
 @app.get("/", response_class=HTMLResponse)
@@ -293,63 +275,53 @@ async def health_check():
         "timestamp": datetime.now().isoformat()
     }
 
+# Readiness endpoint
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: 503 until startup has warmed the caches, and again once shutdown starts"""
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "not_ready"})
+    return {"status": "ready", "startup_ms": app.state.startup_ms}
+
+# Metrics endpoint
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus-format request, database, Stripe and event loop metrics"""
+    return Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
 # Menu endpoints
 @app.get("/api/menu", response_model=List[MenuItem])
-async def get_menu():
+async def get_menu(request: Request):
     """Get all menu items"""
     logger.info("📋 Obteniendo menú")
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM menu_items WHERE available = 1')
-        items = cursor.fetchall()
-        conn.close()
-        
-        menu_items = []
-        for item in items:
-            menu_items.append(MenuItem(
-                id=item[0],
-                name=item[1],
-                description=item[2],
-                price=item[3],
-                category=item[4],
-                available=bool(item[5])
-            ))
-        
-        logger.info(f"✅ Menú obtenido: {len(menu_items)} items encontrados")
-        return menu_items
+        snapshot = await menu_cache.get()
+        logger.info(f"✅ Menú obtenido: {len(snapshot.items)} items encontrados (versión {snapshot.version})")
+        return conditional_response(request, snapshot.menu_body, snapshot.menu_etag)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching menu: {str(e)}")
 
 @app.get("/api/menu/categories")
-async def get_menu_categories():
+async def get_menu_categories(request: Request):
     """Get all menu categories"""
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT DISTINCT category FROM menu_items')
-        categories = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return {"categories": categories}
+        snapshot = await menu_cache.get()
+        return conditional_response(request, snapshot.categories_body, snapshot.categories_etag)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching categories: {str(e)}")
 
 @app.post("/api/menu", response_model=MenuItem)
-async def create_menu_item(item: MenuItem):
+async def create_menu_item(item: MenuItem, db: Database = Depends(get_database)):
     """Create a new menu item"""
     logger.info(f"🍽️ Nuevo item de menú recibido: {item.name} - ${item.price}")
     logger.debug(f"Datos completos: {item.dict()}")
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('''
+        item_id, _ = await db.execute('''
             INSERT INTO menu_items (name, description, price, category, available)
             VALUES (?, ?, ?, ?, ?)
-        ''', (item.name, item.description, item.price, item.category, item.available))
+        ''', (item.name, item.description, item.price, item.category, item.available), name="create_menu_item")
         
-        item_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        menu_cache.invalidate()
         
         item.id = item_id
         logger.info(f"✅ Item de menú creado con ID: {item_id}")
@@ -357,208 +329,721 @@ async def create_menu_item(item: MenuItem):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error creating menu item: {str(e)}")
 
+MENU_BULK_MAX_ITEMS = 5000
+
+def _parse_menu_csv(body: bytes) -> List[dict]:
+    reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+    rows = []
+    for row in reader:
+        item = {key.strip(): (value or "").strip() for key, value in row.items() if key}
+        # Blank optional cells fall back to the model defaults
+        for key in ("id", "available"):
+            if not item.get(key):
+                item.pop(key, None)
+        rows.append(item)
+    return rows
+
+def _upsert_menu_items(conn: sqlite3.Connection, items: List[MenuItem]):
+    # Take the write lock up front so the existence check and the writes
+    # see the same snapshot of menu_items
+    conn.execute('BEGIN IMMEDIATE')
+    existing = {
+        (name, category): item_id
+        for item_id, name, category in conn.execute(
+            'SELECT id, name, category FROM menu_items ORDER BY id DESC'
+        )
+    }
+    updates = []
+    inserts = []
+    for item in items:
+        values = (item.description, item.price, item.available)
+        item_id = existing.get((item.name, item.category))
+        if item_id is None:
+            inserts.append((item.name, item.category) + values)
+        else:
+            updates.append(values + (item_id,))
+    
+    conn.executemany(
+        'UPDATE menu_items SET description = ?, price = ?, available = ? WHERE id = ?',
+        updates
+    )
+    conn.executemany('''
+        INSERT INTO menu_items (name, category, description, price, available)
+        VALUES (?, ?, ?, ?, ?)
+    ''', inserts)
+    conn.commit()
+    return len(inserts), len(updates)
+
+@app.post(
+    "/api/menu/bulk",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": {"$ref": "#/components/schemas/MenuItem"}}
+                },
+                "text/csv": {
+                    "schema": {"type": "string"},
+                    "example": "name,description,price,category,available\nNachos,Cheese nachos,6.5,Snacks,true\n"
+                },
+            },
+        }
+    },
+)
+async def bulk_upsert_menu_items(request: Request, db: Database = Depends(get_database)):
+    """Create or update many menu items in one transaction.
+    
+    Accepts a JSON array of menu items or a CSV file with a header row
+    (name, description, price, category, available). Items are matched on
+    name and category: existing ones are updated, the rest are created.
+    """
+    content_type = request.headers.get("content-type", "")
+    body = await request.body()
+    try:
+        if "csv" in content_type:
+            raw_items = _parse_menu_csv(body)
+        else:
+            raw_items = json.loads(body)
+            if not isinstance(raw_items, list):
+                raise ValueError("Expected a JSON array of menu items")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid menu payload: {str(e)}")
+    
+    if len(raw_items) > MENU_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MENU_BULK_MAX_ITEMS} items per request")
+    
+    try:
+        parsed = [MenuItem.model_validate(raw) for raw in raw_items]
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False))
+    
+    # Later rows win when the same item appears twice in one upload
+    items = list({(item.name, item.category): item for item in parsed}.values())
+    logger.info(f"🍽️ Carga masiva de menú recibida: {len(items)} items")
+    
+    try:
+        created, updated = await db.run(_upsert_menu_items, items)
+        menu_cache.invalidate()
+        
+        logger.info(f"✅ Menú actualizado: {created} creados, {updated} actualizados")
+        return {"created": created, "updated": updated, "total": created + updated}
+    except Exception as e:
+        logger.error(f"❌ Error en carga masiva de menú: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error importing menu items: {str(e)}")
+
 # Order endpoints
+ORDERS_PAGE_SIZE = 50
+ORDERS_MAX_PAGE_SIZE = 200
+
+def _encode_cursor(timestamp: str, order_id: int) -> str:
+    raw = json.dumps([timestamp, order_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, order_id = json.loads(raw)
+        if not isinstance(timestamp, str) or not isinstance(order_id, int):
+            raise ValueError
+        return timestamp, order_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _fetch_orders_page(conn: sqlite3.Connection, sql: str, params: list, limit: int):
+    rows = conn.execute(sql, params).fetchall()
+    return rows, load_order_items(conn, [row[0] for row in rows[:limit]])
+
+# List endpoints return plain dicts; keys and types must match the response_model
+def _order_json(row: tuple, items: List[dict]) -> dict:
+    return {
+        "id": row[0], "table_number": row[1], "stand": row[2], "items": items, "subtotal": row[3],
+        "tax": row[4], "total": row[5], "status": row[6], "timestamp": row[7]
+    }
+
 @app.get("/api/orders", response_model=List[Order])
-async def get_orders():
-    """Get all orders"""
+async def get_orders(
+    limit: int = Query(ORDERS_PAGE_SIZE, ge=1, le=ORDERS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    table_number: Optional[int] = None,
+    db: Database = Depends(get_database)
+):
+    """Get orders, newest first, one page at a time.
+    
+    Pass the X-Next-Cursor header from the previous response as ``cursor``
+    to fetch the following page; it is absent on the last page.
+    """
     logger.info("📦 Obteniendo ordenes")
+    clauses = []
+    params = []
+    if status is not None:
+        clauses.append('status = ?')
+        params.append(status)
+    if table_number is not None:
+        clauses.append('table_number = ?')
+        params.append(table_number)
+    if cursor is not None:
+        clauses.append('(timestamp, id) < (?, ?)')
+        params.extend(_decode_cursor(cursor))
+    
+    where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+    # One extra row tells us whether another page exists
+    params.append(limit + 1)
+    
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM orders ORDER BY timestamp DESC')
-        orders_data = cursor.fetchall()
-        conn.close()
+        orders_data, items_by_order = await db.run(
+            _fetch_orders_page,
+            f'SELECT id, table_number, stand, subtotal, tax, total, status, timestamp FROM orders '
+            f'{where}ORDER BY timestamp DESC, id DESC LIMIT ?',
+            params, limit,
+            name="get_orders"
+        )
         
-        orders = []
-        for order_data in orders_data:
-            orders.append(Order(
-                id=order_data[0],
-                table_number=order_data[1],
-                items=json.loads(order_data[2]),
-                total=order_data[3],
-                status=order_data[4],
-                timestamp=order_data[5]
-            ))
+        orders = [_order_json(row, items_by_order[row[0]]) for row in orders_data[:limit]]
+        response = RowsResponse(orders)
+        
+        if len(orders_data) > limit:
+            last = orders[-1]
+            response.headers["X-Next-Cursor"] = _encode_cursor(last["timestamp"], last["id"])
         
         logger.info(f"✅ Ordenes obtenidas: {len(orders)} ordenes encontradas")
-        return orders
+        return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching orders: {str(e)}")
 
+def _insert_order(conn: sqlite3.Connection, order: Order, timestamp: str) -> int:
+    cursor = conn.execute('''
+        INSERT INTO orders (table_number, stand, subtotal, tax, total, status, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (order.table_number, order.stand, order.subtotal, order.tax, order.total, order.status, timestamp))
+    order_id = cursor.lastrowid
+    insert_order_items(conn, order_id, order.items)
+    record_order(conn, order_id, order.table_number, timestamp)
+    conn.commit()
+    return order_id
+
 @app.post("/api/orders", response_model=Order)
-async def create_order(order: Order):
-    """Create a new order"""
-    logger.info(f"🛎️ Nueva orden recibida - Mesa: {order.table_number}, Total: ${order.total}")
+async def create_order(
+    order: Order,
+    response: Response,
+    db: Database = Depends(get_database),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
+):
+    """Create a new order.
+    
+    Items are priced from the menu: each needs the ``id`` of an available
+    menu item and a ``qty``. Subtotal, tax and total are computed here;
+    amounts sent by the client are ignored. Retries sent with the same
+    Idempotency-Key get the original order back instead of creating a
+    duplicate ticket.
+    """
+    logger.info(f"🛎️ Nueva orden recibida - Mesa: {order.table_number}")
     logger.info(f"📋 Items en la orden: {order.items}")
     logger.debug(f"Datos completos de la orden: {order.dict()}")
-    try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        
-        items_json = json.dumps(order.items)
-        timestamp = datetime.now().isoformat()
-        
-        cursor.execute('''
-            INSERT INTO orders (table_number, items, total, status, timestamp)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (order.table_number, items_json, order.total, order.status, timestamp))
+    
+    async def insert():
+        snapshot = await menu_cache.get()
+        try:
+            priced = price_order(snapshot.prices, order.items, tax_rules)
+        except PricingError as e:
+            logger.warning(f"⚠️ Orden rechazada: {e.detail}")
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
         
-        order_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        client_total = order.total
+        order.items = priced.items
+        order.subtotal = float(priced.subtotal)
+        order.tax = float(priced.tax)
+        order.total = float(priced.total)
+        if client_total is not None and abs(client_total - order.total) >= 0.005:
+            logger.warning(f"⚠️ Total del cliente ${client_total} reemplazado por ${order.total}")
         
-        order.id = order_id
-        order.timestamp = timestamp
-        logger.info(f"✅ Orden creada con ID: {order_id} a las {timestamp}")
-        return order
+        try:
+            timestamp = datetime.now().isoformat()
+            
+            order_id = await db.run(_insert_order, order, timestamp, name="create_order")
+            
+            order.id = order_id
+            order.timestamp = timestamp
+            broker.publish("order.created", order_id, order.table_number, order.status)
+            logger.info(f"✅ Orden creada con ID: {order_id} a las {timestamp} - Total: ${order.total}")
+            return order
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error creating order: {str(e)}")
+    
+    return await idempotency_store.run("create_order", idempotency_key, order, response, insert)
+
+# Streaming exports
+def _export_response(kind: str, format: str, since: Optional[str], until: Optional[str], db: Database):
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of: {list(EXPORT_FORMATS)}")
+    try:
+        since, until = parse_bound(since), parse_bound(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since and until must be ISO dates or timestamps")
+    
+    logger.info(f"📤 Exportando {kind} en formato {format}")
+    extension = "csv" if format == "csv" else "ndjson"
+    return StreamingResponse(
+        stream_export(db, kind, format, since, until, archive_path=order_archive.path),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="seatserve-{kind}.{extension}"'}
+    )
+
+@app.get("/api/orders/export")
+async def export_orders(
+    format: str = "ndjson",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    db: Database = Depends(get_database)
+):
+    """Stream every order placed in [since, until) as NDJSON or CSV, oldest first"""
+    return _export_response("orders", format, since, until, db)
+
+@app.get("/api/payments/export")
+async def export_payments(
+    format: str = "ndjson",
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    db: Database = Depends(get_database)
+):
+    """Stream every payment made in [since, until) as NDJSON or CSV, oldest first"""
+    return _export_response("payments", format, since, until, db)
+
+# Lookups by id read through to the archive for orders moved out of the live database
+@app.get("/api/orders/{order_id}", response_model=Order)
+async def get_order(order_id: int):
+    """Get one order, including archived orders"""
+    try:
+        found = await order_archive.get_order(order_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching order: {str(e)}")
+    if found is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    row, items = found
+    return RowsResponse(_order_json(row, items))
+
+@app.get("/api/payments/{payment_id}", response_model=Payment)
+async def get_payment(payment_id: int):
+    """Get one payment, including payments of archived orders"""
+    try:
+        row = await order_archive.get_payment(payment_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching payment: {str(e)}")
+    if row is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    return RowsResponse({
+        "id": row[0], "order_id": row[1], "amount": row[2], "payment_method": row[3],
+        "status": row[4], "transaction_id": row[5], "timestamp": row[6]
+    })
+
+class ArchiveRun(BaseModel):
+    older_than_hours: float = Field(ARCHIVE_AFTER_HOURS, ge=0)
+
+@app.post("/api/archive/run")
+async def run_archive(run: ArchiveRun):
+    """Move closed orders older than ``older_than_hours`` (and their payments) to the archive now"""
+    logger.info(f"🗄️ Archivando ordenes de hace mas de {run.older_than_hours} horas")
+    try:
+        archived = await order_archive.run(run.older_than_hours)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating order: {str(e)}")
+        logger.error(f"❌ Error archivando ordenes: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error archiving orders: {str(e)}")
+    logger.info(f"✅ Ordenes archivadas: {archived}")
+    return {"archived": archived}
+
+# Order status streams (Server-Sent Events)
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+@app.get("/api/orders/{order_id}/events")
+async def stream_order_events(order_id: int, db: Database = Depends(get_database)):
+    """Stream status changes for one order as Server-Sent Events.
+    
+    The first event is the order's current status; later events are pushed
+    as payments are confirmed or rejected and the order moves along.
+    """
+    # Subscribe before reading the current state so no change slips between
+    subscription = broker.subscribe(order_topic(order_id))
+    try:
+        row = await db.fetchone(
+            'SELECT table_number, status FROM orders WHERE id = ?', (order_id,),
+            name="stream_order_events"
+        )
+        if row is None:
+            found = await order_archive.get_order(order_id)
+            row = (found[0][1], found[0][6]) if found is not None else None
+    except Exception:
+        broker.unsubscribe(subscription)
+        raise
+    if row is None:
+        broker.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    initial = {"id": 0, "type": "order.snapshot", "order_id": order_id, "table_number": row[0], "status": row[1]}
+    logger.info(f"📡 Cliente suscrito a la orden {order_id}")
+    return StreamingResponse(event_stream(subscription, initial), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/api/tables/{table_number}/events")
+async def stream_table_events(table_number: int):
+    """Stream status changes for every order at one table as Server-Sent Events"""
+    subscription = broker.subscribe(table_topic(table_number))
+    logger.info(f"📡 Cliente suscrito a la mesa {table_number}")
+    return StreamingResponse(event_stream(subscription), media_type="text/event-stream", headers=SSE_HEADERS)
+
+# Kitchen endpoints
+KITCHEN_QUEUE_LIMIT = 50
+
+def kitchen_stand(stand: str = Path(..., pattern=STAND_PATTERN)) -> str:
+    """Path stand name, 404 unless the kitchen has queued orders there"""
+    if not kitchen.has_stand(stand):
+        raise HTTPException(status_code=404, detail=f"Unknown stand: {stand}")
+    return stand
+
+@app.get("/api/kitchen/{stand}/queue")
+async def get_kitchen_queue(stand: str = Depends(kitchen_stand), limit: int = Query(KITCHEN_QUEUE_LIMIT, ge=1, le=500)):
+    """Paid orders waiting at a stand, next ticket first, plus the ones being made.
+    
+    Served from the stand's in-memory queue; no database access.
+    """
+    return kitchen.snapshot(stand, limit)
+
+@app.post("/api/kitchen/{stand}/claim")
+async def claim_kitchen_order(stand: str = Depends(kitchen_stand), db: Database = Depends(get_database)):
+    """Take the stand's next ticket and start preparing it (204 if nothing is waiting)"""
+    while True:
+        ticket = kitchen.claim(stand)
+        if ticket is None:
+            return Response(status_code=204)
+        try:
+            items = await db.run(start_order, ticket.order_id, name="claim_order")
+        except Exception as e:
+            kitchen.unclaim(ticket)
+            logger.error(f"❌ Error reclamando orden {ticket.order_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error claiming order: {str(e)}")
+        if items is not None:
+            break
+        # Changed since it was queued (e.g. cancelled); drop it and try the next one
+        kitchen.discard(stand, ticket.order_id)
+    
+    broker.publish("order.preparing", ticket.order_id, ticket.table_number, "preparing", stand=stand)
+    logger.info(f"👨‍🍳 Orden {ticket.order_id} en preparación en {stand}")
+    return {**ticket.to_dict(), "status": "preparing", "items": items}
+
+@app.post("/api/kitchen/{stand}/orders/{order_id}/complete")
+async def complete_kitchen_order(order_id: int, stand: str = Depends(kitchen_stand),
+                                 db: Database = Depends(get_database)):
+    """Mark a claimed order ready for pickup (409 if it is no longer being prepared)"""
+    ticket = kitchen.in_progress(stand, order_id)
+    if ticket is None:
+        # Claimed through another worker, whose event may not have arrived yet
+        ticket = await db.run(load_preparing_ticket, stand, order_id, name="load_preparing_ticket")
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Order is not being prepared at this stand")
+    try:
+        finished = await db.run(finish_order, order_id, name="complete_order")
+    except Exception as e:
+        logger.error(f"❌ Error completando orden {order_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error completing order: {str(e)}")
+    kitchen.complete(stand, order_id)
+    if not finished:
+        # Changed since it was claimed (e.g. cancelled, or completed through another worker)
+        logger.warning(f"⚠️ Orden {order_id} ya no estaba en preparación en {stand}")
+        raise HTTPException(status_code=409, detail="Order is no longer being prepared")
+    
+    broker.publish("order.ready", order_id, ticket.table_number, "ready", stand=stand)
+    logger.info(f"✅ Orden {order_id} lista en {stand}")
+    return {**ticket.to_dict(), "status": "ready"}
 
 # Table endpoints
 @app.get("/api/tables", response_model=List[Table])
-async def get_tables():
+async def get_tables(db: Database = Depends(get_database)):
     """Get all restaurant tables"""
     logger.info("🪑 Obteniendo mesas del restaurante")
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM restaurant_tables ORDER BY number')
-        tables_data = cursor.fetchall()
-        conn.close()
+        tables_data = await db.fetchall(
+            'SELECT id, number, seats, status FROM restaurant_tables ORDER BY number', name="get_tables"
+        )
         
-        tables = []
-        for table_data in tables_data:
-            tables.append(Table(
-                id=table_data[0],
-                number=table_data[1],
-                seats=table_data[2],
-                status=table_data[3]
-            ))
+        tables = [
+            {"id": row[0], "number": row[1], "seats": row[2], "status": row[3]}
+            for row in tables_data
+        ]
         
         logger.info(f"✅ Mesas obtenidas: {len(tables)} mesas encontradas")
-        return tables
+        return RowsResponse(tables)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching tables: {str(e)}")
 
+@app.get("/api/tables/available", response_model=List[Table])
+async def get_available_tables(
+    party_size: int = Query(..., ge=1),
+    limit: int = Query(20, ge=1, le=500)
+):
+    """Available tables that seat ``party_size``, smallest fitting tables first.
+    
+    Served from the in-memory table index, so the cost doesn't grow with
+    the number of tables in the venue.
+    """
+    try:
+        return RowsResponse(await table_index.available(party_size, limit))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching available tables: {str(e)}")
+
+TABLE_STATUSES = ["available", "occupied", "reserved"]
+TABLES_BULK_MAX_UPDATES = 2000
+
+def _check_table_status(status: str):
+    if status not in TABLE_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of: {TABLE_STATUSES}")
+
+def _set_table_status(conn: sqlite3.Connection, table_id: int, status: str, expected_status: Optional[str]):
+    cursor = conn.execute(
+        'UPDATE restaurant_tables SET status = ? WHERE id = ? AND (? IS NULL OR status = ?)',
+        (status, table_id, expected_status, expected_status)
+    )
+    if cursor.rowcount == 0:
+        row = conn.execute('SELECT status FROM restaurant_tables WHERE id = ?', (table_id,)).fetchone()
+        conn.rollback()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Table not found")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Table {table_id} is '{row[0]}', expected '{expected_status}'"
+        )
+    conn.commit()
+
 @app.put("/api/tables/{table_id}/status")
-async def update_table_status(table_id: int, status: str):
-    """Update table status"""
-    valid_statuses = ["available", "occupied", "reserved"]
-    if status not in valid_statuses:
-        raise HTTPException(status_code=400, detail=f"Status must be one of: {valid_statuses}")
+async def update_table_status(
+    table_id: int,
+    status: str,
+    expected_status: Optional[str] = None,
+    db: Database = Depends(get_database)
+):
+    """Update table status.
+    
+    With ``expected_status`` the update only applies if the table is
+    currently in that status (409 otherwise), so two hosts can't silently
+    overwrite each other.
+    """
+    _check_table_status(status)
     
     logger.info(f"🔄 Actualizando estado de mesa {table_id} a '{status}'")
     
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('UPDATE restaurant_tables SET status = ? WHERE id = ?', (status, table_id))
-        
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Table not found")
-        
-        conn.commit()
-        conn.close()
+        await db.run(_set_table_status, table_id, status, expected_status, name="update_table_status")
+        table_index.set_status(table_id, status)
         
         logger.info(f"✅ Estado de mesa {table_id} actualizado a '{status}'")
         return {"message": f"Table {table_id} status updated to {status}"}
-    except HTTPException:
+    except HTTPException as e:
+        if e.status_code == 409:
+            # Someone else changed the table; our index may be behind too
+            table_index.invalidate()
         raise
     except Exception as e:
         logger.error(f"❌ Error actualizando mesa {table_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error updating table status: {str(e)}")
 
+class TableStatusUpdate(BaseModel):
+    table_id: int
+    status: str
+    expected_status: Optional[str] = None  # only apply if the table currently has this status
+
+class TableStatusBulk(BaseModel):
+    updates: List[TableStatusUpdate]
+
+def _apply_table_statuses(conn: sqlite3.Connection, updates: List[TableStatusUpdate]) -> List[dict]:
+    # Take the write lock up front so the status checks and the writes see
+    # the same snapshot of restaurant_tables
+    conn.execute('BEGIN IMMEDIATE')
+    table_ids = list({update.table_id for update in updates})
+    current = {}
+    for start in range(0, len(table_ids), 500):
+        chunk = table_ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        current.update(conn.execute(
+            f'SELECT id, status FROM restaurant_tables WHERE id IN ({placeholders})', chunk
+        ).fetchall())
+    
+    # Updates apply in request order, so a later update sees earlier ones
+    results = []
+    changed = {}
+    for update in updates:
+        status = current.get(update.table_id)
+        if status is None:
+            reason = "not_found"
+        elif update.expected_status is not None and status != update.expected_status:
+            reason = "status_mismatch"
+        else:
+            reason = None
+            status = current[update.table_id] = changed[update.table_id] = update.status
+        results.append({
+            "table_id": update.table_id,
+            "applied": reason is None,
+            "status": status,
+            "reason": reason,
+        })
+    
+    conn.executemany(
+        'UPDATE restaurant_tables SET status = ? WHERE id = ?',
+        [(status, table_id) for table_id, status in changed.items()]
+    )
+    conn.commit()
+    return results
+
+@app.post("/api/tables/status/bulk")
+async def bulk_update_table_status(bulk: TableStatusBulk, db: Database = Depends(get_database)):
+    """Apply many table status changes in one transaction.
+    
+    Each update may carry ``expected_status`` for compare-and-swap. Updates
+    that don't match (or name a missing table) are skipped and reported;
+    the rest still apply. ``status`` in each result is the table's status
+    after the request.
+    """
+    if len(bulk.updates) > TABLES_BULK_MAX_UPDATES:
+        raise HTTPException(status_code=413, detail=f"At most {TABLES_BULK_MAX_UPDATES} updates per request")
+    for update in bulk.updates:
+        _check_table_status(update.status)
+    
+    logger.info(f"🔄 Actualizando {len(bulk.updates)} estados de mesa")
+    try:
+        results = await db.run(_apply_table_statuses, bulk.updates, name="bulk_update_table_status")
+    except Exception as e:
+        logger.error(f"❌ Error actualizando mesas: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error updating table statuses: {str(e)}")
+    
+    # Every result carries the table's committed status, mismatches included
+    table_index.set_statuses((result["table_id"], result["status"]) for result in results if result["status"])
+    applied = sum(1 for result in results if result["applied"])
+    logger.info(f"✅ Estados de mesa actualizados: {applied} de {len(results)}")
+    return {"applied": applied, "rejected": len(results) - applied, "results": results}
+
+# Sales reports
+@app.get("/api/reports/{report}")
+async def get_sales_report(
+    report: str,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Database = Depends(get_database)
+):
+    """Sales totals from the rollup tables: hourly, categories, items or tables.
+    
+    ``since`` and ``until`` are ISO dates or timestamps, inclusive to the
+    hour; ``since`` defaults to the start of today. The rollups are kept
+    current as orders are placed and paid, so this never scans orders.
+    """
+    if report not in REPORTS:
+        raise HTTPException(status_code=404, detail=f"Report must be one of: {list(REPORTS)}")
+    try:
+        start, end = report_range(since, until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since and until must be ISO dates or timestamps")
+    
+    logger.info(f"📊 Obteniendo reporte de ventas '{report}' desde {start}")
+    try:
+        rows = await db.run(load_report, report, start, end, limit, name=f"report_{report}")
+        return RowsResponse(rows)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching report: {str(e)}")
+
 # Payment endpoints
 @app.get("/api/payments", response_model=List[Payment])
-async def get_payments():
+async def get_payments(db: Database = Depends(get_database)):
     """Get all payments"""
     logger.info("💳 Obteniendo pagos")
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM payments ORDER BY timestamp DESC')
-        payments_data = cursor.fetchall()
-        conn.close()
+        payments_data = await db.fetchall(
+            'SELECT id, order_id, amount, payment_method, status, transaction_id, timestamp '
+            'FROM payments ORDER BY timestamp DESC',
+            name="get_payments"
+        )
         
-        payments = []
-        for payment_data in payments_data:
-            payments.append(Payment(
-                id=payment_data[0],
-                order_id=payment_data[1],
-                amount=payment_data[2],
-                payment_method=payment_data[3],
-                status=payment_data[4],
-                transaction_id=payment_data[5],
-                timestamp=payment_data[6]
-            ))
+        payments = [
+            {
+                "id": row[0], "order_id": row[1], "amount": row[2], "payment_method": row[3],
+                "status": row[4], "transaction_id": row[5], "timestamp": row[6]
+            }
+            for row in payments_data
+        ]
         
         logger.info(f"✅ Pagos obtenidos: {len(payments)} pagos encontrados")
-        return payments
+        return RowsResponse(payments)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching payments: {str(e)}")
 
+def _insert_payment(conn: sqlite3.Connection, payment: Payment, transaction_id: str, timestamp: str) -> int:
+    cursor = conn.cursor()
+    
+    # Verificar que la orden existe
+    cursor.execute('SELECT id FROM orders WHERE id = ?', (payment.order_id,))
+    if not cursor.fetchone():
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    cursor.execute('''
+        INSERT INTO payments (order_id, amount, payment_method, status, transaction_id, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (payment.order_id, payment.amount, payment.payment_method, 'pending', transaction_id, timestamp))
+    
+    payment_id = cursor.lastrowid
+    conn.commit()
+    return payment_id
+
 @app.post("/api/payments", response_model=Payment)
-async def create_payment(payment: Payment):
+async def create_payment(
+    payment: Payment,
+    response: Response,
+    db: Database = Depends(get_database),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
+):
     """Create a new payment"""
     logger.info(f"💳 Nuevo pago recibido - Orden: {payment.order_id}, Monto: ${payment.amount}")
     logger.info(f"📋 Método de pago: {payment.payment_method}")
-    try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        
-        # Verificar que la orden existe
-        cursor.execute('SELECT id FROM orders WHERE id = ?', (payment.order_id,))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        timestamp = datetime.now().isoformat()
-        transaction_id = f"TXN-{payment.order_id}-{int(datetime.now().timestamp())}"
-        
-        cursor.execute('''
-            INSERT INTO payments (order_id, amount, payment_method, status, transaction_id, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (payment.order_id, payment.amount, payment.payment_method, 'pending', transaction_id, timestamp))
-        
-        payment_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        
-        payment.id = payment_id
-        payment.status = 'pending'
-        payment.transaction_id = transaction_id
-        payment.timestamp = timestamp
-        logger.info(f"✅ Pago creado con ID: {payment_id}, Transacción: {transaction_id}")
-        return payment
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Error creando pago: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error creating payment: {str(e)}")
+    
+    async def insert():
+        try:
+            timestamp = datetime.now().isoformat()
+            transaction_id = f"TXN-{payment.order_id}-{int(datetime.now().timestamp())}"
+            
+            payment_id = await db.run(_insert_payment, payment, transaction_id, timestamp)
+            
+            payment.id = payment_id
+            payment.status = 'pending'
+            payment.transaction_id = transaction_id
+            payment.timestamp = timestamp
+            logger.info(f"✅ Pago creado con ID: {payment_id}, Transacción: {transaction_id}")
+            return payment
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error creando pago: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error creating payment: {str(e)}")
+    
+    return await idempotency_store.run("create_payment", idempotency_key, payment, response, insert)
+
+def _settle_payment(conn: sqlite3.Connection, payment_id: int, outcome: str):
+    row = conn.execute('SELECT order_id FROM payments WHERE id = ?', (payment_id,)).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Payment not found")
+    
+    # Actualizar el pago, y si se completa marcar la orden pagada (y encolarla en la cocina)
+    notification = settle_payment(conn, payment_id, row[0], outcome)
+    if notification is None:
+        conn.rollback()
+        status = conn.execute('SELECT status FROM payments WHERE id = ?', (payment_id,)).fetchone()[0]
+        raise HTTPException(status_code=409, detail=f"Payment {payment_id} is already {status}")
+    conn.commit()
+    return notification
 
 @app.put("/api/payments/{payment_id}/confirm")
-async def confirm_payment(payment_id: int):
+async def confirm_payment(payment_id: int, db: Database = Depends(get_database)):
     """Confirm/Complete a payment"""
     logger.info(f"✅ Confirmando pago {payment_id}")
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        
-        # Verificar que el pago existe
-        cursor.execute('SELECT order_id FROM payments WHERE id = ?', (payment_id,))
-        payment_row = cursor.fetchone()
-        if not payment_row:
-            raise HTTPException(status_code=404, detail="Payment not found")
-        
-        order_id = payment_row[0]
-        
-        # Actualizar estado del pago a completado
-        cursor.execute('UPDATE payments SET status = ? WHERE id = ?', ('completed', payment_id))
-        
-        # Actualizar estado de la orden a pagada
-        cursor.execute('UPDATE orders SET status = ? WHERE id = ?', ('paid', order_id))
-        
-        conn.commit()
-        conn.close()
+        event_type, order_id, table_number, order_status, fields = await db.run(
+            _settle_payment, payment_id, "completed", name="confirm_payment"
+        )
+        broker.publish(event_type, order_id, table_number, order_status, **fields)
         
         logger.info(f"✅ Pago {payment_id} confirmado, Orden {order_id} marcada como pagada")
         return {"message": f"Payment {payment_id} confirmed", "order_id": order_id, "status": "completed"}
@@ -569,20 +1054,14 @@ async def confirm_payment(payment_id: int):
         raise HTTPException(status_code=500, detail=f"Error confirming payment: {str(e)}")
 
 @app.put("/api/payments/{payment_id}/reject")
-async def reject_payment(payment_id: int):
+async def reject_payment(payment_id: int, db: Database = Depends(get_database)):
     """Reject/Cancel a payment"""
     logger.info(f"❌ Rechazando pago {payment_id}")
     try:
-        conn = sqlite3.connect('seatserve.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('UPDATE payments SET status = ? WHERE id = ?', ('failed', payment_id))
-        
-        if cursor.rowcount == 0:
-            raise HTTPException(status_code=404, detail="Payment not found")
-        
-        conn.commit()
-        conn.close()
+        event_type, order_id, table_number, order_status, fields = await db.run(
+            _settle_payment, payment_id, "failed", name="reject_payment"
+        )
+        broker.publish(event_type, order_id, table_number, order_status, **fields)
         
         logger.info(f"✅ Pago {payment_id} rechazado")
         return {"message": f"Payment {payment_id} rejected", "status": "failed"}
@@ -599,75 +1078,216 @@ async def get_stripe_config():
     return {"publishableKey": STRIPE_PUBLISHABLE_KEY}
 
 @app.post("/api/stripe/create-payment-intent")
-async def create_payment_intent(payment_data: StripePaymentIntent):
-    """Create a Stripe Payment Intent"""
+async def create_payment_intent(
+    payment_data: StripePaymentIntent,
+    response: Response,
+    gateway: PaymentGateway = Depends(get_payment_gateway),
+    db: Database = Depends(get_database),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
+):
+    """Create a Stripe Payment Intent.
+    
+    With ``order_data.order_id`` the intent charges that order's stored
+    total; ``amount`` is only used for intents not tied to an order.
+    """
     logger.info(f"💳 Creando Payment Intent de Stripe - Monto: ${payment_data.amount}")
-    try:
-        # Calculate amount in cents (Stripe requires integer cents)
-        amount_cents = int(payment_data.amount * 100)
-        
-        # Create Payment Intent
-        intent = stripe.PaymentIntent.create(
-            amount=amount_cents,
-            currency='usd',
-            automatic_payment_methods={
-                'enabled': True,
-            },
-            metadata={
+    
+    async def create():
+        try:
+            # Calculate amount in cents (Stripe requires integer cents)
+            amount_cents = int(payment_data.amount * 100)
+            
+            metadata = {
                 'order_data': json.dumps(payment_data.order_data)
             }
-        )
-        
-        logger.info(f"✅ Payment Intent creado: {intent.id}")
-        return {
-            "clientSecret": intent.client_secret,
-            "paymentIntentId": intent.id
-        }
-    except stripe.error.StripeError as e:
-        logger.error(f"❌ Error de Stripe: {str(e)}")
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        logger.error(f"❌ Error creando Payment Intent: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error creating payment intent: {str(e)}")
+            # Lets the webhook worker attach the payment to a server-side order,
+            # which is then charged its stored total, not the amount sent
+            order_id = payment_data.order_data.get('order_id')
+            if order_id is not None:
+                try:
+                    order_id = int(order_id)
+                except (TypeError, ValueError):
+                    raise HTTPException(status_code=422, detail="order_id must be an integer")
+                amount_cents = await db.run(order_total_cents, order_id, name="order_total")
+                if amount_cents is None:
+                    raise HTTPException(status_code=404, detail="Order not found")
+                metadata['order_id'] = str(order_id)
+            
+            # Create Payment Intent
+            intent = await gateway.create_payment_intent(
+                amount=amount_cents,
+                currency='usd',
+                metadata=metadata,
+                idempotency_key=idempotency_key
+            )
+            
+            logger.info(f"✅ Payment Intent creado: {intent.id}")
+            return {
+                "clientSecret": intent.client_secret,
+                "paymentIntentId": intent.id
+            }
+        except GatewayError as e:
+            logger.error(f"❌ Error de Stripe: {str(e)}")
+            # Gateway outages are ours to report; rejected requests are the client's
+            raise HTTPException(status_code=502 if e.retryable else 400, detail=str(e))
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error creando Payment Intent: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error creating payment intent: {str(e)}")
+    
+    return await idempotency_store.run("create_payment_intent", idempotency_key, payment_data, response, create)
 
 @app.post("/api/stripe/webhook")
-async def stripe_webhook(request: Request):
-    """Handle Stripe webhooks"""
+async def stripe_webhook(request: Request, db: Database = Depends(get_database)):
+    """Handle Stripe webhooks.
+    
+    Only events signed with ``STRIPE_WEBHOOK_SECRET`` are accepted.
+    Verified events are appended to the webhook inbox and acknowledged
+    right away; the webhook worker applies them to payments and orders in
+    batches. Redelivered events are acknowledged without being stored twice.
+    """
     payload = await request.body()
     sig_header = request.headers.get('stripe-signature')
     
     # Get webhook secret from environment
     webhook_secret = os.getenv('STRIPE_WEBHOOK_SECRET', '')
+    if not webhook_secret:
+        # Unsigned events could mark any order paid; Stripe retries until this is configured
+        logger.error("❌ STRIPE_WEBHOOK_SECRET no configurado: webhook rechazado")
+        raise HTTPException(status_code=503, detail="Webhook signing secret is not configured")
     
     try:
-        if webhook_secret:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, webhook_secret
-            )
-        else:
-            # For testing without webhook secret
-            event = json.loads(payload)
-        
+        stripe.Webhook.construct_event(payload, sig_header, webhook_secret)
+        # The signature covers the raw payload; keep working with plain dicts
+        event = json.loads(payload)
         logger.info(f"🔔 Webhook recibido: {event['type']}")
-        
-        # Handle the event
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            logger.info(f"✅ Pago exitoso: {payment_intent['id']}")
-            # Here you would update your database with payment confirmation
-            
-        elif event['type'] == 'payment_intent.payment_failed':
-            payment_intent = event['data']['object']
-            logger.error(f"❌ Pago fallido: {payment_intent['id']}")
-            
-        return {"status": "success"}
-        
     except stripe.error.SignatureVerificationError as e:
         logger.error(f"❌ Error de verificación de firma: {str(e)}")
         raise HTTPException(status_code=400, detail="Invalid signature")
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"❌ Webhook inválido: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid webhook payload")
+    
+    if not event.get('id'):
+        raise HTTPException(status_code=400, detail="Webhook event has no id")
+    
+    try:
+        stored = await db.run(enqueue_event, event, payload, name="webhook_enqueue")
     except Exception as e:
         logger.error(f"❌ Error procesando webhook: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    if stored:
+        webhook_worker.notify()
+    else:
+        logger.info(f"🔁 Webhook duplicado ignorado: {event['id']}")
+    return {"status": "success"}
+
+class WebhookReplay(BaseModel):
+    event_ids: Optional[List[str]] = None
+
+@app.post("/api/stripe/webhook/replay")
+async def replay_webhook_events(replay: WebhookReplay, db: Database = Depends(get_database)):
+    """Queue stored webhook events to be processed again (all failed events by default)"""
+    requeued = await db.run(requeue_events, replay.event_ids, name="webhook_requeue")
+    webhook_worker.notify()
+    logger.info(f"🔁 Eventos de webhook reencolados: {requeued}")
+    return {"requeued": requeued}
+
+class ReconcileRequest(BaseModel):
+    since_hours: float = Field(RECONCILE_LOOKBACK_HOURS, gt=0)
+    dry_run: bool = False
+
+@app.post("/api/payments/reconcile")
+async def reconcile_payments(
+    request: ReconcileRequest,
+    db: Database = Depends(get_database),
+    gateway: PaymentGateway = Depends(get_payment_gateway)
+):
+    """Settle pending payments from their Stripe payment intents.
+    
+    Pages through intents created in the last ``since_hours`` and through
+    local pending payments, marking payments completed or failed (and
+    orders paid) in batched transactions. Paid intents for orders with no
+    payment row get one recorded. ``dry_run`` only counts the corrections.
+    """
+    logger.info(f"🧾 Conciliando pagos de las ultimas {request.since_hours} horas")
+    since = datetime.now() - timedelta(hours=request.since_hours)
+    try:
+        report = await Reconciler(db, gateway, broker).run(since=since, dry_run=request.dry_run)
+    except GatewayError as e:
+        logger.error(f"❌ Error de Stripe conciliando pagos: {e}")
+        raise HTTPException(status_code=502, detail=f"Payment gateway error: {e}")
+    return report.to_dict()
+
+async def _refresh_kitchen_queues(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            kitchen.rebuild(await db.run(load_open_tickets, name="load_open_tickets"))
+        except Exception as e:
+            logger.error(f"❌ Error recargando colas de cocina: {str(e)}")
+
+async def _rebuild_kitchen_queues():
+    """Reload paid and in-progress orders into the kitchen queues"""
+    try:
+        count = kitchen.rebuild(await db.run(load_open_tickets, name="load_open_tickets"))
+        logger.info(f"👨‍🍳 Colas de cocina reconstruidas: {count} ordenes abiertas")
+    except sqlite3.Error as e:
+        logger.error(f"❌ Error reconstruyendo colas de cocina: {str(e)}")
+
+async def startup(app: FastAPI):
+    """Schema, connections and caches first, background workers next, readiness last"""
+    started = time.perf_counter()
+    app.state.ready = False
+    start_queue_logging()
+    db.open()
+    order_archive.open()
+
+    # Migrates the schema; a quick no-op when serve.py already ran it
+    await asyncio.get_running_loop().run_in_executor(None, init_db)
+    connections = await db.warm()
+    snapshot = await menu_cache.get()
+    table_index.invalidate()
+    await table_index.refresh()
+    await _rebuild_kitchen_queues()
+
+    # Event loop lag for /metrics
+    app.state.loop_monitor = asyncio.create_task(monitor_event_loop())
+    if KITCHEN_REFRESH_SECONDS > 0:
+        app.state.kitchen_refresh = asyncio.create_task(_refresh_kitchen_queues(KITCHEN_REFRESH_SECONDS))
+    await event_relay.start()
+    webhook_worker.start()
+    archive_worker.start()
+
+    app.state.startup_ms = round((time.perf_counter() - started) * 1000, 1)
+    app.state.ready = True
+    logger.info(
+        f"🚀 SeatServe listo en {app.state.startup_ms} ms: {connections} conexiones abiertas, "
+        f"{len(snapshot.items)} items en el menú"
+    )
+
+async def shutdown(app: FastAPI):
+    """Fail readiness, stop background work, then drain in-flight queries and close pooled connections"""
+    app.state.ready = False
+    await webhook_worker.stop()
+    await archive_worker.stop()
+    await event_relay.stop()
+    await gateway.aclose()
+    for name in ("loop_monitor", "kitchen_refresh"):
+        task = getattr(app.state, name, None)
+        if task is not None:
+            task.cancel()
+            setattr(app.state, name, None)
+    db.close()
+    order_archive.close()
+    stop_queue_logging()
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    if os.getenv('APP_ENV') == 'production':
+        from serve import main as serve
+        raise SystemExit(serve())
+    # Development server with auto-reload; watchfiles logs every change it sees
+    logging.getLogger("watchfiles").setLevel(logging.WARNING)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, reload_includes=["*.py"])
\ No newline at end of file
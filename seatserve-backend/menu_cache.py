@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Menu Cache
+Process-local, versioned menu snapshots served with ETag revalidation
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from database import Database, db
+from pricing import MenuPrice, build_price_index
+from serialization import dumps
+
+# Phones must revalidate every time, but a matching ETag costs a 304 with no body
+MENU_CACHE_CONTROL = os.getenv('SEATSERVE_MENU_CACHE_CONTROL', 'public, no-cache')
+# Reload at least this often, to pick up menu writes made by other worker processes
+MENU_CACHE_TTL = float(os.getenv('SEATSERVE_MENU_CACHE_TTL', '5'))
+
+
+def _etag(body: bytes) -> str:
+    # Content-derived so every worker process hands out the same tag
+    return '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+
+
+@dataclass(frozen=True)
+class MenuSnapshot:
+    """Immutable, pre-serialized view of the menu at one cache version"""
+    version: int
+    items: List[dict]
+    categories: List[str]
+    menu_body: bytes
+    menu_etag: str
+    categories_body: bytes
+    categories_etag: str
+    prices: Dict[int, MenuPrice]
+
+    @classmethod
+    def build(cls, version: int, rows: List[tuple]) -> "MenuSnapshot":
+        items = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2],
+                "price": row[3],
+                "category": row[4],
+                "available": bool(row[5]),
+            }
+            for row in rows
+            if row[5]
+        ]
+        # Categories cover every item, available or not, in first-seen order
+        categories = list(dict.fromkeys(row[4] for row in rows))
+        menu_body = dumps(items)
+        categories_body = dumps({"categories": categories})
+        return cls(
+            version=version,
+            items=items,
+            categories=categories,
+            menu_body=menu_body,
+            menu_etag=_etag(menu_body),
+            categories_body=categories_body,
+            categories_etag=_etag(categories_body),
+            prices=build_price_index(rows),
+        )
+
+
+def _load_menu(conn: sqlite3.Connection) -> List[tuple]:
+    return conn.execute('SELECT * FROM menu_items ORDER BY id').fetchall()
+
+
+class MenuCache:
+    """Holds the current menu snapshot until a write bumps the version.
+
+    Writers call ``invalidate()`` after committing; the next reader reloads
+    the menu once and every reader after it is served from memory. Readers
+    that arrive while a reload is running wait for that same load instead of
+    starting their own. A load that races with an invalidation is returned
+    to its waiters but not kept. Snapshots older than the TTL are reloaded
+    too, since other worker processes can't invalidate this one.
+    """
+
+    def __init__(self, database: Database, ttl: float = MENU_CACHE_TTL):
+        self._db = database
+        self.ttl = ttl
+        self._version = 0
+        self._snapshot = None
+        self._loaded_at = 0.0
+        self._loading: Optional[asyncio.Task] = None
+        self._loading_version = -1
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def invalidate(self) -> None:
+        """Mark the cached menu stale after a menu write"""
+        self._version += 1
+
+    async def get(self) -> MenuSnapshot:
+        """Return the current snapshot, reloading it if stale"""
+        snapshot = self._snapshot
+        if (snapshot is not None and snapshot.version == self._version
+                and time.monotonic() - self._loaded_at < self.ttl):
+            return snapshot
+
+        loading = self._loading
+        if (loading is None or loading.done() or self._loading_version != self._version
+                or loading.get_loop() is not asyncio.get_running_loop()):
+            loading = self._loading = asyncio.ensure_future(self._load(self._version))
+            self._loading_version = self._version
+        # Shielded so one cancelled reader doesn't cancel the load for the rest
+        return await asyncio.shield(loading)
+
+    async def _load(self, version: int) -> MenuSnapshot:
+        loaded_at = time.monotonic()
+        rows = await self._db.run(_load_menu, name="load_menu")
+        snapshot = MenuSnapshot.build(version, rows)
+        if version == self._version:
+            self._snapshot = snapshot
+            self._loaded_at = loaded_at
+        return snapshot
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def conditional_response(request: Request, body: bytes, etag: str) -> Response:
+    """JSON response for ``body``, or an empty 304 if the client has ``etag``"""
+    headers = {"ETag": etag, "Cache-Control": MENU_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+menu_cache = MenuCache(db)
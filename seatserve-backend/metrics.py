@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Metrics
+Dependency-free counters and latency histograms in Prometheus text format
+"""
+
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+import asyncio
+import threading
+import time
+
+# Seconds; covers sub-millisecond SQLite reads up to slow payment gateway calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Fixed-bucket histogram; buckets are allocated once, up front"""
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Gauge(Counter):
+    __slots__ = ()
+
+    def dec(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Child metric for a label tuple; created once, then a dict lookup"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in sorted(self._children.items(), key=lambda item: tuple(map(str, item[0]))):
+            self._render_child(lines, values, child)
+
+    def _render_child(self, lines: List[str], values: Tuple, child) -> None:
+        lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}")
+
+
+class CounterFamily(_Family):
+    kind = "counter"
+
+    def _new_child(self):
+        return Counter()
+
+
+class GaugeFamily(_Family):
+    kind = "gauge"
+
+    def _new_child(self):
+        return Gauge()
+
+
+class HistogramFamily(_Family):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return Histogram(self.buckets)
+
+    def _render_child(self, lines: List[str], values: Tuple, child: Histogram) -> None:
+        with child._lock:
+            counts = list(child.counts)
+            total = child.sum
+            count = child.count
+        cumulative = 0
+        for bound, bucket_count in zip(child.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _labels(self.labelnames, values, 'le="' + le + '"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        labels = _labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {repr(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families: List[_Family] = []
+
+    def register(self, family: _Family) -> _Family:
+        self.families.append(family)
+        return family
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in self.families:
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.register(CounterFamily(
+    "seatserve_http_requests_total", "HTTP requests handled", ("method", "route", "status")))
+http_request_duration = registry.register(HistogramFamily(
+    "seatserve_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route")))
+http_requests_in_flight = registry.register(GaugeFamily(
+    "seatserve_http_requests_in_flight", "HTTP requests currently being handled")).labels()
+db_query_duration = registry.register(HistogramFamily(
+    "seatserve_db_query_duration_seconds", "Database query execution time by query name", ("query",)))
+db_query_wait = registry.register(HistogramFamily(
+    "seatserve_db_query_wait_seconds", "Time queries waited for a database worker", ("query",)))
+stripe_request_duration = registry.register(HistogramFamily(
+    "seatserve_stripe_request_duration_seconds", "Stripe API call latency", ("operation", "outcome")))
+event_loop_lag = registry.register(HistogramFamily(
+    "seatserve_event_loop_lag_seconds", "Delay between scheduled and actual event loop wakeups")).labels()
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request counts and latency.
+
+    Requests are labelled by route template (``/api/orders/{order_id}``),
+    resolved from the matched endpoint through a table built once from the
+    app's routes, so there is no per-request string work.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._route_paths: Dict[object, str] = {}
+
+    def _route_template(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._route_paths.get(endpoint)
+        if path is None:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is not None:
+                    self._route_paths.setdefault(route.endpoint, route.path)
+            path = self._route_paths.get(endpoint, "unmatched")
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            method = scope["method"]
+            route = self._route_template(scope)
+            http_request_duration.labels(method, route).observe(time.perf_counter() - started)
+            http_requests_total.labels(method, route, status).inc()
+
+
+async def monitor_event_loop(interval: float = 0.5) -> None:
+    """Sample how late the event loop wakes up; long lags mean blocking work"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - expected))
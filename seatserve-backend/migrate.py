@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Schema Migrations
+Applies the Alembic revisions in migrations/ to the SQLite database
+
+Usage:
+    python3 migrate.py                         # upgrade to the latest revision
+    alembic downgrade 0002                     # step back to a revision
+    alembic revision -m "..." --rev-id 0004    # start a new revision
+"""
+
+from typing import Optional
+import argparse
+import os
+import sqlite3
+import sys
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+
+from database import DATABASE_PATH
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def alembic_config(path: str = DATABASE_PATH) -> Config:
+    """Alembic settings for ``path``, usable from any working directory"""
+    config = Config(os.path.join(BASE_DIR, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(BASE_DIR, "migrations"))
+    config.attributes["db_path"] = path
+    # Keep the app's logging setup
+    config.attributes["configure_logger"] = False
+    return config
+
+
+def head_revision() -> str:
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(path: str = DATABASE_PATH) -> Optional[str]:
+    """Revision ``path`` is at, or None before the first migration"""
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute('SELECT version_num FROM alembic_version').fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def upgrade(path: str = DATABASE_PATH, revision: str = "head") -> None:
+    """Apply pending revisions; a quick no-op when ``path`` is already at ``revision``"""
+    command.upgrade(alembic_config(path), revision)
+
+
+def downgrade(path: str, revision: str) -> None:
+    command.downgrade(alembic_config(path), revision)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Migrate the SeatServe database schema")
+    parser.add_argument("revision", nargs="?", default="head", help="revision to upgrade to (default: head)")
+    parser.add_argument("--db", default=DATABASE_PATH, help="SQLite database file")
+    args = parser.parse_args()
+
+    before = current_revision(args.db)
+    upgrade(args.db, args.revision)
+    print(f"{args.db}: {before or 'empty'} -> {current_revision(args.db)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Alembic environment for the SeatServe SQLite database
+
+Every pending revision runs in one transaction that takes the write lock
+before the current revision is read, so worker processes starting at the
+same time migrate one after another instead of racing.
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine, event
+
+from database import BUSY_TIMEOUT_MS, DATABASE_PATH
+
+config = context.config
+
+# The app configures logging itself; only the alembic CLI uses alembic.ini's
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+DB_URL = f"sqlite:///{config.attributes.get('db_path') or DATABASE_PATH}"
+
+
+def run_migrations_online() -> None:
+    engine = create_engine(DB_URL, connect_args={"timeout": BUSY_TIMEOUT_MS / 1000})
+
+    @event.listens_for(engine, "connect")
+    def _connect(dbapi_connection, _record):
+        # Leave transaction control to SQLAlchemy instead of the sqlite3 module
+        dbapi_connection.isolation_level = None
+        # Create new databases in WAL mode up front: switching later needs an
+        # exclusive lock that pooled connections can't get while we migrate
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+    @event.listens_for(engine, "begin")
+    def _begin(connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    try:
+        with engine.connect() as connection:
+            context.configure(connection=connection, transactional_ddl=True)
+            with context.begin_transaction():
+                context.run_migrations()
+    finally:
+        engine.dispose()
+
+
+if context.is_offline_mode():
+    # The initial revision inspects the existing tables, so there is no SQL-only script
+    raise RuntimeError("Offline (--sql) migrations are not supported; run them against the database")
+run_migrations_online()
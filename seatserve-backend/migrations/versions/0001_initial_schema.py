@@ -0,0 +1,246 @@
+"""Initial schema
+
+Tables as they stood before migrations were introduced, without secondary
+indexes. Statements use IF NOT EXISTS and missing columns are added one by
+one, so databases created by the old init_db upgrade from base in place.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-16 23:45:00
+"""
+
+from alembic import op
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+ROLLUP_COUNTER_NAMES = ("orders", "quantity", "sales_cents", "paid_orders", "paid_quantity", "paid_sales_cents")
+ROLLUP_COUNTERS = ", ".join(f"{column} INTEGER NOT NULL DEFAULT 0" for column in ROLLUP_COUNTER_NAMES)
+ROLLUP_TABLES = ("sales_hourly", "sales_by_category", "sales_by_item", "sales_by_table")
+
+# Legacy orders.items JSON -> order_items rows. A key gets its own column
+# only when its value has the column's type; everything else stays in
+# ``extra``, so each item object round-trips exactly. ('$[#]' matches
+# nothing in an object, so it leaves the key in place.)
+MIGRATE_ITEMS_SQL = '''
+    WITH items AS (
+        SELECT o.id AS order_id, item.key AS line_no, item.value AS value,
+               json_type(item.value, '$.id') IN ('integer', 'text') AS has_id,
+               json_type(item.value, '$.name') = 'text' AS has_name,
+               json_type(item.value, '$.qty') = 'integer' AS has_qty,
+               json_type(item.value, '$.price') IN ('integer', 'real') AS has_price
+        FROM orders o, json_each(COALESCE(NULLIF(o.items, ''), '[]')) AS item
+        WHERE o.id NOT IN (SELECT DISTINCT order_id FROM order_items)
+    )
+    INSERT INTO order_items (order_id, line_no, menu_item_id, name, qty, unit_price, extra)
+    SELECT order_id, line_no,
+           CASE WHEN has_id THEN json_extract(value, '$.id') END,
+           CASE WHEN has_name THEN json_extract(value, '$.name') END,
+           CASE WHEN has_qty THEN json_extract(value, '$.qty') END,
+           CASE WHEN has_price THEN json_extract(value, '$.price') END,
+           NULLIF(json_remove(
+               value,
+               CASE WHEN has_id THEN '$.id' ELSE '$[#]' END,
+               CASE WHEN has_name THEN '$.name' ELSE '$[#]' END,
+               CASE WHEN has_qty THEN '$.qty' ELSE '$[#]' END,
+               CASE WHEN has_price THEN '$.price' ELSE '$[#]' END
+           ), '{}')
+    FROM items
+'''
+
+# Rollup backfill. Every order counts once in the hour it was placed and,
+# if paid, once more (paid = 1) in the hour it was paid. Sales are pre-tax
+# cents per line; orders without a category count as 'Uncategorized'.
+ROLLUP_SOURCE_SQL = '''
+    WITH placed AS (
+        SELECT id, table_number, status, paid_at,
+               COALESCE(timestamp, strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime')) AS timestamp
+        FROM orders
+    ),
+    counted AS (
+        SELECT id, table_number, 0 AS paid, timestamp AS at FROM placed
+        UNION ALL
+        SELECT id, table_number, 1, COALESCE(paid_at, timestamp) FROM placed
+        WHERE status IN ('paid', 'preparing', 'ready')
+    ),
+    events AS (
+        SELECT id, table_number, paid, substr(at, 1, 10) || 'T' || substr(at, 12, 2) AS hour FROM counted
+    ),
+    lines AS (
+        SELECT i.order_id, i.menu_item_id, i.name, i.line_no,
+               COALESCE(i.qty, 1) AS qty,
+               CAST(round(COALESCE(i.unit_price, 0) * 100) AS INTEGER) * COALESCE(i.qty, 1) AS cents,
+               COALESCE(m.category, 'Uncategorized') AS category
+        FROM order_items i
+        LEFT JOIN menu_items m ON m.id = i.menu_item_id
+    )
+'''
+ROLLUP_COUNTER_SQL = '''
+    SUM(1 - e.paid), SUM((1 - e.paid) * l.qty), SUM((1 - e.paid) * l.cents),
+    SUM(e.paid), SUM(e.paid * l.qty), SUM(e.paid * l.cents)
+'''
+ROLLUP_COLUMNS = ", ".join(ROLLUP_COUNTER_NAMES)
+BACKFILL_ROLLUPS_SQL = (
+    ROLLUP_SOURCE_SQL + f'''
+    INSERT INTO sales_hourly (hour, {ROLLUP_COLUMNS})
+    SELECT e.hour, {ROLLUP_COUNTER_SQL}
+    FROM events e
+    JOIN (
+        SELECT o.id, COALESCE(SUM(lines.qty), 0) AS qty, COALESCE(SUM(lines.cents), 0) AS cents
+        FROM orders o LEFT JOIN lines ON lines.order_id = o.id GROUP BY o.id
+    ) l ON l.id = e.id
+    GROUP BY e.hour
+''',
+    ROLLUP_SOURCE_SQL + f'''
+    INSERT INTO sales_by_table (hour, table_number, {ROLLUP_COLUMNS})
+    SELECT e.hour, e.table_number, {ROLLUP_COUNTER_SQL}
+    FROM events e
+    JOIN (
+        SELECT o.id, COALESCE(SUM(lines.qty), 0) AS qty, COALESCE(SUM(lines.cents), 0) AS cents
+        FROM orders o LEFT JOIN lines ON lines.order_id = o.id GROUP BY o.id
+    ) l ON l.id = e.id
+    GROUP BY e.hour, e.table_number
+''',
+    ROLLUP_SOURCE_SQL + f'''
+    INSERT INTO sales_by_category (hour, category, {ROLLUP_COLUMNS})
+    SELECT e.hour, l.category, {ROLLUP_COUNTER_SQL}
+    FROM events e
+    JOIN (
+        SELECT order_id, category, SUM(qty) AS qty, SUM(cents) AS cents
+        FROM lines GROUP BY order_id, category
+    ) l ON l.order_id = e.id
+    GROUP BY e.hour, l.category
+''',
+    # Item names come from the most recent line for the item
+    ROLLUP_SOURCE_SQL + f'''
+    INSERT INTO sales_by_item (hour, menu_item_id, name, {ROLLUP_COLUMNS})
+    SELECT e.hour, l.menu_item_id,
+           (SELECT name FROM lines latest WHERE latest.menu_item_id = l.menu_item_id
+            ORDER BY latest.order_id DESC, latest.line_no DESC LIMIT 1),
+           {ROLLUP_COUNTER_SQL}
+    FROM events e
+    JOIN (
+        SELECT order_id, menu_item_id, SUM(qty) AS qty, SUM(cents) AS cents
+        FROM lines WHERE typeof(menu_item_id) = 'integer' GROUP BY order_id, menu_item_id
+    ) l ON l.order_id = e.id
+    GROUP BY e.hour, l.menu_item_id
+''',
+)
+
+
+def upgrade() -> None:
+    # Schema inspection runs on the raw sqlite3 connection, in the same transaction
+    conn = op.get_bind().connection.dbapi_connection
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS menu_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            description TEXT,
+            price REAL NOT NULL,
+            category TEXT NOT NULL,
+            available BOOLEAN DEFAULT 1
+        )
+    ''')
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_number INTEGER NOT NULL,
+            stand TEXT DEFAULT 'main',
+            subtotal REAL,
+            tax REAL,
+            total REAL NOT NULL,
+            status TEXT DEFAULT 'pending',
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            paid_at TEXT
+        )
+    ''')
+    # Columns added after the first release
+    order_columns = {row[1] for row in conn.execute('PRAGMA table_info(orders)')}
+    for column, definition in (('subtotal', 'REAL'), ('tax', 'REAL'), ('stand', "TEXT DEFAULT 'main'"), ('paid_at', 'TEXT')):
+        if column not in order_columns:
+            op.execute(f'ALTER TABLE orders ADD COLUMN {column} {definition}')
+
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS restaurant_tables (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            number INTEGER UNIQUE NOT NULL,
+            seats INTEGER NOT NULL,
+            status TEXT DEFAULT 'available'
+        )
+    ''')
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            payment_method TEXT DEFAULT 'card',
+            status TEXT DEFAULT 'pending',
+            transaction_id TEXT,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+    ''')
+
+    # Order line items replace the legacy orders.items JSON column
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            line_no INTEGER NOT NULL,
+            menu_item_id,  -- no type affinity: ids keep the type the client sent
+            name TEXT,
+            qty INTEGER,
+            unit_price REAL,
+            extra TEXT,
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+    ''')
+    if "items" in order_columns:
+        op.execute(MIGRATE_ITEMS_SQL)
+        op.execute('ALTER TABLE orders DROP COLUMN items')
+
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            event_id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            received_at TEXT NOT NULL,
+            processed_at TEXT
+        )
+    ''')
+
+    op.execute(f'CREATE TABLE IF NOT EXISTS sales_hourly (hour TEXT PRIMARY KEY, {ROLLUP_COUNTERS})')
+    op.execute(f'''
+        CREATE TABLE IF NOT EXISTS sales_by_category (
+            hour TEXT NOT NULL, category TEXT NOT NULL, {ROLLUP_COUNTERS},
+            PRIMARY KEY (hour, category)
+        )
+    ''')
+    op.execute(f'''
+        CREATE TABLE IF NOT EXISTS sales_by_item (
+            hour TEXT NOT NULL, menu_item_id INTEGER NOT NULL, name TEXT, {ROLLUP_COUNTERS},
+            PRIMARY KEY (hour, menu_item_id)
+        )
+    ''')
+    op.execute(f'''
+        CREATE TABLE IF NOT EXISTS sales_by_table (
+            hour TEXT NOT NULL, table_number INTEGER NOT NULL, {ROLLUP_COUNTERS},
+            PRIMARY KEY (hour, table_number)
+        )
+    ''')
+    # Backfill rollups created for a database that already has orders
+    if not set(ROLLUP_TABLES) <= existing:
+        for statement in BACKFILL_ROLLUPS_SQL:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    for table in ROLLUP_TABLES + ("webhook_events", "order_items", "payments", "restaurant_tables", "orders", "menu_items"):
+        op.execute(f'DROP TABLE IF EXISTS {table}')
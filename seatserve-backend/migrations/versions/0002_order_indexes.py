@@ -0,0 +1,38 @@
+"""Order indexes
+
+Keyset pagination and filters on GET /api/orders, the order export, the
+kitchen queue rebuild, the archive job, and order line item lookups.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 23:45:00
+"""
+
+from alembic import op
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    # Newest-first pages and (timestamp, id) export chunks
+    ('idx_orders_timestamp', 'orders (timestamp, id)'),
+    # ?status= pages, and closed orders past the archive cutoff
+    ('idx_orders_status_timestamp', 'orders (status, timestamp, id)'),
+    ('idx_orders_table_timestamp', 'orders (table_number, timestamp, id)'),
+    # Only open kitchen tickets
+    ('idx_orders_kitchen', "orders (status) WHERE status IN ('paid', 'preparing')"),
+    ('idx_order_items_order', 'order_items (order_id, line_no)'),
+    ('idx_order_items_menu_item', 'order_items (menu_item_id)'),
+)
+
+
+def upgrade() -> None:
+    for name, definition in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def downgrade() -> None:
+    for name, _ in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -0,0 +1,36 @@
+"""Payment and webhook indexes
+
+Payments by order and by time, the pending payments the reconciliation
+job pages through, intent lookups for webhooks, and the undelivered part
+of the webhook inbox.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 23:45:00
+"""
+
+from alembic import op
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('idx_payments_order', 'payments (order_id, status)'),
+    # GET /api/payments and (timestamp, id) export chunks
+    ('idx_payments_timestamp', 'payments (timestamp, id)'),
+    ('idx_payments_pending', "payments (id) WHERE status = 'pending'"),
+    ('idx_payments_transaction', 'payments (transaction_id)'),
+    ('idx_webhook_events_pending', 'webhook_events (processed_at) WHERE processed_at IS NULL'),
+)
+
+
+def upgrade() -> None:
+    for name, definition in INDEXES:
+        op.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {definition}')
+
+
+def downgrade() -> None:
+    for name, _ in INDEXES:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
@@ -0,0 +1,36 @@
+"""Idempotency keys
+
+Idempotency-Key claims and stored responses, shared by every worker
+process and kept across restarts.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 10:30:00
+"""
+
+from alembic import op
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            fingerprint TEXT NOT NULL,
+            owner TEXT,                -- claim token while the first request runs, NULL once done
+            status_code INTEGER,
+            response TEXT,             -- JSON body, or {"detail": ..., "headers": ...} for errors
+            expires_at REAL NOT NULL,  -- unix time; a lease while running, the TTL once done
+            UNIQUE (scope, key)
+        )
+    ''')
+    op.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys (expires_at)')
+
+
+def downgrade() -> None:
+    op.execute('DROP TABLE IF EXISTS idempotency_keys')
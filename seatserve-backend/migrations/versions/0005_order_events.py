@@ -0,0 +1,32 @@
+"""Order events
+
+Outbox of order status events, relayed to the other worker processes'
+SSE subscribers and kitchen queues.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17 11:15:00
+"""
+
+from alembic import op
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute('''
+        CREATE TABLE IF NOT EXISTS order_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,  -- never reused, so workers can track the last one seen
+            origin TEXT NOT NULL,                  -- worker that published it
+            payload TEXT NOT NULL,                 -- JSON event
+            created_at REAL NOT NULL               -- unix time, for pruning
+        )
+    ''')
+    op.execute('CREATE INDEX IF NOT EXISTS idx_order_events_created ON order_events (created_at)')
+
+
+def downgrade() -> None:
+    op.execute('DROP TABLE IF EXISTS order_events')
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Order Events
+Pub/sub for order status changes, relayed between workers and streamed to clients over SSE
+"""
+
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Set, Tuple
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+
+from database import Database, db
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv('SEATSERVE_EVENTS_QUEUE_SIZE', '32'))
+KEEPALIVE_SECONDS = float(os.getenv('SEATSERVE_EVENTS_KEEPALIVE', '15'))
+# How often each worker looks for events published by the others
+EVENTS_POLL_SECONDS = float(os.getenv('SEATSERVE_EVENTS_POLL_SECONDS', '0.2'))
+# How long relayed events stay in the order_events table
+EVENTS_RETENTION_SECONDS = float(os.getenv('SEATSERVE_EVENTS_RETENTION_SECONDS', '60'))
+EVENTS_BATCH_SIZE = int(os.getenv('SEATSERVE_EVENTS_BATCH_SIZE', '500'))
+# Events kept for the relay while the database is unavailable
+EVENTS_OUTBOX_SIZE = 10000
+
+
+def order_topic(order_id: int) -> str:
+    return f"order:{order_id}"
+
+
+def table_topic(table_number: int) -> str:
+    return f"table:{table_number}"
+
+
+class Subscription:
+    """One client's bounded event queue, owned by the loop that created it"""
+
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize)
+
+    def _put(self, event: dict) -> None:
+        # Status streams only care about the latest state: a slow client
+        # loses its oldest pending event rather than stalling publishers
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    def deliver(self, event: dict) -> bool:
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+            return True
+        except RuntimeError:
+            # The subscriber's event loop is gone
+            return False
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class OrderEventBroker:
+    """Fans order status events out to subscribers by order and by table.
+
+    Publishing is O(subscribers of the event's topics) and never blocks;
+    events are handed to each subscriber's own loop. While an
+    ``EventRelay`` is running, published events are also queued for it,
+    so subscribers in other worker processes get them too.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.origin = uuid.uuid4().hex
+        self.relay: Optional["EventRelay"] = None
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._listeners: List[Callable[[dict], None]] = []
+        self._ids = itertools.count(1)
+
+    def add_listener(self, listener: Callable[[dict], None]) -> None:
+        """Call ``listener`` synchronously with every published event"""
+        self._listeners.append(listener)
+
+    def subscribe(self, topic: str) -> Subscription:
+        subscription = Subscription(topic, self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is None:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.topic]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(
+        self,
+        event_type: str,
+        order_id: int,
+        table_number: Optional[int],
+        status: str,
+        **fields,
+    ) -> dict:
+        """Send an order event to the order's and the table's subscribers"""
+        event = {
+            "id": next(self._ids),
+            "type": event_type,
+            "order_id": order_id,
+            "table_number": table_number,
+            "status": status,
+            **fields,
+        }
+        self.deliver(event)
+        if self.relay is not None:
+            self.relay.send(event)
+        return event
+
+    def deliver(self, event: dict) -> None:
+        """Hand an event to this process's listeners and subscribers"""
+        for listener in self._listeners:
+            listener(event)
+        topics = [order_topic(event["order_id"])]
+        if event["table_number"] is not None:
+            topics.append(table_topic(event["table_number"]))
+        for topic in topics:
+            for subscription in tuple(self._subscribers.get(topic, ())):
+                if not subscription.deliver(event):
+                    self.unsubscribe(subscription)
+
+
+def last_event_id(conn: sqlite3.Connection) -> int:
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM order_events').fetchone()[0]
+
+
+def exchange_events(conn: sqlite3.Connection, origin: str, outgoing: List[dict], after_id: int,
+                    retention: float, limit: int) -> List[Tuple[int, str, str]]:
+    """Append this worker's events, then read every worker's events after ``after_id``
+
+    Events older than ``retention`` seconds are pruned whenever new ones are written.
+    """
+    if outgoing:
+        now = time.time()
+        conn.executemany(
+            'INSERT INTO order_events (origin, payload, created_at) VALUES (?, ?, ?)',
+            [(origin, json.dumps(event), now) for event in outgoing]
+        )
+        conn.execute('DELETE FROM order_events WHERE created_at < ?', (now - retention,))
+        conn.commit()
+    return conn.execute(
+        'SELECT id, origin, payload FROM order_events WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit)
+    ).fetchall()
+
+
+class EventRelay:
+    """Background task sharing order events between worker processes.
+
+    Events published here are written to the ``order_events`` table, and
+    events written by other workers are handed to this process's
+    subscribers and listeners (such as the kitchen queues). ``send()``
+    wakes it as soon as an event is published; the poll interval bounds
+    how long other workers' events take to arrive.
+    """
+
+    def __init__(self, database: Database, broker: OrderEventBroker, interval: float = EVENTS_POLL_SECONDS,
+                 retention: float = EVENTS_RETENTION_SECONDS, batch_size: int = EVENTS_BATCH_SIZE):
+        self.database = database
+        self.broker = broker
+        self.interval = interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self._outbox: Deque[dict] = deque(maxlen=EVENTS_OUTBOX_SIZE)
+        self._last_id = 0
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def send(self, event: dict) -> None:
+        """Queue a locally published event for the other workers"""
+        self._outbox.append(event)
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # The relay's event loop is gone
+            pass
+
+    async def sync(self) -> int:
+        """Write queued events and deliver other workers' new ones; returns how many were delivered"""
+        delivered = 0
+        while True:
+            outgoing = [self._outbox.popleft() for _ in range(len(self._outbox))]
+            try:
+                rows = await self.database.run(
+                    exchange_events, self.broker.origin, outgoing, self._last_id, self.retention,
+                    self.batch_size, name="exchange_events"
+                )
+            except BaseException:
+                self._outbox.extendleft(reversed(outgoing))
+                raise
+            for event_id, origin, payload in rows:
+                self._last_id = event_id
+                if origin != self.broker.origin:
+                    self.broker.deliver(json.loads(payload))
+                    delivered += 1
+            if len(rows) < self.batch_size:
+                return delivered
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"❌ Error relevando eventos de ordenes: {str(e)}")
+            if self._loop is None:
+                return
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def start(self) -> None:
+        """Skip events from before startup, then relay from here on"""
+        self._last_id = await self.database.run(last_event_id, name="last_event_id")
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.broker.relay = self
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Finish the current pass, handing over anything already published, and stop"""
+        task, self._task = self._task, None
+        self.broker.relay = None
+        self._loop = None
+        if task is not None:
+            # Not cancelled: a write interrupted mid-flight could be sent twice
+            self._wakeup.set()
+            await task
+        if self._outbox:
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"❌ Error relevando eventos de ordenes: {str(e)}")
+
+
+def format_sse(event: dict) -> str:
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+async def event_stream(
+    subscription: Subscription,
+    initial: Optional[dict] = None,
+    keepalive: float = KEEPALIVE_SECONDS,
+) -> AsyncIterator[str]:
+    """Yield SSE frames for a subscription until the client goes away"""
+    try:
+        if initial is not None:
+            yield format_sse(initial)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                # Comment frame keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+broker = OrderEventBroker()
+event_relay = EventRelay(db, broker)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Order Storage
+Normalized order line items and the helpers that read and write them
+"""
+
+from typing import Dict, Iterable, List, Sequence
+import json
+import sqlite3
+
+# Item keys stored in their own columns, with the value types each column
+# accepts. Anything else (unexpected keys, None, odd types) is kept verbatim
+# in the ``extra`` JSON column so the original dict round-trips exactly.
+_ITEM_COLUMNS = (
+    ("id", (int, str)),
+    ("name", (str,)),
+    ("price", (int, float)),
+    ("qty", (int,)),
+)
+
+
+def _item_row(order_id: int, line_no: int, item: dict) -> tuple:
+    values = {}
+    extra = dict(item)
+    for key, types in _ITEM_COLUMNS:
+        value = item.get(key)
+        if value is not None and isinstance(value, types) and not isinstance(value, bool):
+            values[key] = extra.pop(key)
+    return (
+        order_id,
+        line_no,
+        values.get("id"),
+        values.get("name"),
+        values.get("qty"),
+        values.get("price"),
+        json.dumps(extra) if extra else None,
+    )
+
+
+def insert_order_items(conn: sqlite3.Connection, order_id: int, items: Sequence[dict]) -> None:
+    """Write an order's line items; the caller owns the transaction"""
+    conn.executemany('''
+        INSERT INTO order_items (order_id, line_no, menu_item_id, name, qty, unit_price, extra)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [_item_row(order_id, line_no, item) for line_no, item in enumerate(items)])
+
+
+def _item_dict(menu_item_id, name, qty, unit_price, extra) -> dict:
+    item = {}
+    if menu_item_id is not None:
+        item["id"] = menu_item_id
+    if name is not None:
+        item["name"] = name
+    if unit_price is not None:
+        item["price"] = unit_price
+    if qty is not None:
+        item["qty"] = qty
+    if extra:
+        item.update(json.loads(extra))
+    return item
+
+
+def load_order_items(conn: sqlite3.Connection, order_ids: Iterable[int],
+                     schema: str = "main") -> Dict[int, List[dict]]:
+    """Fetch line items for many orders in one query, keyed by order id"""
+    order_ids = list(order_ids)
+    items: Dict[int, List[dict]] = {order_id: [] for order_id in order_ids}
+    if not order_ids:
+        return items
+    placeholders = ",".join("?" * len(order_ids))
+    rows = conn.execute(f'''
+        SELECT order_id, menu_item_id, name, qty, unit_price, extra
+        FROM {schema}.order_items
+        WHERE order_id IN ({placeholders})
+        ORDER BY order_id, line_no
+    ''', order_ids)
+    for order_id, *columns in rows:
+        items[order_id].append(_item_dict(*columns))
+    return items
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Payment Gateway
+Async Stripe client with pooled keep-alive connections and bounded concurrency
+"""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import os
+import time
+
+import httpx
+
+from metrics import stripe_request_duration
+
+STRIPE_API_BASE = os.getenv('SEATSERVE_STRIPE_API_BASE', 'https://api.stripe.com')
+CONNECT_TIMEOUT = float(os.getenv('SEATSERVE_STRIPE_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.getenv('SEATSERVE_STRIPE_READ_TIMEOUT', '10'))
+MAX_CONNECTIONS = int(os.getenv('SEATSERVE_STRIPE_MAX_CONNECTIONS', '32'))
+MAX_CONCURRENCY = int(os.getenv('SEATSERVE_STRIPE_MAX_CONCURRENCY', '32'))
+
+
+class GatewayError(Exception):
+    """The gateway rejected a request, or could not be reached"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, retryable: bool = False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retryable = retryable
+
+
+@dataclass
+class PaymentIntent:
+    id: str
+    client_secret: Optional[str]
+    status: str
+    amount: int
+    currency: str
+    metadata: Dict[str, str]
+    created: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "object": "payment_intent",
+            "status": self.status,
+            "amount": self.amount,
+            "currency": self.currency,
+            "metadata": self.metadata,
+            "created": self.created,
+        }
+
+
+class PaymentGateway(ABC):
+    """Interface the API uses to talk to a payment provider"""
+
+    @abstractmethod
+    async def create_payment_intent(
+        self,
+        amount: int,
+        currency: str,
+        metadata: Optional[Dict[str, str]] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> PaymentIntent:
+        """Create an intent for ``amount`` in the currency's smallest unit"""
+
+    @abstractmethod
+    async def retrieve_payment_intent(self, intent_id: str) -> PaymentIntent:
+        """Fetch one intent by id"""
+
+    @abstractmethod
+    async def list_payment_intents(
+        self,
+        created_gte: Optional[int] = None,
+        starting_after: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[PaymentIntent], bool]:
+        """One page of intents, newest first, and whether more pages follow"""
+
+    async def aclose(self) -> None:
+        """Release connections; nothing to do by default"""
+
+
+def _form_encode(params: Dict[str, Any], prefix: str = "") -> List[Tuple[str, str]]:
+    # Stripe expects nested values as bracketed form keys: metadata[order_data]=...
+    pairs = []
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else key
+        if isinstance(value, dict):
+            pairs.extend(_form_encode(value, name))
+        elif isinstance(value, bool):
+            pairs.append((name, "true" if value else "false"))
+        elif value is not None:
+            pairs.append((name, str(value)))
+    return pairs
+
+
+def _intent_from_json(data: dict) -> PaymentIntent:
+    return PaymentIntent(
+        id=data["id"],
+        client_secret=data.get("client_secret"),
+        status=data.get("status", ""),
+        amount=data.get("amount", 0),
+        currency=data.get("currency", ""),
+        metadata=data.get("metadata") or {},
+        created=data.get("created", 0),
+    )
+
+
+class StripeGateway(PaymentGateway):
+    """Stripe REST client that never blocks the event loop.
+
+    Requests share one ``httpx.AsyncClient`` per event loop, so TLS
+    connections to Stripe stay open between checkouts. Connect and read
+    timeouts are explicit, and a semaphore caps in-flight Stripe calls so
+    a slow gateway cannot pile up unbounded work. Point ``base_url`` at a
+    local stub (see stripe_stub.py) for tests and benchmarks.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = STRIPE_API_BASE,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        max_connections: int = MAX_CONNECTIONS,
+        max_concurrency: int = MAX_CONCURRENCY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self._transport = transport
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _session(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        # Connections and semaphores belong to the loop that created them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=(self.api_key, ""),
+                timeout=self.timeout,
+                limits=self.limits,
+                transport=self._transport,
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client, self._semaphore
+
+    async def _request(self, operation: str, method: str, path: str, **kwargs) -> dict:
+        client, semaphore = self._session()
+        outcome = "error"
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                if response.status_code >= 400:
+                    try:
+                        message = response.json()["error"]["message"]
+                    except (ValueError, KeyError, TypeError):
+                        message = response.text or f"HTTP {response.status_code}"
+                    raise GatewayError(
+                        message, response.status_code,
+                        retryable=response.status_code == 429 or response.status_code >= 500,
+                    )
+                outcome = "ok"
+                return response.json()
+            except httpx.TimeoutException as e:
+                outcome = "timeout"
+                raise GatewayError(f"Stripe request timed out: {e}", retryable=True)
+            except httpx.HTTPError as e:
+                raise GatewayError(f"Stripe request failed: {e}", retryable=True)
+            finally:
+                stripe_request_duration.labels(operation, outcome).observe(time.perf_counter() - started)
+
+    async def create_payment_intent(
+        self,
+        amount: int,
+        currency: str,
+        metadata: Optional[Dict[str, str]] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> PaymentIntent:
+        # Stripe dedupes on Idempotency-Key too, covering retries that reach
+        # a different worker or outlive our own idempotency store
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else None
+        data = await self._request(
+            "payment_intent.create", "POST", "/v1/payment_intents",
+            headers=headers,
+            data=dict(_form_encode({
+                "amount": amount,
+                "currency": currency,
+                "automatic_payment_methods": {"enabled": True},
+                "metadata": metadata or {},
+            })),
+        )
+        return _intent_from_json(data)
+
+    async def retrieve_payment_intent(self, intent_id: str) -> PaymentIntent:
+        data = await self._request("payment_intent.retrieve", "GET", f"/v1/payment_intents/{intent_id}")
+        return _intent_from_json(data)
+
+    async def list_payment_intents(
+        self,
+        created_gte: Optional[int] = None,
+        starting_after: Optional[str] = None,
+        limit: int = 100,
+    ) -> Tuple[List[PaymentIntent], bool]:
+        params = {"limit": limit, "created": {"gte": created_gte}, "starting_after": starting_after}
+        data = await self._request(
+            "payment_intent.list", "GET", "/v1/payment_intents", params=_form_encode(params)
+        )
+        return [_intent_from_json(item) for item in data.get("data", [])], bool(data.get("has_more"))
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                await client.aclose()
+            except RuntimeError:
+                # Created on a loop that has since closed
+                pass
+
+
+gateway: PaymentGateway = StripeGateway(os.getenv('STRIPE_SECRET_KEY', ''))
+
+
+def get_payment_gateway() -> PaymentGateway:
+    """FastAPI dependency returning the configured payment gateway"""
+    return gateway
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Payment Settlement
+Applies payment outcomes to payments and orders, checking gateway amounts against the order total
+"""
+
+from typing import Optional, Tuple
+import logging
+import sqlite3
+
+from kitchen import mark_paid
+
+logger = logging.getLogger(__name__)
+
+# Succeeded at the gateway for a different amount than the order total;
+# the order stays unpaid until someone looks at it
+REVIEW_STATUS = 'review'
+
+# Order events to publish once the transaction commits: (event_type, order_id, table_number, status, fields)
+Notification = Tuple[str, int, Optional[int], Optional[str], dict]
+
+
+def intent_order_id(metadata: Optional[dict]) -> Optional[int]:
+    """Order id a payment intent was created for, from its metadata"""
+    try:
+        return int((metadata or {})['order_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def order_total_cents(conn: sqlite3.Connection, order_id: int) -> Optional[int]:
+    """Server-priced order total in cents, or None if the order doesn't exist"""
+    row = conn.execute('SELECT total FROM orders WHERE id = ?', (order_id,)).fetchone()
+    return None if row is None else round(row[0] * 100)
+
+
+def settle_payment(conn: sqlite3.Connection, payment_id: int, order_id: int, outcome: str,
+                   amount_cents: Optional[int] = None) -> Optional[Notification]:
+    """Record a payment's outcome in the caller's transaction and return the event to publish.
+
+    ``outcome`` is ``completed`` or ``failed``. A completed payment marks
+    the order paid (and queues it for the kitchen), unless ``amount_cents``
+    (what the gateway actually collected) differs from the order total;
+    the payment is then set to ``review`` and the order left as it is.
+    Only pending payments can fail or go to review, so a late or replayed
+    failure never undoes a completed payment; returns None when nothing
+    changed.
+    """
+    if outcome == 'completed' and amount_cents is not None and amount_cents != order_total_cents(conn, order_id):
+        outcome = REVIEW_STATUS
+        logger.warning(f"⚠️ Pago {payment_id} por {amount_cents / 100:.2f} no coincide con el total de la orden {order_id}")
+
+    if outcome == 'completed':
+        conn.execute('UPDATE payments SET status = ? WHERE id = ?', (outcome, payment_id))
+    else:
+        cursor = conn.execute(
+            "UPDATE payments SET status = ? WHERE id = ? AND status = 'pending'", (outcome, payment_id)
+        )
+        if cursor.rowcount == 0:
+            return None
+
+    extra = {"payment_id": payment_id, "payment_status": outcome}
+    if outcome == 'completed':
+        fields = mark_paid(conn, order_id) or {"table_number": None, "status": "paid"}
+        table_number, status = fields.pop("table_number"), fields.pop("status")
+        return ("order.paid", order_id, table_number, status, {**extra, **fields})
+
+    row = conn.execute('SELECT table_number, status FROM orders WHERE id = ?', (order_id,)).fetchone()
+    event_type = "payment.review" if outcome == REVIEW_STATUS else "payment.failed"
+    return (event_type, order_id, row[0] if row else None, row[1] if row else None, extra)
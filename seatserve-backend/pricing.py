@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Pricing
+Server-side cart pricing against the cached menu price index, with tax rules
+"""
+
+from dataclasses import dataclass
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Optional
+import os
+
+# Default sales tax, and per-category overrides: "Beverages=0.05,Groceries=0"
+TAX_RATE = Decimal(os.getenv('SEATSERVE_TAX_RATE', '0.07'))
+MAX_ORDER_LINES = int(os.getenv('SEATSERVE_MAX_ORDER_LINES', '100'))
+MAX_ITEM_QTY = int(os.getenv('SEATSERVE_MAX_ITEM_QTY', '99'))
+
+_CENT = Decimal('0.01')
+
+
+def _parse_tax_rates(spec: str) -> Dict[str, Decimal]:
+    rates = {}
+    for part in spec.split(','):
+        if '=' in part:
+            category, rate = part.split('=', 1)
+            rates[category.strip()] = Decimal(rate.strip())
+    return rates
+
+
+CATEGORY_TAX_RATES = _parse_tax_rates(os.getenv('SEATSERVE_TAX_RATES', ''))
+
+
+class PricingError(Exception):
+    """A cart that cannot be priced; carries the HTTP status to answer with"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass(frozen=True)
+class MenuPrice:
+    id: int
+    name: str
+    price: Decimal
+    category: str
+    available: bool
+
+
+@dataclass(frozen=True)
+class PricedOrder:
+    items: List[dict]
+    subtotal: Decimal
+    tax: Decimal
+    total: Decimal
+
+
+def build_price_index(rows: List[tuple]) -> Dict[int, MenuPrice]:
+    """Index menu rows (id, name, description, price, category, available) by id"""
+    return {
+        row[0]: MenuPrice(
+            id=row[0],
+            name=row[1],
+            price=Decimal(str(row[3])).quantize(_CENT),
+            category=row[4],
+            available=bool(row[5]),
+        )
+        for row in rows
+    }
+
+
+def _menu_item_id(value) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+class TaxRules:
+    """Tax rate per menu category, falling back to a default rate"""
+
+    def __init__(self, default_rate: Decimal = TAX_RATE, category_rates: Optional[Dict[str, Decimal]] = None):
+        self.default_rate = default_rate
+        self.category_rates = CATEGORY_TAX_RATES if category_rates is None else category_rates
+
+    def rate(self, category: str) -> Decimal:
+        return self.category_rates.get(category, self.default_rate)
+
+
+def price_order(index: Dict[int, MenuPrice], items: List[dict], tax_rules: TaxRules) -> PricedOrder:
+    """Validate a cart and price it from the index; O(items), no database access.
+
+    Each item needs the ``id`` of an available menu item and an optional
+    integer ``qty`` (default 1). Names and prices always come from the
+    menu; any other keys on an item are kept as-is. Tax is rounded per
+    rate, on the sum of the lines taxed at that rate.
+    """
+    if not items:
+        raise PricingError(422, "Order has no items")
+    if len(items) > MAX_ORDER_LINES:
+        raise PricingError(422, f"Order has more than {MAX_ORDER_LINES} items")
+
+    priced = []
+    subtotal = Decimal(0)
+    taxable: Dict[Decimal, Decimal] = {}
+    for line, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            raise PricingError(422, f"Item {line} must be an object")
+        menu_item_id = _menu_item_id(item.get('id'))
+        entry = index.get(menu_item_id) if menu_item_id is not None else None
+        if entry is None:
+            raise PricingError(422, f"Unknown menu item: {item.get('id')!r}")
+        if not entry.available:
+            raise PricingError(409, f"Menu item not available: {entry.name}")
+        qty = item.get('qty', 1)
+        if isinstance(qty, bool) or not isinstance(qty, int) or not 1 <= qty <= MAX_ITEM_QTY:
+            raise PricingError(422, f"Item {line} qty must be a whole number from 1 to {MAX_ITEM_QTY}")
+
+        line_total = entry.price * qty
+        subtotal += line_total
+        rate = tax_rules.rate(entry.category)
+        taxable[rate] = taxable.get(rate, Decimal(0)) + line_total
+
+        extra = {key: value for key, value in item.items() if key not in ('id', 'name', 'price', 'qty')}
+        priced.append({"id": entry.id, "name": entry.name, "price": float(entry.price), "qty": qty, **extra})
+
+    tax = sum(
+        ((amount * rate).quantize(_CENT, rounding=ROUND_HALF_UP) for rate, amount in taxable.items()),
+        Decimal(0)
+    )
+    return PricedOrder(items=priced, subtotal=subtotal, tax=tax, total=subtotal + tax)
+
+
+tax_rules = TaxRules()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Payment Reconciliation
+Bulk job matching local payments against gateway payment intents and fixing stale statuses
+
+Usage:
+    python reconciliation.py --since-hours 72
+    python reconciliation.py --dry-run
+"""
+
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+from payment_gateway import GatewayError, PaymentGateway, PaymentIntent
+from payments import REVIEW_STATUS, Notification, intent_order_id, settle_payment
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_LOOKBACK_HOURS = float(os.getenv('SEATSERVE_RECONCILE_LOOKBACK_HOURS', '72'))
+# Stripe list pages hold at most 100 intents
+RECONCILE_PAGE_SIZE = int(os.getenv('SEATSERVE_RECONCILE_PAGE_SIZE', '100'))
+RECONCILE_BATCH_SIZE = int(os.getenv('SEATSERVE_RECONCILE_BATCH_SIZE', '200'))
+# Parallel retrieves for pending payments outside the listed window
+RECONCILE_CONCURRENCY = int(os.getenv('SEATSERVE_RECONCILE_CONCURRENCY', '8'))
+
+# Final intent statuses and the payment status each one settles to
+INTENT_OUTCOMES = {"succeeded": "completed", "canceled": "failed"}
+
+
+@dataclass
+class Correction:
+    """A local payment to settle from a gateway intent.
+
+    ``payment_id`` is None when the intent succeeded for an order that has
+    no payment row at all; applying it records one.
+    """
+    payment_id: Optional[int]
+    order_id: int
+    intent: PaymentIntent
+    status: str
+
+
+@dataclass
+class ReconcileReport:
+    intents: int = 0
+    pending_payments: int = 0
+    retrieved: int = 0
+    completed: int = 0
+    failed: int = 0
+    recorded: int = 0
+    # Succeeded for a different amount than the order total
+    review: int = 0
+    still_pending: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def load_pending_payments(conn: sqlite3.Connection, after_id: int, limit: int) -> List[tuple]:
+    """One keyset page of pending payments: (id, order_id, transaction_id)"""
+    return conn.execute('''
+        SELECT id, order_id, transaction_id FROM payments
+        WHERE status = 'pending' AND id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (after_id, limit)).fetchall()
+
+
+def load_order_matches(conn: sqlite3.Connection, order_ids: List[int],
+                       intent_ids: List[str]) -> Tuple[Set[str], Dict[int, int]]:
+    """For one page of listed intents: the intent ids a payment already
+    carries, and each order's oldest pending payment recorded without an intent id
+    """
+    intent_marks = ",".join("?" * len(intent_ids))
+    carried = {row[0] for row in conn.execute(
+        f'SELECT transaction_id FROM payments WHERE transaction_id IN ({intent_marks})', intent_ids
+    )}
+    order_marks = ",".join("?" * len(order_ids))
+    unmatched: Dict[int, int] = {}
+    for payment_id, order_id in conn.execute(f'''
+        SELECT id, order_id FROM payments
+        WHERE status = 'pending' AND order_id IN ({order_marks})
+          AND (transaction_id IS NULL OR substr(transaction_id, 1, 3) <> 'pi_')
+        ORDER BY id DESC
+    ''', order_ids):
+        unmatched[order_id] = payment_id
+    return carried, unmatched
+
+
+def _apply_correction(conn: sqlite3.Connection, correction: Correction) -> Optional[Notification]:
+    intent = correction.intent
+    if correction.payment_id is None:
+        # Only record a payment the order doesn't already have
+        exists = conn.execute('''
+            SELECT 1 FROM payments
+            WHERE transaction_id = ? OR (order_id = ? AND status = 'completed')
+        ''', (intent.id, correction.order_id)).fetchone()
+        if exists or conn.execute('SELECT 1 FROM orders WHERE id = ?', (correction.order_id,)).fetchone() is None:
+            return None
+        payment_id = conn.execute('''
+            INSERT INTO payments (order_id, amount, payment_method, status, transaction_id, timestamp)
+            VALUES (?, ?, 'card', 'pending', ?, ?)
+        ''', (correction.order_id, intent.amount / 100, intent.id, datetime.now().isoformat())).lastrowid
+    else:
+        # Skip payments someone settled since they were read, and order
+        # matches for intents another payment already carries
+        payment_id = correction.payment_id
+        cursor = conn.execute('''
+            UPDATE payments SET transaction_id = ?
+            WHERE id = ? AND status = 'pending'
+              AND (transaction_id = ? OR NOT EXISTS (SELECT 1 FROM payments WHERE transaction_id = ?))
+        ''', (intent.id, payment_id, intent.id, intent.id))
+        if cursor.rowcount == 0:
+            return None
+
+    # Only collected amounts are checked; a canceled intent fails the payment either way
+    amount_cents = intent.amount if correction.status == "completed" else None
+    return settle_payment(conn, payment_id, correction.order_id, correction.status, amount_cents)
+
+
+def apply_corrections(conn: sqlite3.Connection, corrections: List[Correction]) -> List[Tuple[Correction, Notification]]:
+    """Apply a batch of corrections in one transaction.
+
+    Returns the corrections that took effect, each with the order event to
+    publish once the batch has committed.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        applied = []
+        for correction in corrections:
+            notification = _apply_correction(conn, correction)
+            if notification is not None:
+                applied.append((correction, notification))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return applied
+
+
+class Reconciler:
+    """Settles pending payments from the gateway's view of their intents.
+
+    Works in two passes, each holding one page at a time, so memory does
+    not grow with the number of payments or intents. Local pending
+    payments are read in keyset pages and each one's intent is retrieved
+    by its ``transaction_id``, a bounded number at a time. Then the
+    intents created in the lookback window are listed page by page and
+    matched by their ``order_id`` metadata, for payments recorded without
+    an intent id and for paid intents with no payment at all. Corrections
+    are written in batched transactions as each page is matched and
+    announced like webhook updates.
+    """
+
+    def __init__(
+        self,
+        database,
+        gateway: PaymentGateway,
+        broker=None,
+        page_size: int = RECONCILE_PAGE_SIZE,
+        batch_size: int = RECONCILE_BATCH_SIZE,
+        concurrency: int = RECONCILE_CONCURRENCY,
+    ):
+        self.database = database
+        self.gateway = gateway
+        self.broker = broker
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+
+    async def _retrieve(self, intent_ids: List[str], report: ReconcileReport) -> Dict[str, PaymentIntent]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def retrieve(intent_id: str) -> Optional[PaymentIntent]:
+            async with semaphore:
+                try:
+                    return await self.gateway.retrieve_payment_intent(intent_id)
+                except GatewayError as e:
+                    report.errors.append(f"{intent_id}: {e}")
+                    return None
+
+        found = await asyncio.gather(*[retrieve(intent_id) for intent_id in intent_ids])
+        report.retrieved += sum(1 for intent in found if intent is not None)
+        return {intent.id: intent for intent in found if intent is not None}
+
+    async def _settle(self, corrections: List[Correction], report: ReconcileReport, dry_run: bool) -> int:
+        """Write corrections (or only count them on a dry run); returns how many pending payments they settled"""
+        if dry_run:
+            for correction in corrections:
+                self._count(report, correction)
+            return sum(1 for correction in corrections if correction.payment_id is not None)
+
+        settled = 0
+        for start in range(0, len(corrections), self.batch_size):
+            batch = corrections[start:start + self.batch_size]
+            applied = await self.database.run(apply_corrections, batch, name="reconcile_batch")
+            for correction, (event_type, order_id, table_number, status, fields) in applied:
+                if fields["payment_status"] == REVIEW_STATUS:
+                    report.review += 1
+                else:
+                    self._count(report, correction)
+                if correction.payment_id is not None:
+                    settled += 1
+                if self.broker is not None:
+                    self.broker.publish(event_type, order_id, table_number, status, **fields)
+        return settled
+
+    async def _reconcile_pending(self, report: ReconcileReport, dry_run: bool) -> int:
+        """Settle pending payments from the intents their ``transaction_id`` points at"""
+        settled = 0
+        after_id = 0
+        while True:
+            rows = await self.database.run(
+                load_pending_payments, after_id, self.page_size, name="reconcile_pending_payments"
+            )
+            if not rows:
+                return settled
+            after_id = rows[-1][0]
+            report.pending_payments += len(rows)
+
+            intents = await self._retrieve(
+                [txn for _, _, txn in rows if txn and txn.startswith("pi_")], report
+            )
+            corrections = []
+            for payment_id, order_id, transaction_id in rows:
+                intent = intents.get(transaction_id)
+                outcome = INTENT_OUTCOMES.get(intent.status) if intent is not None else None
+                if outcome is not None:
+                    corrections.append(Correction(payment_id, order_id, intent, outcome))
+            settled += await self._settle(corrections, report, dry_run)
+
+    async def _match_page(self, page: List[PaymentIntent]) -> List[Correction]:
+        # Per order on this page, the newest succeeded intent, or failing
+        # that the newest canceled one
+        by_order: Dict[int, PaymentIntent] = {}
+        for intent in page:
+            order_id = intent_order_id(intent.metadata)
+            if order_id is not None and intent.status in INTENT_OUTCOMES:
+                current = by_order.get(order_id)
+                rank = (intent.status == "succeeded", intent.created)
+                if current is None or rank > (current.status == "succeeded", current.created):
+                    by_order[order_id] = intent
+        if not by_order:
+            return []
+
+        carried, unmatched = await self.database.run(
+            load_order_matches, list(by_order), [intent.id for intent in by_order.values()],
+            name="reconcile_order_matches"
+        )
+        corrections = []
+        for order_id, intent in by_order.items():
+            # A payment carrying the intent was settled by the first pass
+            if intent.id in carried:
+                continue
+            payment_id = unmatched.get(order_id)
+            if payment_id is not None:
+                corrections.append(Correction(payment_id, order_id, intent, INTENT_OUTCOMES[intent.status]))
+            elif intent.status == "succeeded":
+                # Paid intents no local payment points at (e.g. the webhook never arrived)
+                corrections.append(Correction(None, order_id, intent, "completed"))
+        return corrections
+
+    async def _reconcile_listed(self, since: datetime, report: ReconcileReport, dry_run: bool) -> int:
+        """Match the intents created since ``since`` to orders, one listed page at a time"""
+        settled = 0
+        starting_after = None
+        while True:
+            page, has_more = await self.gateway.list_payment_intents(
+                created_gte=int(since.timestamp()), starting_after=starting_after, limit=self.page_size
+            )
+            report.intents += len(page)
+            settled += await self._settle(await self._match_page(page), report, dry_run)
+            if not has_more or not page:
+                return settled
+            starting_after = page[-1].id
+
+    async def run(self, since: Optional[datetime] = None, dry_run: bool = False) -> ReconcileReport:
+        since = since or datetime.now() - timedelta(hours=RECONCILE_LOOKBACK_HOURS)
+        report = ReconcileReport()
+        settled = await self._reconcile_pending(report, dry_run)
+        settled += await self._reconcile_listed(since, report, dry_run)
+        report.still_pending = report.pending_payments - settled
+        logger.info(
+            f"🧾 Conciliacion: {report.completed} completados, {report.failed} fallidos, "
+            f"{report.recorded} registrados, {report.review} en revision, {report.still_pending} pendientes"
+        )
+        return report
+
+    @staticmethod
+    def _count(report: ReconcileReport, correction: Correction) -> None:
+        if correction.payment_id is None:
+            report.recorded += 1
+        elif correction.status == "completed":
+            report.completed += 1
+        else:
+            report.failed += 1
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Reconcile SeatServe payments against Stripe")
+    parser.add_argument("--since-hours", type=float, default=RECONCILE_LOOKBACK_HOURS,
+                        help="list gateway intents created this far back")
+    parser.add_argument("--dry-run", action="store_true", help="report corrections without writing them")
+    args = parser.parse_args()
+
+    from database import db
+    from payment_gateway import gateway
+
+    # Order events published here would only reach this process; kitchen
+    # queues pick the paid orders up when the API next starts. Use
+    # POST /api/payments/reconcile to reconcile inside a running API.
+    async def reconcile() -> ReconcileReport:
+        try:
+            return await Reconciler(db, gateway).run(
+                since=datetime.now() - timedelta(hours=args.since_hours), dry_run=args.dry_run
+            )
+        finally:
+            await gateway.aclose()
+
+    report = asyncio.run(reconcile())
+    print(json.dumps(report.to_dict(), indent=2))
+    return 1 if report.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Request Logging
+Low-overhead ASGI access logging and a non-blocking log queue
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import json
+import logging
+import os
+import queue
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Fraction of requests logged; 5xx responses are always logged
+LOG_SAMPLE_RATE = float(os.getenv('SEATSERVE_LOG_SAMPLE_RATE', '1.0'))
+# Request bodies are only captured when explicitly enabled, and always redacted
+LOG_BODIES = os.getenv('SEATSERVE_LOG_BODIES', '').lower() in ('1', 'true', 'yes')
+LOG_BODY_MAX_BYTES = int(os.getenv('SEATSERVE_LOG_BODY_MAX_BYTES', '2048'))
+
+REDACTED = "***"
+SENSITIVE_KEYS = frozenset({
+    "card", "card_number", "cardnumber", "number", "cvc", "cvv", "exp", "exp_month",
+    "exp_year", "expiry", "client_secret", "clientsecret", "token", "password",
+    "secret", "email", "phone", "address", "billing_details", "name_on_card",
+})
+
+
+def redact(value):
+    """Return a copy of a decoded JSON value with sensitive fields masked"""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if key.lower() in SENSITIVE_KEYS else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [redact(item) for item in value]
+    return value
+
+
+def _describe_body(body: bytes, truncated: bool) -> str:
+    if truncated:
+        return f"<{len(body)}+ bytes, truncated>"
+    try:
+        return json.dumps(redact(json.loads(body)))
+    except ValueError:
+        return f"<{len(body)} bytes, not JSON>"
+
+
+class RequestLoggingMiddleware:
+    """Pure ASGI access logger.
+
+    Logs one line per sampled request with method, path, status and
+    duration. The message is passed as a %-style template with arguments so
+    formatting happens on the log listener thread, not in the request path.
+    Bodies are never buffered up front: when capture is enabled, chunks are
+    copied as the application reads them, up to ``body_max_bytes``.
+    """
+
+    def __init__(
+        self,
+        app,
+        sample_rate: float = LOG_SAMPLE_RATE,
+        log_bodies: bool = LOG_BODIES,
+        body_max_bytes: int = LOG_BODY_MAX_BYTES,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.log_bodies = log_bodies
+        self.body_max_bytes = body_max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        body: Optional[bytearray] = None
+        truncated = False
+        if self.log_bodies and sampled and scope["method"] in ("POST", "PUT"):
+            body = bytearray()
+
+            async def receive_wrapper():
+                nonlocal truncated
+                message = await receive()
+                if message["type"] == "http.request" and not truncated:
+                    chunk = message.get("body", b"")
+                    room = self.body_max_bytes - len(body)
+                    if len(chunk) > room:
+                        body.extend(chunk[:room])
+                        truncated = True
+                    else:
+                        body.extend(chunk)
+                return message
+        else:
+            receive_wrapper = receive
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if sampled or status >= 500:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                logger.info(
+                    "📨 [%s] %s → %d (%.1f ms)",
+                    scope["method"], scope["path"], status, elapsed_ms,
+                )
+                if body:
+                    logger.info("📦 Body recibido: %s", _describe_body(bytes(body), truncated))
+
+
+class _DeferredQueueHandler(QueueHandler):
+    # QueueHandler.prepare() formats the message on the calling thread; the
+    # listener runs in-process, so hand the record over untouched instead.
+    def prepare(self, record):
+        return record
+
+
+_listener: Optional[QueueListener] = None
+
+
+def start_queue_logging() -> None:
+    """Route root logging through an in-memory queue drained by a thread.
+
+    The handlers configured so far (console, files) move behind a
+    QueueListener, so request handlers only pay for an enqueue.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    root = logging.getLogger()
+    handlers = list(root.handlers)
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_queue_logging() -> None:
+    """Flush queued records and restore the original handlers"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _DeferredQueueHandler):
+            root.removeHandler(handler)
+    for handler in _listener.handlers:
+        root.addHandler(handler)
+    _listener = None
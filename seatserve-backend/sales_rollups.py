@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Sales Rollups
+Hourly sales totals per category, menu item and table, kept up to date as orders are written
+"""
+
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import sqlite3
+
+UNCATEGORIZED = "Uncategorized"
+# Order statuses that mean the order has been paid for
+PAID_STATUSES = ('paid', 'preparing', 'ready')
+
+# Rollup table -> key columns. Every rollup carries the same counters.
+# ``orders`` counts orders touching the row; sales are pre-tax, in cents.
+_ROLLUPS = {
+    "hourly": ("sales_hourly", ("hour",)),
+    "categories": ("sales_by_category", ("hour", "category")),
+    "items": ("sales_by_item", ("hour", "menu_item_id")),
+    "tables": ("sales_by_table", ("hour", "table_number")),
+}
+_COUNTERS = ("orders", "quantity", "sales_cents", "paid_orders", "paid_quantity", "paid_sales_cents")
+REPORTS = tuple(_ROLLUPS)
+
+# (menu item id, name, qty, unit price, category) for one order line
+Line = Tuple[object, Optional[str], int, float, str]
+
+
+def to_hour(timestamp: str) -> str:
+    """Rollup bucket of a stored timestamp: 'YYYY-MM-DDTHH' (local time)"""
+    return f"{timestamp[:10]}T{timestamp[11:13]}"
+
+
+class RollupDelta:
+    """Counter increments for a set of orders, grouped by rollup row"""
+
+    def __init__(self):
+        self.rows: Dict[str, Dict[tuple, list]] = {name: {} for name in _ROLLUPS}
+        self.names: Dict[object, Optional[str]] = {}
+
+    def _bump(self, rollup: str, key: tuple, offset: int, quantity: int, cents: int) -> None:
+        counters = self.rows[rollup].get(key)
+        if counters is None:
+            counters = self.rows[rollup][key] = [0] * len(_COUNTERS)
+        counters[offset] += 1
+        counters[offset + 1] += quantity
+        counters[offset + 2] += cents
+
+    def add_order(self, hour: str, table_number: int, lines: Iterable[Line], paid: bool = False) -> None:
+        """Count one order, as placed or (``paid``) as paid, in ``hour``"""
+        offset = 3 if paid else 0
+        categories: Dict[str, List[int]] = {}
+        items: Dict[object, List[int]] = {}
+        quantity = cents = 0
+        for menu_item_id, name, qty, unit_price, category in lines:
+            line_cents = round(unit_price * 100) * qty
+            quantity += qty
+            cents += line_cents
+            totals = categories.setdefault(category, [0, 0])
+            totals[0] += qty
+            totals[1] += line_cents
+            if isinstance(menu_item_id, int):
+                self.names[menu_item_id] = name
+                totals = items.setdefault(menu_item_id, [0, 0])
+                totals[0] += qty
+                totals[1] += line_cents
+
+        self._bump("hourly", (hour,), offset, quantity, cents)
+        self._bump("tables", (hour, table_number), offset, quantity, cents)
+        for category, (qty, line_cents) in categories.items():
+            self._bump("categories", (hour, category), offset, qty, line_cents)
+        for menu_item_id, (qty, line_cents) in items.items():
+            self._bump("items", (hour, menu_item_id), offset, qty, line_cents)
+
+    def apply(self, conn: sqlite3.Connection) -> None:
+        """Add the increments to the rollup tables; the caller owns the transaction"""
+        for rollup, rows in self.rows.items():
+            if not rows:
+                continue
+            table, keys = _ROLLUPS[rollup]
+            columns = keys + _COUNTERS
+            updates = [f"{column} = {column} + excluded.{column}" for column in _COUNTERS]
+            params = [key + tuple(counters) for key, counters in rows.items()]
+            if rollup == "items":
+                columns += ("name",)
+                updates.append("name = excluded.name")
+                params = [row + (self.names[row[1]],) for row in params]
+            conn.executemany(f'''
+                INSERT INTO {table} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})
+                ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {", ".join(updates)}
+            ''', params)
+
+
+_LINES_SQL = '''
+    SELECT i.menu_item_id, i.name, COALESCE(i.qty, 1), COALESCE(i.unit_price, 0),
+           COALESCE(m.category, ?)
+    FROM order_items i
+    LEFT JOIN menu_items m ON m.id = i.menu_item_id
+'''
+
+
+def _order_lines(conn: sqlite3.Connection, order_id: int) -> List[Line]:
+    return conn.execute(
+        _LINES_SQL + 'WHERE i.order_id = ? ORDER BY i.line_no', (UNCATEGORIZED, order_id)
+    ).fetchall()
+
+
+def record_order(conn: sqlite3.Connection, order_id: int, table_number: int, timestamp: str) -> None:
+    """Count a new order (after its items are written) in the caller's transaction"""
+    delta = RollupDelta()
+    delta.add_order(to_hour(timestamp), table_number, _order_lines(conn, order_id))
+    delta.apply(conn)
+
+
+def record_paid(conn: sqlite3.Connection, order_id: int, table_number: int, paid_at: str) -> None:
+    """Count an order as paid, in the hour it was paid, in the caller's transaction.
+
+    Call once per order, when it first moves to paid.
+    """
+    delta = RollupDelta()
+    delta.add_order(to_hour(paid_at), table_number, _order_lines(conn, order_id), paid=True)
+    delta.apply(conn)
+
+
+def _range_bound(value: Optional[str]) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        # Accepts a date, a date and hour, or a full timestamp
+        return to_hour(datetime.fromisoformat(value).isoformat())
+    except ValueError:
+        if len(value) == 13:
+            return to_hour(datetime.fromisoformat(value + ":00").isoformat())
+        raise
+
+
+def report_range(since: Optional[str], until: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Hour bounds for a report; ``since`` defaults to the start of today.
+
+    Raises ValueError for values that aren't ISO dates or timestamps.
+    """
+    start = _range_bound(since)
+    if start is None:
+        start = to_hour(datetime.combine(datetime.now().date(), datetime.min.time()).isoformat())
+    return start, _range_bound(until)
+
+
+def _row_json(keys: tuple, row: tuple) -> dict:
+    data = dict(zip(keys, row))
+    counters = dict(zip(_COUNTERS, row[len(keys):]))
+    data.update(
+        orders=counters["orders"],
+        quantity=counters["quantity"],
+        sales=counters["sales_cents"] / 100,
+        paid_orders=counters["paid_orders"],
+        paid_quantity=counters["paid_quantity"],
+        paid_sales=counters["paid_sales_cents"] / 100,
+    )
+    return data
+
+
+def load_report(conn: sqlite3.Connection, report: str, since: str, until: Optional[str],
+                limit: Optional[int] = None) -> List[dict]:
+    """Totals for hours in [since, until], read from one rollup table.
+
+    ``hourly`` returns one row per hour; the other reports sum the hours
+    per category, menu item or table, highest sales first.
+    """
+    table, keys = _ROLLUPS[report]
+    where = 'hour >= ?' + (' AND hour <= ?' if until else '')
+    params: list = [since] + ([until] if until else [])
+    sums = ", ".join(f"SUM({column})" for column in _COUNTERS)
+    if report == "hourly":
+        sql = f'SELECT hour, {", ".join(_COUNTERS)} FROM {table} WHERE {where} ORDER BY hour'
+        out_keys = keys
+    else:
+        group = keys[1]
+        out_keys = (group, "name") if report == "items" else (group,)
+        columns = f"{group}, MAX(name)" if report == "items" else group
+        sql = (f'SELECT {columns}, {sums} FROM {table} WHERE {where} '
+               f'GROUP BY {group} ORDER BY SUM(sales_cents) DESC, {group}')
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return [_row_json(out_keys, row) for row in conn.execute(sql, params)]
+
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Serialization
+Fast JSON encoding for responses built straight from database rows
+"""
+
+from typing import Any
+import json
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements.txt
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Encode plain dicts/lists/scalars to compact UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RowsResponse(Response):
+    """JSON response for content that is already plain JSON data.
+
+    List endpoints build dicts directly from rows and return this instead
+    of Pydantic models, which skips FastAPI's response_model validation and
+    ``jsonable_encoder`` pass. The route's ``response_model`` still
+    documents the shape in OpenAPI, so the dicts must match it.
+    """
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Production Server
+Multi-process launcher: no reloader, graceful shutdown, one schema migration before workers start
+
+Usage:
+    python3 serve.py
+    SEATSERVE_PORT=8000 python3 serve.py
+"""
+
+import logging
+import os
+import sys
+
+import uvicorn
+
+HOST = os.getenv('SEATSERVE_HOST', '0.0.0.0')
+PORT = int(os.getenv('SEATSERVE_PORT', '8000'))
+# Order events, idempotency keys and kitchen claims are shared through the
+# database, so every core can run a worker
+WORKERS = int(os.getenv('SEATSERVE_WORKERS', str(os.cpu_count() or 1)))
+# Seconds a stopping worker waits for in-flight requests before closing them
+GRACEFUL_TIMEOUT = float(os.getenv('SEATSERVE_GRACEFUL_TIMEOUT', '30'))
+KEEPALIVE_TIMEOUT = int(os.getenv('SEATSERVE_KEEPALIVE_TIMEOUT', '5'))
+# Proxies trusted to report the client address (X-Forwarded-For/-Proto)
+FORWARDED_ALLOW_IPS = os.getenv('SEATSERVE_FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+logger = logging.getLogger("seatserve.serve")
+
+
+def prepare_environment(workers: int) -> None:
+    """Defaults for state each worker keeps in memory.
+
+    Kitchen queues follow the other workers through relayed order events;
+    with several workers each one also reloads them from the database on
+    an interval, in case a worker stopped before relaying its events.
+    Explicit settings win.
+    """
+    if workers > 1:
+        os.environ.setdefault('SEATSERVE_KITCHEN_REFRESH_SECONDS', '30')
+
+
+def main() -> int:
+    prepare_environment(WORKERS)
+
+    # Create and migrate the schema once, before any worker can race on it
+    from main import init_db
+    from database import db
+    init_db()
+    db.close()
+    logger.info(f"🚀 Iniciando SeatServe con {WORKERS} workers en {HOST}:{PORT}")
+
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        reload=False,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        # RequestLoggingMiddleware already logs every request
+        access_log=False,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
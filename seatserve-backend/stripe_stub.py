@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Stripe Stub
+Minimal local stand-in for the Stripe PaymentIntents API, for tests and benchmarks
+
+Run it next to the API and point the gateway at it:
+    uvicorn stripe_stub:app --port 12111
+    SEATSERVE_STRIPE_API_BASE=http://127.0.0.1:12111 python3 main.py
+"""
+
+from typing import Dict
+from urllib.parse import parse_qsl
+import asyncio
+import itertools
+import os
+import re
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Simulated gateway round trip
+STUB_LATENCY_MS = float(os.getenv('STRIPE_STUB_LATENCY_MS', '0'))
+
+# Shared by every stub so intent ids stay unique across a process, like Stripe's
+_intent_ids = itertools.count(1)
+
+_BRACKETED = re.compile(r"^(\w+)\[(\w+)\]$")
+
+
+def _parse_form(body: bytes) -> dict:
+    params: Dict[str, object] = {}
+    for key, value in parse_qsl(body.decode()):
+        match = _BRACKETED.match(key)
+        if match:
+            params.setdefault(match.group(1), {})[match.group(2)] = value
+        else:
+            params[key] = value
+    return params
+
+
+def _error(message: str, status_code: int = 400) -> JSONResponse:
+    return JSONResponse({"error": {"type": "invalid_request_error", "message": message}}, status_code=status_code)
+
+
+class StripeStub:
+    """In-memory PaymentIntents store with Stripe-shaped responses"""
+
+    def __init__(self, latency_ms: float = STUB_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self.intents: Dict[str, dict] = {}
+        self.idempotent_requests: Dict[str, str] = {}
+
+    async def _delay(self) -> None:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+    async def create_intent(self, request: Request) -> JSONResponse:
+        await self._delay()
+        idempotency_key = request.headers.get("idempotency-key")
+        if idempotency_key in self.idempotent_requests:
+            return JSONResponse(self.intents[self.idempotent_requests[idempotency_key]])
+        params = _parse_form(await request.body())
+        try:
+            amount = int(params["amount"])
+        except (KeyError, ValueError):
+            return _error("Missing required param: amount.")
+        if amount < 50:
+            return _error("Amount must be at least $0.50 usd")
+        intent_id = f"pi_stub_{next(_intent_ids):08d}"
+        intent = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": amount,
+            "currency": params.get("currency", "usd"),
+            "client_secret": f"{intent_id}_secret_stub",
+            "status": "requires_payment_method",
+            "metadata": params.get("metadata", {}),
+            "created": int(time.time()),
+        }
+        self.intents[intent_id] = intent
+        if idempotency_key:
+            self.idempotent_requests[idempotency_key] = intent_id
+        return JSONResponse(intent)
+
+    async def retrieve_intent(self, request: Request) -> JSONResponse:
+        await self._delay()
+        intent = self.intents.get(request.path_params["intent_id"])
+        if intent is None:
+            return _error("No such payment_intent", 404)
+        return JSONResponse(intent)
+
+    async def list_intents(self, request: Request) -> JSONResponse:
+        await self._delay()
+        params = request.query_params
+        try:
+            limit = min(int(params.get("limit", "10")), 100)
+            created_gte = int(params.get("created[gte]", "0"))
+        except ValueError:
+            return _error("Invalid integer")
+        # Newest first, like Stripe; ids are assigned in creation order
+        intents = [intent for intent in reversed(self.intents.values()) if intent["created"] >= created_gte]
+        starting_after = params.get("starting_after")
+        if starting_after:
+            ids = [intent["id"] for intent in intents]
+            if starting_after not in ids:
+                return _error("No such payment_intent", 404)
+            intents = intents[ids.index(starting_after) + 1:]
+        return JSONResponse({
+            "object": "list",
+            "url": "/v1/payment_intents",
+            "data": intents[:limit],
+            "has_more": len(intents) > limit,
+        })
+
+    def set_status(self, intent_id: str, status: str) -> None:
+        """Move an intent along, as the customer paying (or not) would"""
+        self.intents[intent_id]["status"] = status
+        if status == "succeeded":
+            self.intents[intent_id]["amount_received"] = self.intents[intent_id]["amount"]
+
+    def build_app(self) -> Starlette:
+        return Starlette(routes=[
+            Route("/v1/payment_intents", self.create_intent, methods=["POST"]),
+            Route("/v1/payment_intents", self.list_intents, methods=["GET"]),
+            Route("/v1/payment_intents/{intent_id}", self.retrieve_intent, methods=["GET"]),
+        ])
+
+
+stub = StripeStub()
+app = stub.build_app()
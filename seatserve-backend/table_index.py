@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Table Index
+In-memory index of restaurant tables bucketed by status and seat count
+"""
+
+from bisect import bisect_left, insort
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from database import Database, db
+
+# Reload from the database at most this often, to pick up changes made by
+# other worker processes; this process's own writes apply immediately
+TABLE_INDEX_TTL = float(os.getenv('SEATSERVE_TABLE_INDEX_TTL', '5'))
+# Reads to retry when status writes keep landing while the tables are read
+_RELOAD_ATTEMPTS = 3
+
+
+def _load_tables(conn: sqlite3.Connection) -> List[tuple]:
+    return conn.execute('SELECT id, number, seats, status FROM restaurant_tables ORDER BY number').fetchall()
+
+
+class _StatusBuckets:
+    """Tables of one status: seat count -> {table id: row}, with sorted seat counts"""
+    __slots__ = ("seat_counts", "buckets")
+
+    def __init__(self):
+        self.seat_counts: List[int] = []
+        self.buckets: Dict[int, Dict[int, tuple]] = {}
+
+    def add(self, row: tuple) -> None:
+        seats = row[2]
+        bucket = self.buckets.get(seats)
+        if bucket is None:
+            bucket = self.buckets[seats] = {}
+            insort(self.seat_counts, seats)
+        bucket[row[0]] = row
+
+    def remove(self, row: tuple) -> None:
+        seats = row[2]
+        bucket = self.buckets[seats]
+        del bucket[row[0]]
+        if not bucket:
+            del self.buckets[seats]
+            del self.seat_counts[bisect_left(self.seat_counts, seats)]
+
+    def at_least(self, seats: int, limit: int) -> List[tuple]:
+        """Up to ``limit`` tables with room for ``seats``, smallest tables first.
+
+        Within a seat count, tables that changed status most recently come
+        last, so freshly freed tables aren't always handed out first.
+        """
+        found = []
+        for index in range(bisect_left(self.seat_counts, seats), len(self.seat_counts)):
+            bucket = self.buckets[self.seat_counts[index]]
+            found.extend(islice(bucket.values(), limit - len(found)))
+            if len(found) >= limit:
+                break
+        return found
+
+
+class TableIndex:
+    """Tables bucketed by status and seat count.
+
+    Availability searches cost a binary search over the distinct seat
+    counts plus the tables returned, independent of venue size. Writers
+    call ``set_status`` after committing; the whole index is reloaded when
+    it is older than the TTL. Concurrent searches share one reload, and a
+    reload that overlapped a ``set_status`` is discarded and read again,
+    so it can't undo the write.
+    """
+
+    def __init__(self, database: Database, ttl: float = TABLE_INDEX_TTL):
+        self._db = database
+        self.ttl = ttl
+        self._tables: Dict[int, tuple] = {}
+        self._by_status: Dict[str, _StatusBuckets] = {}
+        self._loaded_at: Optional[float] = None
+        self._version = 0
+        self._loading: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+
+    def load(self, rows: Iterable[tuple], version: Optional[int] = None) -> bool:
+        """Replace the index with ``rows``.
+
+        With ``version`` (read before the rows were), nothing is replaced
+        and False is returned if a status change has been applied since.
+        """
+        tables = {}
+        by_status: Dict[str, _StatusBuckets] = {}
+        for row in rows:
+            row = tuple(row)
+            tables[row[0]] = row
+            by_status.setdefault(row[3], _StatusBuckets()).add(row)
+        with self._lock:
+            if version is not None and version != self._version:
+                return False
+            self._tables = tables
+            self._by_status = by_status
+            self._loaded_at = time.monotonic()
+            return True
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._loaded_at = None
+
+    async def refresh(self) -> None:
+        """Reload from the database if never loaded or older than the TTL"""
+        loaded_at = self._loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl:
+            return
+        loading = self._loading
+        if loading is None or loading.done() or loading.get_loop() is not asyncio.get_running_loop():
+            loading = self._loading = asyncio.ensure_future(self._reload())
+        # Shielded so one cancelled search doesn't cancel the reload for the rest
+        await asyncio.shield(loading)
+
+    async def _reload(self) -> None:
+        for _ in range(_RELOAD_ATTEMPTS):
+            version = self._version
+            if self.load(await self._db.run(_load_tables, name="load_table_index"), version):
+                return
+
+    def set_status(self, table_id: int, status: str) -> None:
+        with self._lock:
+            self._version += 1
+            row = self._tables.get(table_id)
+            if row is None or row[3] == status:
+                return
+            self._by_status[row[3]].remove(row)
+            row = (row[0], row[1], row[2], status)
+            self._tables[table_id] = row
+            self._by_status.setdefault(status, _StatusBuckets()).add(row)
+
+    def set_statuses(self, changes: Iterable[Tuple[int, str]]) -> None:
+        for table_id, status in changes:
+            self.set_status(table_id, status)
+
+    async def available(self, party_size: int, limit: int) -> List[dict]:
+        """Available tables that seat ``party_size``, best fit first"""
+        await self.refresh()
+        with self._lock:
+            buckets = self._by_status.get("available")
+            rows = buckets.at_least(party_size, limit) if buckets is not None else []
+        return [{"id": row[0], "number": row[1], "seats": row[2], "status": row[3]} for row in rows]
+
+
+table_index = TableIndex(db)
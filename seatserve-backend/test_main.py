@@ -5,9 +5,36 @@ Tests all major endpoints and functionality
 """
 
 import pytest
+from fastapi import HTTPException, Response
 from fastapi.testclient import TestClient
-from main import app, init_db, MenuItem, Order, Table
+from main import app, init_db, MenuItem, Order, Table, Payment
+from database import pool, db, Database, ConnectionPool
+from metrics import db_query_duration
+from orders import load_order_items
+from migrate import upgrade as upgrade_schema, downgrade as downgrade_schema, current_revision, head_revision
+from request_logging import RequestLoggingMiddleware, redact
+from menu_cache import menu_cache, MenuCache
+from serve import prepare_environment
+from order_events import broker, event_stream, order_topic, table_topic
+from payment_gateway import PaymentGateway, StripeGateway, GatewayError, get_payment_gateway
+from stripe_stub import StripeStub
+from webhook_inbox import webhook_worker, process_batch
+from reconciliation import Reconciler
+from exports import stream_export
+from archive import order_archive, archive_worker
+import csv
+import io
+from sales_rollups import load_report, record_order, record_paid, PAID_STATUSES
+import httpx
+import logging
+import sqlite3
+import asyncio
+import threading
+import hashlib
+import hmac
 import json
+import os
+import time
 
 # Initialize test client
 client = TestClient(app)
@@ -18,6 +45,22 @@ def setup_db():
     """Initialize database for testing"""
     init_db()
 
+def query_count(name):
+    """How many times a named database query has run in this process"""
+    return db_query_duration.labels(name).count
+
+ROLLUP_TABLES = ("sales_hourly", "sales_by_category", "sales_by_item", "sales_by_table")
+
+def replay_rollups(conn):
+    """Recompute the rollups by feeding every live order through record_order and record_paid"""
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table}")
+    orders = conn.execute("SELECT id, table_number, timestamp, status, paid_at FROM orders ORDER BY id").fetchall()
+    for order_id, table_number, timestamp, status, paid_at in orders:
+        record_order(conn, order_id, table_number, timestamp)
+        if status in PAID_STATUSES:
+            record_paid(conn, order_id, table_number, paid_at or timestamp)
+
 class TestHealthEndpoint:
     """Test health check endpoint"""
     
@@ -70,6 +113,121 @@ class TestMenuEndpoints:
         assert "id" in data
         print(f"[PASS] Create menu item - ID: {data['id']}")
 
+class TestMenuBulkImport:
+    """Test bulk menu create/update"""
+    
+    def test_bulk_json_upsert(self):
+        """Test JSON items are created, then updated in place"""
+        items = [
+            {"name": "Bulk Hot Dog", "description": "Stadium dog", "price": 6.0, "category": "Bulk"},
+            {"name": "Bulk Pretzel", "description": "Salted", "price": 5.0, "category": "Bulk"},
+        ]
+        response = client.post("/api/menu/bulk", json=items)
+        assert response.status_code == 200
+        assert response.json() == {"created": 2, "updated": 0, "total": 2}
+        
+        items[0]["price"] = 6.5
+        response = client.post("/api/menu/bulk", json=items)
+        assert response.json() == {"created": 0, "updated": 2, "total": 2}
+        
+        menu = {item["name"]: item for item in client.get("/api/menu").json()}
+        assert menu["Bulk Hot Dog"]["price"] == 6.5
+        print("[PASS] Bulk JSON menu upsert")
+    
+    def test_bulk_csv_import(self):
+        """Test CSV uploads, including unavailable items"""
+        csv_body = (
+            "name,description,price,category,available\n"
+            "CSV Nachos,Cheese nachos,6.5,BulkCSV,true\n"
+            "CSV Churro,,4.0,BulkCSV,false\n"
+        )
+        response = client.post("/api/menu/bulk", content=csv_body, headers={"Content-Type": "text/csv"})
+        assert response.status_code == 200
+        assert response.json()["created"] == 2
+        
+        names = [item["name"] for item in client.get("/api/menu").json()]
+        assert "CSV Nachos" in names
+        assert "CSV Churro" not in names
+        print("[PASS] Bulk CSV menu import")
+    
+    def test_bulk_single_invalidation(self):
+        """Test one upload bumps the menu version exactly once"""
+        version = menu_cache.version
+        items = [{"name": f"Bulk Item {i}", "description": "", "price": 1.0 + i, "category": "BulkMany"} for i in range(50)]
+        client.post("/api/menu/bulk", json=items)
+        assert menu_cache.version == version + 1
+        print("[PASS] Bulk upload invalidates menu cache once")
+    
+    def test_bulk_invalid_item(self):
+        """Test a bad row rejects the whole upload"""
+        items = [
+            {"name": "Bulk Valid", "description": "", "price": 1.0, "category": "BulkBad"},
+            {"name": "Bulk Invalid", "description": "", "price": "free", "category": "BulkBad"},
+        ]
+        response = client.post("/api/menu/bulk", json=items)
+        assert response.status_code == 422
+        names = [item["name"] for item in client.get("/api/menu").json()]
+        assert "Bulk Valid" not in names
+        print("[PASS] Invalid bulk upload rejected")
+
+class TestMenuCache:
+    """Test menu snapshot caching and revalidation"""
+    
+    def test_menu_etag_headers(self):
+        """Test menu responses carry ETag and Cache-Control"""
+        response = client.get("/api/menu")
+        assert response.status_code == 200
+        assert response.headers["etag"].startswith('"')
+        assert "no-cache" in response.headers["cache-control"]
+        print(f"[PASS] Menu ETag - {response.headers['etag']}")
+    
+    def test_menu_not_modified(self):
+        """Test a matching If-None-Match returns 304 with no body"""
+        etag = client.get("/api/menu").headers["etag"]
+        response = client.get("/api/menu", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        
+        etag = client.get("/api/menu/categories").headers["etag"]
+        response = client.get("/api/menu/categories", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        print("[PASS] Menu revalidation returns 304")
+    
+    def test_create_invalidates_menu(self):
+        """Test creating an item produces a new menu version"""
+        etag = client.get("/api/menu").headers["etag"]
+        new_item = {
+            "name": "Cache Test Nachos",
+            "description": "Invalidates the menu cache",
+            "price": 7.5,
+            "category": "Snacks",
+            "available": True
+        }
+        client.post("/api/menu", json=new_item)
+        
+        response = client.get("/api/menu", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+        assert any(item["name"] == new_item["name"] for item in response.json())
+        
+        categories = client.get("/api/menu/categories").json()["categories"]
+        assert "Snacks" in categories
+        print("[PASS] Menu cache invalidated on create")
+    
+    def test_concurrent_reloads_share_one_query(self):
+        """Test readers arriving during a reload wait for it instead of querying again"""
+        cache = MenuCache(db, ttl=60)
+        before = query_count("load_menu")
+        
+        async def burst():
+            return await asyncio.gather(*[cache.get() for _ in range(50)])
+        
+        snapshots = asyncio.run(burst())
+        assert query_count("load_menu") == before + 1
+        assert all(snapshot is snapshots[0] for snapshot in snapshots)
+        print("[PASS] Concurrent menu reloads single-flighted")
+
 class TestOrderEndpoints:
     """Test order-related endpoints"""
     
@@ -86,20 +244,411 @@ class TestOrderEndpoints:
         new_order = {
             "table_number": 1,
             "items": [
-                {"id": "p1", "name": "Burger", "qty": 2, "price": 10.0}
+                {"id": 6, "name": "Burger Classic", "qty": 2}
             ],
-            "total": 20.0,
             "status": "pending"
         }
         response = client.post("/api/orders", json=new_order)
         assert response.status_code == 200
         data = response.json()
         assert data["table_number"] == new_order["table_number"]
-        assert data["total"] == new_order["total"]
+        assert data["subtotal"] == 29.98
+        assert data["tax"] == 2.10
+        assert data["total"] == 32.08
         assert "id" in data
         assert "timestamp" in data
         print(f"[PASS] Create order - ID: {data['id']}, Total: ${data['total']}")
 
+class TestOrderPricing:
+    """Test orders are priced on the server from the menu"""
+    
+    def test_client_amounts_ignored(self):
+        """Test names, prices and totals sent by the client are replaced"""
+        response = client.post("/api/orders", json={
+            "table_number": 3,
+            "items": [{"id": 1, "name": "Free Pizza", "price": 0.01, "qty": 2}, {"id": 5}],
+            "total": 0.03
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert [(i["name"], i["price"], i["qty"]) for i in data["items"]] == [
+            ("Margherita Pizza", 12.99, 2), ("Coffee", 2.99, 1)
+        ]
+        assert data["subtotal"] == 28.97
+        assert data["tax"] == 2.03
+        assert data["total"] == 31.0
+        print(f"[PASS] Order priced by server - Total: ${data['total']}")
+    
+    def test_invalid_carts_rejected(self):
+        """Test unknown items, bad quantities and empty carts"""
+        cases = [
+            ([], 422),
+            ([{"id": 999999, "qty": 1}], 422),
+            ([{"id": "p1", "qty": 1}], 422),
+            ([{"id": 1, "qty": 0}], 422),
+            ([{"id": 1, "qty": 1.5}], 422),
+            ([{"name": "Burger"}], 422),
+        ]
+        for items, status in cases:
+            response = client.post("/api/orders", json={"table_number": 3, "items": items})
+            assert response.status_code == status, items
+        print("[PASS] Invalid carts rejected")
+    
+    def test_unavailable_item_rejected(self):
+        """Test items marked unavailable cannot be ordered"""
+        item = client.post("/api/menu", json={
+            "name": "Sold Out Nachos", "description": "Gone by halftime",
+            "price": 7.5, "category": "Snacks", "available": False
+        }).json()
+        response = client.post("/api/orders", json={"table_number": 3, "items": [{"id": item["id"]}]})
+        assert response.status_code == 409
+        assert "Sold Out Nachos" in response.json()["detail"]
+        print("[PASS] Unavailable item rejected")
+    
+    def test_priced_from_cache(self):
+        """Test pricing reads the cached menu, not the database"""
+        client.post("/api/orders", json={"table_number": 3, "items": [{"id": 1}]})
+        loads = query_count("load_menu")
+        for _ in range(3):
+            client.post("/api/orders", json={"table_number": 3, "items": [{"id": 1}]})
+        assert query_count("load_menu") == loads
+        print("[PASS] Orders priced from cached menu")
+    
+    def test_category_tax_rules(self):
+        """Test per-category rates and per-rate rounding"""
+        from decimal import Decimal
+        from pricing import TaxRules, build_price_index, price_order
+        index = build_price_index([
+            (1, "Hot Dog", "", 6.5, "Mains", 1),
+            (2, "Water", "", 2.25, "Beverages", 1),
+        ])
+        rules = TaxRules(Decimal("0.07"), {"Beverages": Decimal("0")})
+        priced = price_order(index, [{"id": 1, "qty": 3}, {"id": 2, "qty": 2}], rules)
+        assert priced.subtotal == Decimal("24.00")
+        assert priced.tax == Decimal("1.37")  # 19.50 * 7% = 1.365, rounded half up
+        assert priced.total == Decimal("25.37")
+        print("[PASS] Category tax rules")
+
+@pytest.fixture(scope="class")
+def pagination_orders():
+    """Create a few orders on a dedicated table"""
+    for qty in (1, 2, 3):
+        client.post("/api/orders", json={
+            "table_number": TestOrderPagination.TABLE,
+            "items": [{"id": 5, "qty": qty}],
+            "status": "pending"
+        })
+
+@pytest.mark.usefixtures("pagination_orders")
+class TestOrderPagination:
+    """Test keyset pagination and filtering of GET /api/orders"""
+    
+    TABLE = 9001
+    
+    def test_paginate_by_cursor(self):
+        """Test pages follow each other without overlap"""
+        first = client.get(f"/api/orders?table_number={self.TABLE}&limit=2")
+        assert first.status_code == 200
+        assert len(first.json()) == 2
+        cursor = first.headers["x-next-cursor"]
+        
+        second = client.get(f"/api/orders?table_number={self.TABLE}&limit=2&cursor={cursor}")
+        assert second.status_code == 200
+        assert len(second.json()) == 1
+        assert "x-next-cursor" not in second.headers
+        
+        ids = [o["id"] for o in first.json() + second.json()]
+        assert len(set(ids)) == 3
+        assert ids == sorted(ids, reverse=True)
+        print("[PASS] Orders keyset pagination")
+    
+    def test_filter_by_status(self):
+        """Test status filter"""
+        response = client.get(f"/api/orders?table_number={self.TABLE}&status=paid")
+        assert response.status_code == 200
+        assert response.json() == []
+        response = client.get("/api/orders?status=pending")
+        assert all(o["status"] == "pending" for o in response.json())
+        print("[PASS] Orders status filter")
+    
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = client.get("/api/orders?cursor=not-a-cursor")
+        assert response.status_code == 400
+        print("[PASS] Invalid cursor rejected")
+    
+    def test_pagination_uses_index(self):
+        """Test the filtered page query is served from an index"""
+        with pool.connection() as conn:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM orders WHERE status = ? "
+                "ORDER BY timestamp DESC, id DESC LIMIT 50", ("pending",)
+            ).fetchall()
+        detail = " ".join(row[-1] for row in plan)
+        assert "idx_orders_status_timestamp" in detail
+        assert "TEMP B-TREE" not in detail
+        print(f"[PASS] Orders page query plan - {detail}")
+
+class TestOrderItems:
+    """Test normalized order line items"""
+    
+    def test_items_round_trip(self):
+        """Test priced items, including extra keys, come back as created"""
+        items = [
+            {"id": 6, "qty": 2},
+            {"id": "5", "qty": 1, "size": "large", "notes": None},
+        ]
+        created = client.post("/api/orders", json={
+            "table_number": 9002, "items": items
+        }).json()
+        assert created["items"] == [
+            {"id": 6, "name": "Burger Classic", "price": 14.99, "qty": 2},
+            {"id": 5, "name": "Coffee", "price": 2.99, "qty": 1, "size": "large", "notes": None},
+        ]
+        fetched = client.get("/api/orders?table_number=9002").json()
+        assert fetched[0]["id"] == created["id"]
+        assert fetched[0]["items"] == created["items"]
+        assert fetched[0]["total"] == created["total"]
+        print("[PASS] Order items round trip")
+    
+    def test_items_stored_in_rows(self):
+        """Test each line item is its own order_items row"""
+        created = client.post("/api/orders", json={
+            "table_number": 9003,
+            "items": [{"id": 1, "name": "Pizza", "qty": 3, "price": 1.0}],
+        }).json()
+        with pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT menu_item_id, qty, unit_price FROM order_items WHERE order_id = ?",
+                (created["id"],)
+            ).fetchall()
+        assert rows == [(1, 3, 12.99)]
+        print("[PASS] Order items stored as rows")
+    
+    def test_legacy_items_migrated(self, tmp_path):
+        """Test JSON items of an old database are backfilled"""
+        path = str(tmp_path / "legacy.db")
+        conn = sqlite3.connect(path)
+        conn.execute("""
+            CREATE TABLE orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_number INTEGER NOT NULL,
+                items TEXT NOT NULL,
+                total REAL NOT NULL,
+                status TEXT DEFAULT 'pending',
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        legacy = [{"id": "p1", "name": "Burger", "qty": 2, "price": 10.0}]
+        conn.execute("INSERT INTO orders (table_number, items, total) VALUES (1, ?, 20.0)", (json.dumps(legacy),))
+        conn.execute("INSERT INTO orders (table_number, items, total) VALUES (2, '[]', 0)")
+        conn.commit()
+        
+        upgrade_schema(path)
+        
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(orders)")]
+        assert "items" not in columns
+        assert load_order_items(conn, [1, 2]) == {1: legacy, 2: []}
+        conn.close()
+        print("[PASS] Legacy order items migrated")
+    
+    def test_legacy_migration_matches_python_rules(self, tmp_path):
+        """Test the migration's SQL backfill stores items and rollups like the application code"""
+        path = str(tmp_path / "legacy_rollups.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE menu_items (id INTEGER PRIMARY KEY, name TEXT, description TEXT, price REAL, category TEXT, available BOOLEAN)")
+        conn.executemany("INSERT INTO menu_items VALUES (?, ?, '', ?, ?, 1)", [(1, "Pizza", 12.99, "Mains"), (5, "Coffee", 2.99, "Drinks")])
+        conn.execute("""
+            CREATE TABLE orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_number INTEGER NOT NULL,
+                items TEXT NOT NULL,
+                total REAL NOT NULL,
+                status TEXT DEFAULT 'pending',
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        legacy = [
+            ([{"id": 1, "name": "Pizza", "qty": 2, "price": 12.99}, {"id": 5, "name": "Coffee", "price": 2.99}], "paid", "2020-05-01T12:10:00"),
+            ([{"id": 5, "name": "Cafe", "qty": 3, "price": 2.99}], "pending", "2020-05-01T12:40:00"),
+            ([{"id": "p1", "qty": True, "price": "free", "note": None, "extra": {"x": [1]}}], "ready", "2020-05-01T13:05:00"),
+            ([{"id": 1, "name": "Pizza", "qty": 1, "price": 12.99}, {"name": "Water"}], "preparing", "2020-05-02T09:00:00"),
+            ([], "paid", "2020-05-02T09:30:00"),
+        ]
+        for number, (items, status, timestamp) in enumerate(legacy, start=1):
+            conn.execute(
+                "INSERT INTO orders (table_number, items, total, status, timestamp) VALUES (?, ?, 0, ?, ?)",
+                (number % 2 + 1, json.dumps(items), status, timestamp)
+            )
+        conn.commit()
+        
+        upgrade_schema(path)
+        
+        assert load_order_items(conn, range(1, 6)) == {number: items for number, (items, _, _) in enumerate(legacy, start=1)}
+        migrated = {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in ROLLUP_TABLES}
+        assert migrated["sales_hourly"]
+        replay_rollups(conn)
+        assert {table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall() for table in ROLLUP_TABLES} == migrated
+        conn.rollback()
+        conn.close()
+        print("[PASS] Migration backfill matches application rules")
+
+class TestOrderEvents:
+    """Test order status push over Server-Sent Events"""
+    
+    def test_status_changes_published(self):
+        """Test create and confirm push events to table subscribers"""
+        async def main():
+            subscription = broker.subscribe(table_topic(9005))
+            async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+                order = (await ac.post("/api/orders", json={"table_number": 9005, "items": [{"id": 5, "qty": 1}]})).json()
+                payment = (await ac.post("/api/payments", json={"order_id": order["id"], "amount": 4.0})).json()
+                await ac.put(f"/api/payments/{payment['id']}/confirm")
+            events = [await asyncio.wait_for(subscription.get(), 1) for _ in range(2)]
+            broker.unsubscribe(subscription)
+            return order, events
+        
+        order, events = asyncio.run(main())
+        assert [e["type"] for e in events] == ["order.created", "order.paid"]
+        assert all(e["order_id"] == order["id"] for e in events)
+        assert events[1]["status"] == "paid"
+        print("[PASS] Order status events published")
+    
+    def test_event_stream_frames(self):
+        """Test the SSE stream starts with the snapshot and then pushes events"""
+        async def main():
+            subscription = broker.subscribe(order_topic(424242))
+            stream = event_stream(subscription, {"id": 0, "type": "order.snapshot", "order_id": 424242, "status": "pending"})
+            first = await stream.__anext__()
+            broker.publish("payment.failed", 424242, None, "pending", payment_status="failed")
+            second = await asyncio.wait_for(stream.__anext__(), 1)
+            await stream.aclose()
+            return first, second
+        
+        count = broker.subscriber_count()
+        first, second = asyncio.run(main())
+        assert first.startswith("id: 0\nevent: order.snapshot\n")
+        assert "event: payment.failed" in second
+        assert json.loads(second.split("data: ")[1])["payment_status"] == "failed"
+        assert broker.subscriber_count() == count
+        print("[PASS] SSE frames and unsubscribe on close")
+    
+    def test_stream_unknown_order(self):
+        """Test subscribing to a missing order is rejected"""
+        count = broker.subscriber_count()
+        response = client.get("/api/orders/999999/events")
+        assert response.status_code == 404
+        assert broker.subscriber_count() == count
+        print("[PASS] Unknown order stream rejected")
+
+class TestKitchenQueue:
+    """Test per-stand kitchen queues of paid orders"""
+    
+    def paid_order(self, stand, items):
+        order = client.post("/api/orders", json={"table_number": 4, "stand": stand, "items": items}).json()
+        payment = client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+        assert client.put(f"/api/payments/{payment['id']}/confirm").status_code == 200
+        return order
+    
+    def test_paid_orders_queued_by_ready_time(self):
+        """Test a quick order paid just after a large one is made first"""
+        large = self.paid_order("kq-priority", [{"id": 6, "qty": 10}])
+        small = self.paid_order("kq-priority", [{"id": 5, "qty": 1}])
+        unpaid = client.post("/api/orders", json={"table_number": 4, "stand": "kq-priority", "items": [{"id": 5}]})
+        assert unpaid.status_code == 200
+        
+        queue = client.get("/api/kitchen/kq-priority/queue").json()
+        assert queue["waiting"] == 2
+        assert [t["order_id"] for t in queue["queue"]] == [small["id"], large["id"]]
+        assert queue["queue"][1]["prep_seconds"] > queue["queue"][0]["prep_seconds"]
+        print("[PASS] Kitchen queue ordered by ready time")
+    
+    def test_claim_and_complete(self):
+        """Test claiming moves the next ticket to in progress and completing marks it ready"""
+        order = self.paid_order("kq-flow", [{"id": 1, "qty": 2}])
+        
+        response = client.post("/api/kitchen/kq-flow/claim")
+        assert response.status_code == 200
+        ticket = response.json()
+        assert ticket["order_id"] == order["id"]
+        assert ticket["status"] == "preparing"
+        assert ticket["items"][0]["name"] == "Margherita Pizza"
+        assert client.post("/api/kitchen/kq-flow/claim").status_code == 204
+        
+        queue = client.get("/api/kitchen/kq-flow/queue").json()
+        assert queue["queue"] == []
+        assert [t["order_id"] for t in queue["in_progress"]] == [order["id"]]
+        
+        response = client.post(f"/api/kitchen/kq-flow/orders/{order['id']}/complete")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        assert client.post(f"/api/kitchen/kq-flow/orders/{order['id']}/complete").status_code == 404
+        assert client.get("/api/kitchen/kq-flow/queue").json()["in_progress"] == []
+        
+        with pool.connection() as conn:
+            status = conn.execute("SELECT status FROM orders WHERE id = ?", (order["id"],)).fetchone()[0]
+        assert status == "ready"
+        print(f"[PASS] Kitchen claim and complete - Order {order['id']}")
+    
+    def test_repeat_confirmation_not_requeued(self):
+        """Test confirming again after the kitchen started does not queue a second ticket"""
+        order = self.paid_order("kq-repeat", [{"id": 5}])
+        client.post("/api/kitchen/kq-repeat/claim")
+        payment = client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+        client.put(f"/api/payments/{payment['id']}/confirm")
+        queue = client.get("/api/kitchen/kq-repeat/queue").json()
+        assert queue["waiting"] == 0
+        assert len(queue["in_progress"]) == 1
+        print("[PASS] Started orders not requeued")
+    
+    def test_rebuild_from_database(self):
+        """Test queues are rebuilt from paid and in-progress orders"""
+        from kitchen import KitchenQueues, load_open_tickets
+        first = self.paid_order("kq-rebuild", [{"id": 5}])
+        second = self.paid_order("kq-rebuild", [{"id": 5}])
+        client.post("/api/kitchen/kq-rebuild/claim")
+        
+        queues = KitchenQueues()
+        with pool.connection() as conn:
+            queues.rebuild(load_open_tickets(conn))
+        snapshot = queues.snapshot("kq-rebuild", 10)
+        assert [t["order_id"] for t in snapshot["queue"]] == [second["id"]]
+        assert [t["order_id"] for t in snapshot["in_progress"]] == [first["id"]]
+        print("[PASS] Kitchen queues rebuilt")
+    
+    def test_invalid_stand_rejected(self):
+        """Test stand names are validated on new orders"""
+        response = client.post("/api/orders", json={"table_number": 4, "stand": "Bad Stand!", "items": [{"id": 5}]})
+        assert response.status_code == 422
+        print("[PASS] Invalid stand rejected")
+    
+    def test_unknown_stand(self):
+        """Test kitchen endpoints reject stands with no queued orders without creating queues"""
+        from kitchen import kitchen
+        assert client.get("/api/kitchen/kq-nowhere/queue").status_code == 404
+        assert client.post("/api/kitchen/kq-nowhere/claim").status_code == 404
+        assert client.get("/api/kitchen/Bad Stand!/queue").status_code == 422
+        assert client.get("/api/kitchen/main/queue").status_code == 200
+        kitchen.snapshot("kq-nowhere", 10)
+        assert not kitchen.has_stand("kq-nowhere")
+        print("[PASS] Unknown stand rejected")
+    
+    def test_complete_conflict(self, monkeypatch):
+        """Test completing an order that left preparing returns 409 and publishes nothing"""
+        order = self.paid_order("kq-conflict", [{"id": 5}])
+        assert client.post("/api/kitchen/kq-conflict/claim").status_code == 200
+        with pool.connection() as conn:
+            conn.execute("UPDATE orders SET status = 'ready' WHERE id = ?", (order["id"],))
+            conn.commit()
+        
+        published = []
+        monkeypatch.setattr(broker, "publish", lambda event_type, *args, **fields: published.append(event_type))
+        response = client.post(f"/api/kitchen/kq-conflict/orders/{order['id']}/complete")
+        assert response.status_code == 409
+        assert published == []
+        assert client.get("/api/kitchen/kq-conflict/queue").json()["in_progress"] == []
+        print("[PASS] Kitchen completion conflict")
+
 class TestTableEndpoints:
     """Test table-related endpoints"""
     
@@ -148,6 +697,255 @@ class TestTableEndpoints:
         assert response.status_code == 400
         print("[PASS] Invalid status rejection")
 
+class TestSalesReports:
+    """Test incrementally maintained sales rollups and the report endpoints"""
+    
+    def report(self, name, key):
+        response = client.get(f"/api/reports/{name}")
+        assert response.status_code == 200
+        return {row[key]: row for row in response.json()}
+    
+    def test_order_and_payment_counted(self):
+        """Test placing and paying an order updates every rollup once"""
+        categories = self.report("categories", "category")
+        items = self.report("items", "menu_item_id")
+        
+        order = client.post("/api/orders", json={"table_number": 77, "items": [
+            {"id": 1, "qty": 2}, {"id": 5, "qty": 1}
+        ]}).json()
+        after = self.report("categories", "category")
+        assert round(after["Mains"]["sales"] - categories.get("Mains", {}).get("sales", 0), 2) == 25.98
+        assert round(after["Beverages"]["sales"] - categories.get("Beverages", {}).get("sales", 0), 2) == 2.99
+        item = self.report("items", "menu_item_id")[1]
+        assert item["name"] == "Margherita Pizza"
+        assert item["quantity"] - items.get(1, {}).get("quantity", 0) == 2
+        table = self.report("tables", "table_number")[77]
+        assert (table["orders"], table["sales"], table["paid_orders"]) == (1, 28.97, 0)
+        
+        payment = client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+        client.put(f"/api/payments/{payment['id']}/confirm")
+        client.put(f"/api/payments/{payment['id']}/confirm")
+        table = self.report("tables", "table_number")[77]
+        assert (table["paid_orders"], table["paid_quantity"], table["paid_sales"]) == (1, 3, 28.97)
+        print("[PASS] Sales rollups updated on order and payment")
+    
+    def test_rollups_match_replay(self):
+        """Test the incremental rollups equal replaying every order from scratch"""
+        def snapshot(conn):
+            return {name: load_report(conn, name, "0000-00-00T00", None) for name in ("hourly", "categories", "items", "tables")}
+        with pool.connection() as conn:
+            incremental = snapshot(conn)
+            replay_rollups(conn)
+            replayed = snapshot(conn)
+            conn.rollback()
+        assert replayed == incremental
+        print("[PASS] Incremental rollups match replay")
+    
+    def test_report_validation(self):
+        """Test unknown reports and bad ranges are rejected"""
+        assert client.get("/api/reports/weekly").status_code == 404
+        assert client.get("/api/reports/hourly?since=yesterday").status_code == 400
+        assert client.get("/api/reports/hourly?since=2000-01-01T00&until=2000-01-01").json() == []
+        print("[PASS] Report validation")
+
+class TestTableStatusUpdates:
+    """Test bulk and compare-and-swap table status updates"""
+    
+    def statuses(self):
+        return {t["id"]: t["status"] for t in client.get("/api/tables").json()}
+    
+    def test_conditional_update(self):
+        """Test expected_status makes a single update compare-and-swap"""
+        client.put("/api/tables/3/status?status=available")
+        response = client.put("/api/tables/3/status?status=occupied&expected_status=available")
+        assert response.status_code == 200
+        response = client.put("/api/tables/3/status?status=reserved&expected_status=available")
+        assert response.status_code == 409
+        assert self.statuses()[3] == "occupied"
+        assert client.put("/api/tables/99999/status?status=occupied&expected_status=available").status_code == 404
+        print("[PASS] Conditional table update")
+    
+    def test_bulk_update(self):
+        """Test many transitions apply in one request and report what applied"""
+        client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": table_id, "status": "available"} for table_id in (4, 5, 6)
+        ]})
+        response = client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": 4, "status": "occupied", "expected_status": "available"},
+            {"table_id": 5, "status": "reserved", "expected_status": "occupied"},
+            {"table_id": 6, "status": "reserved"},
+            {"table_id": 99999, "status": "reserved"},
+        ]})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["applied"] == 2 and data["rejected"] == 2
+        assert [(r["table_id"], r["applied"], r["status"], r["reason"]) for r in data["results"]] == [
+            (4, True, "occupied", None),
+            (5, False, "available", "status_mismatch"),
+            (6, True, "reserved", None),
+            (99999, False, None, "not_found"),
+        ]
+        statuses = self.statuses()
+        assert (statuses[4], statuses[5], statuses[6]) == ("occupied", "available", "reserved")
+        print("[PASS] Bulk table update")
+    
+    def test_bulk_updates_apply_in_order(self):
+        """Test a later transition sees the result of an earlier one"""
+        client.put("/api/tables/7/status?status=available")
+        data = client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": 7, "status": "reserved", "expected_status": "available"},
+            {"table_id": 7, "status": "occupied", "expected_status": "reserved"},
+            {"table_id": 7, "status": "available", "expected_status": "reserved"},
+        ]}).json()
+        assert [r["applied"] for r in data["results"]] == [True, True, False]
+        assert self.statuses()[7] == "occupied"
+        print("[PASS] Bulk updates applied in order")
+    
+    def test_bulk_validation(self):
+        """Test invalid statuses and oversized requests are rejected before any write"""
+        response = client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": 1, "status": "occupied"}, {"table_id": 2, "status": "dirty"}
+        ]})
+        assert response.status_code == 400
+        response = client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": 1, "status": "available"}
+        ] * 2001})
+        assert response.status_code == 413
+        print("[PASS] Bulk table update validation")
+
+class TestExports:
+    """Test streaming NDJSON and CSV exports"""
+    
+    def count(self, table):
+        with pool.connection() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    
+    def test_orders_ndjson(self):
+        """Test every order is exported once, oldest first, with its items"""
+        client.post("/api/orders", json={"table_number": 2, "items": [{"id": 8, "qty": 2}]})
+        response = client.get("/api/orders/export")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        orders = [json.loads(line) for line in response.text.splitlines()]
+        assert len(orders) == self.count("orders")
+        assert len({order["id"] for order in orders}) == len(orders)
+        assert [(o["timestamp"], o["id"]) for o in orders] == sorted((o["timestamp"], o["id"]) for o in orders)
+        assert orders[-1]["items"][0]["name"] == "Tiramisu"
+        print(f"[PASS] Orders NDJSON export - {len(orders)} orders")
+    
+    def test_chunks_match_single_read(self):
+        """Test small chunks produce the same export as one large chunk"""
+        async def collect(chunk_size):
+            return b"".join([chunk async for chunk in stream_export(db, "orders", "ndjson", None, None, chunk_size)])
+        assert asyncio.run(collect(3)) == asyncio.run(collect(100000))
+        print("[PASS] Chunked export")
+    
+    def test_payments_csv_and_range(self):
+        """Test CSV payments export and date-range filters"""
+        response = client.get("/api/payments/export?format=csv")
+        assert response.status_code == 200
+        assert "attachment" in response.headers["content-disposition"]
+        rows = list(csv.reader(io.StringIO(response.text)))
+        assert rows[0][:3] == ["id", "order_id", "amount"]
+        assert len(rows) - 1 == self.count("payments")
+        
+        response = client.get("/api/payments/export?format=csv&since=2999-01-01")
+        assert response.text.splitlines() == [",".join(rows[0])]
+        assert client.get("/api/orders/export?until=2000-01-01").text == ""
+        print("[PASS] Payments CSV export")
+    
+    def test_export_validation(self):
+        """Test unknown formats and bad dates are rejected"""
+        assert client.get("/api/orders/export?format=xml").status_code == 400
+        assert client.get("/api/payments/export?since=last-week").status_code == 400
+        print("[PASS] Export validation")
+
+class TestTableAvailability:
+    """Test the party-size table search served from the table index"""
+    
+    def reset(self):
+        client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": table_id, "status": "available"} for table_id in range(1, 9)
+        ]})
+    
+    def available(self, party_size, **params):
+        response = client.get("/api/tables/available", params={"party_size": party_size, **params})
+        assert response.status_code == 200
+        return response.json()
+    
+    def test_best_fit_first(self):
+        """Test the smallest tables that fit come first"""
+        self.reset()
+        tables = self.available(5)
+        assert [t["seats"] for t in tables] == [6, 6, 8]
+        assert {t["id"] for t in tables[:2]} == {3, 8}
+        assert all(t["status"] == "available" for t in tables)
+        assert [t["seats"] for t in self.available(1, limit=3)] == [2, 2, 4]
+        assert self.available(9) == []
+        print("[PASS] Best-fit table search")
+    
+    def test_status_changes_apply_immediately(self):
+        """Test single and bulk status updates are reflected in the next search"""
+        self.reset()
+        client.put("/api/tables/5/status?status=occupied")
+        assert self.available(7) == []
+        client.post("/api/tables/status/bulk", json={"updates": [
+            {"table_id": 3, "status": "reserved"},
+            {"table_id": 5, "status": "available"},
+        ]})
+        assert [t["id"] for t in self.available(5)] == [8, 5]
+        self.reset()
+        print("[PASS] Table search follows status changes")
+    
+    def test_concurrent_searches_share_one_reload(self):
+        """Test searches arriving during a reload wait for it instead of reading the tables again"""
+        from table_index import TableIndex
+        index = TableIndex(db, ttl=60)
+        before = query_count("load_table_index")
+        
+        async def burst():
+            return await asyncio.gather(*[index.available(2, 10) for _ in range(20)])
+        
+        results = asyncio.run(burst())
+        assert query_count("load_table_index") == before + 1
+        assert all(result == results[0] for result in results)
+        print("[PASS] Concurrent table index reloads single-flighted")
+    
+    def test_reload_does_not_undo_concurrent_write(self):
+        """Test a reload that read the tables before a status write is discarded and read again"""
+        from table_index import TableIndex
+        self.reset()
+        
+        class WriteDuringRead:
+            """Commits a status change right after the first read, as another request would"""
+            reads = 0
+            
+            async def run(self, fn, *args, name):
+                rows = await db.run(fn, *args, name=name)
+                self.reads += 1
+                if self.reads == 1:
+                    with pool.connection() as conn:
+                        conn.execute("UPDATE restaurant_tables SET status = 'occupied' WHERE id = 3")
+                        conn.commit()
+                    index.set_status(3, "occupied")
+                return rows
+        
+        database = WriteDuringRead()
+        index = TableIndex(database, ttl=60)
+        try:
+            tables = asyncio.run(index.available(5, 10))
+            assert database.reads == 2
+            assert 3 not in {t["id"] for t in tables}
+        finally:
+            self.reset()
+        print("[PASS] Table index reload kept concurrent write")
+    
+    def test_party_size_validation(self):
+        """Test party_size is required and positive"""
+        assert client.get("/api/tables/available").status_code == 422
+        assert client.get("/api/tables/available?party_size=0").status_code == 422
+        print("[PASS] Party size validation")
+
 class TestRootEndpoint:
     """Test root endpoint"""
     
@@ -180,6 +978,673 @@ class TestDataIntegrity:
             assert isinstance(order["total"], (int, float))
         print(f"[PASS] Order totals valid - All {len(orders)} orders have valid totals")
 
+class TestRequestLogging:
+    """Test the ASGI request logger"""
+    
+    def test_access_line_logged(self, caplog):
+        """Test method, path, status and duration are logged without the body"""
+        with caplog.at_level(logging.INFO, logger="request_logging"):
+            client.post("/api/orders", json={"table_number": 9004, "items": [{"id": 5, "qty": 1}]})
+        messages = [r.getMessage() for r in caplog.records if r.name == "request_logging"]
+        assert any("[POST] /api/orders → 200" in m for m in messages)
+        assert not any("Body" in m for m in messages)
+        print("[PASS] Access line logged without body")
+    
+    def test_body_capture_redacted(self, caplog):
+        """Test opt-in body capture masks sensitive fields"""
+        logged_app = RequestLoggingMiddleware(app, log_bodies=True)
+        logged_client = TestClient(logged_app)
+        with caplog.at_level(logging.INFO, logger="request_logging"):
+            response = logged_client.post("/api/payments", json={
+                "order_id": 999999, "amount": 5.0, "card_number": "4242424242424242"
+            })
+        assert response.status_code == 404
+        messages = " ".join(r.getMessage() for r in caplog.records if r.name == "request_logging")
+        assert "4242424242424242" not in messages
+        assert '"card_number": "***"' in messages
+        print("[PASS] Captured body redacted")
+    
+    def test_redact_nested(self):
+        """Test redaction reaches nested objects and lists"""
+        payload = {"order_data": {"items": [{"name": "Burger"}], "email": "fan@example.com"}, "cvc": "123"}
+        assert redact(payload) == {"order_data": {"items": [{"name": "Burger"}], "email": "***"}, "cvc": "***"}
+        print("[PASS] Nested redaction")
+
+class TestMetrics:
+    """Test the /metrics endpoint"""
+    
+    def test_metrics_format(self):
+        """Test metrics are exposed in Prometheus text format"""
+        client.get("/api/tables")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "# TYPE seatserve_http_request_duration_seconds histogram" in body
+        assert 'seatserve_http_requests_total{method="GET",route="/api/tables",status="200"}' in body
+        assert 'seatserve_db_query_duration_seconds_count{query="get_tables"}' in body
+        assert "seatserve_http_requests_in_flight" in body
+        print("[PASS] Metrics exposed")
+    
+    def test_route_template_labels(self):
+        """Test path parameters are collapsed into the route template"""
+        client.get("/api/orders/999998/events")
+        client.get("/api/orders/999997/events")
+        body = client.get("/metrics").text
+        assert 'route="/api/orders/{order_id}/events",status="404"' in body
+        assert "/api/orders/999998" not in body
+        print("[PASS] Metrics labelled by route template")
+    
+    def test_histogram_buckets_cumulative(self):
+        """Test bucket counts are cumulative and end at the total count"""
+        from metrics import HistogramFamily
+        family = HistogramFamily("test_latency_seconds", "Test", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 5.0):
+            family.labels("/x").observe(value)
+        lines = []
+        family.render(lines)
+        assert 'test_latency_seconds_bucket{route="/x",le="0.1"} 1' in lines
+        assert 'test_latency_seconds_bucket{route="/x",le="1.0"} 2' in lines
+        assert 'test_latency_seconds_bucket{route="/x",le="+Inf"} 3' in lines
+        assert 'test_latency_seconds_count{route="/x"} 3' in lines
+        print("[PASS] Histogram buckets cumulative")
+
+class TestLoadTest:
+    """Test the load-test harness against the in-process app"""
+    
+    def test_report_shape(self):
+        """Test a short run reports percentiles for every endpoint hit"""
+        from benchmarks.load_test import run_load
+        report = asyncio.run(run_load(
+            lambda: httpx.AsyncClient(app=app, base_url="http://bench"),
+            mix="mixed", concurrency=4, duration=30, max_requests=40
+        ))
+        assert report["summary"]["requests"] >= 40
+        assert report["summary"]["errors"] == 0
+        for stats in report["endpoints"].values():
+            assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"] <= stats["max_ms"]
+        print(f"[PASS] Load test report - {len(report['endpoints'])} endpoints")
+    
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        from benchmarks.load_test import percentile
+        values = [float(v) for v in range(1, 101)]
+        assert percentile(values, 50) == 50.0
+        assert percentile(values, 99) == 99.0
+        assert percentile([], 95) == 0.0
+        print("[PASS] Nearest-rank percentiles")
+
+class TestPaymentGateway:
+    """Test the async Stripe gateway against the local Stripe stub"""
+    
+    def make_gateway(self, stub=None):
+        stub = stub or StripeStub()
+        return StripeGateway(
+            "sk_test_stub", base_url="http://stripe.test",
+            transport=httpx.ASGITransport(app=stub.build_app())
+        )
+    
+    def test_create_payment_intent(self):
+        """Test amount, currency and nested metadata survive form encoding"""
+        gateway = self.make_gateway()
+        intent = asyncio.run(gateway.create_payment_intent(1250, "usd", {"order_data": '{"table": 4}'}))
+        assert intent.id.startswith("pi_stub_")
+        assert intent.client_secret.startswith(intent.id)
+        assert intent.amount == 1250
+        assert intent.metadata == {"order_data": '{"table": 4}'}
+        print(f"[PASS] Payment intent created - {intent.id}")
+    
+    def test_gateway_interface_abstract(self):
+        """Test a gateway must implement every intent operation"""
+        class Partial(PaymentGateway):
+            async def create_payment_intent(self, amount, currency, metadata=None, idempotency_key=None):
+                raise GatewayError("unused")
+        
+        with pytest.raises(TypeError):
+            PaymentGateway()
+        with pytest.raises(TypeError):
+            Partial()
+        print("[PASS] Gateway interface is abstract")
+    
+    def test_gateway_error(self):
+        """Test Stripe errors surface as non-retryable GatewayError"""
+        gateway = self.make_gateway()
+        with pytest.raises(GatewayError) as excinfo:
+            asyncio.run(gateway.create_payment_intent(10, "usd"))
+        assert excinfo.value.status_code == 400
+        assert not excinfo.value.retryable
+        print("[PASS] Gateway errors mapped")
+    
+    def test_concurrent_requests_bounded(self):
+        """Test concurrent intents share the client and respect the concurrency cap"""
+        stub = StripeStub(latency_ms=20)
+        gateway = StripeGateway(
+            "sk_test_stub", base_url="http://stripe.test", max_concurrency=2,
+            transport=httpx.ASGITransport(app=stub.build_app())
+        )
+        
+        async def burst():
+            intents = await asyncio.gather(*[gateway.create_payment_intent(100, "usd") for _ in range(6)])
+            await gateway.aclose()
+            return intents
+        
+        intents = asyncio.run(burst())
+        assert len({intent.id for intent in intents}) == 6
+        assert len(stub.intents) == 6
+        print("[PASS] Concurrent payment intents")
+    
+    def test_endpoint_uses_gateway(self):
+        """Test the create-payment-intent endpoint goes through the injected gateway"""
+        stub = StripeStub()
+        app.dependency_overrides[get_payment_gateway] = lambda: self.make_gateway(stub)
+        try:
+            response = client.post("/api/stripe/create-payment-intent", json={
+                "amount": 12.5, "order_data": {"table": 4}
+            })
+            assert response.status_code == 200
+            data = response.json()
+            assert data["paymentIntentId"] in stub.intents
+            assert stub.intents[data["paymentIntentId"]]["amount"] == 1250
+            
+            response = client.post("/api/stripe/create-payment-intent", json={
+                "amount": 0.1, "order_data": {}
+            })
+            assert response.status_code == 400
+            
+            # Intents for an order charge its stored total, whatever the client sends
+            order = client.post("/api/orders", json={"table_number": 4, "items": [{"id": 6}]}).json()
+            response = client.post("/api/stripe/create-payment-intent", json={
+                "amount": 0.5, "order_data": {"order_id": order["id"]}
+            })
+            assert response.status_code == 200
+            assert stub.intents[response.json()["paymentIntentId"]]["amount"] == round(order["total"] * 100)
+            response = client.post("/api/stripe/create-payment-intent", json={
+                "amount": 0.5, "order_data": {"order_id": 999999}
+            })
+            assert response.status_code == 404
+        finally:
+            app.dependency_overrides.pop(get_payment_gateway, None)
+        print("[PASS] Payment intent endpoint")
+    
+    def test_endpoint_uses_injected_database(self):
+        """Test the order total for an intent is read through the injected database"""
+        from database import get_database
+        
+        class RecordingDatabase:
+            def __init__(self):
+                self.names = []
+            
+            async def run(self, fn, *args, name=None):
+                self.names.append(name)
+                return await db.run(fn, *args, name=name)
+        
+        recording = RecordingDatabase()
+        order = client.post("/api/orders", json={"table_number": 4, "items": [{"id": 5}]}).json()
+        app.dependency_overrides[get_payment_gateway] = lambda: self.make_gateway(StripeStub())
+        app.dependency_overrides[get_database] = lambda: recording
+        try:
+            response = client.post("/api/stripe/create-payment-intent", json={
+                "amount": 0.5, "order_data": {"order_id": order["id"]}
+            })
+            assert response.status_code == 200
+        finally:
+            app.dependency_overrides.pop(get_payment_gateway, None)
+            app.dependency_overrides.pop(get_database, None)
+        assert recording.names == ["order_total"]
+        print("[PASS] Payment intent endpoint uses the injected database")
+
+class TestIdempotency:
+    """Test Idempotency-Key handling for order, payment and intent creation"""
+    
+    def test_order_retry_replayed(self):
+        """Test a retried order returns the first order instead of a new one"""
+        order = {"table_number": 6, "items": [{"id": 5, "qty": 1}], "status": "pending"}
+        headers = {"Idempotency-Key": "order-retry-1"}
+        first = client.post("/api/orders", json=order, headers=headers)
+        second = client.post("/api/orders", json=order, headers=headers)
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        assert "Idempotent-Replayed" not in first.headers
+        assert second.headers["Idempotent-Replayed"] == "true"
+        
+        third = client.post("/api/orders", json=order)
+        assert third.json()["id"] != first.json()["id"]
+        print(f"[PASS] Order retry replayed - ID: {first.json()['id']}")
+    
+    def test_key_reused_for_different_request(self):
+        """Test a key cannot be reused with a different body"""
+        headers = {"Idempotency-Key": "order-retry-2"}
+        order = {"table_number": 6, "items": [{"id": 5, "qty": 1}], "status": "pending"}
+        assert client.post("/api/orders", json=order, headers=headers).status_code == 200
+        order["items"][0]["qty"] = 2
+        response = client.post("/api/orders", json=order, headers=headers)
+        assert response.status_code == 422
+        print("[PASS] Reused key rejected")
+    
+    def test_client_errors_replayed(self):
+        """Test 4xx responses are stored and replayed"""
+        headers = {"Idempotency-Key": "payment-missing-order"}
+        payment = {"order_id": 999999, "amount": 5.0}
+        assert client.post("/api/payments", json=payment, headers=headers).status_code == 404
+        response = client.post("/api/payments", json=payment, headers=headers)
+        assert response.status_code == 404
+        assert response.headers["Idempotent-Replayed"] == "true"
+        print("[PASS] Client errors replayed")
+    
+    def test_concurrent_duplicates_wait(self):
+        """Test concurrent duplicates wait for the first request and share its result"""
+        from idempotency import IdempotencyStore
+        store = IdempotencyStore()
+        calls = []
+        
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"id": len(calls)}
+        
+        async def burst():
+            return await asyncio.gather(*[
+                store.run("test", "same-key", {"n": 1}, Response(), handler) for _ in range(5)
+            ])
+        
+        results = asyncio.run(burst())
+        assert len(calls) == 1
+        assert results == [{"id": 1}] * 5
+        print("[PASS] Concurrent duplicates waited")
+    
+    def test_server_errors_release_key(self):
+        """Test a 5xx lets the next retry run the handler again, and keys expire"""
+        from idempotency import IdempotencyStore
+        store = IdempotencyStore(ttl=0)
+        attempts = []
+        
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise HTTPException(status_code=502, detail="gateway down")
+            return {"ok": len(attempts)}
+        
+        with pytest.raises(HTTPException):
+            asyncio.run(store.run("test", "key", {}, Response(), flaky))
+        assert asyncio.run(store.run("test", "key", {}, Response(), flaky)) == {"ok": 2}
+        # ttl=0: the stored result has already expired
+        assert asyncio.run(store.run("test", "key", {}, Response(), flaky)) == {"ok": 3}
+        print("[PASS] Server errors and expired keys rerun")
+    
+    def test_keys_shared_across_processes(self):
+        """Test keys live in the database, so another worker or a restarted one replays them"""
+        from idempotency import IdempotencyStore, claim_key, REPLAYED_HEADER
+        first, second = IdempotencyStore(), IdempotencyStore()
+        calls = []
+        
+        async def handler():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {"id": len(calls)}
+        
+        async def both_workers():
+            return await asyncio.gather(
+                first.run("test", "shared-key", {"n": 1}, Response(), handler),
+                second.run("test", "shared-key", {"n": 1}, Response(), handler),
+            )
+        
+        assert asyncio.run(both_workers()) == [{"id": 1}, {"id": 1}]
+        restarted = IdempotencyStore()
+        replay = Response()
+        assert asyncio.run(restarted.run("test", "shared-key", {"n": 1}, replay, handler)) == {"id": 1}
+        assert replay.headers[REPLAYED_HEADER] == "true"
+        assert len(calls) == 1
+        
+        # A claim whose process died is taken over once its lease runs out
+        with pool.connection() as conn:
+            assert claim_key(conn, "test", "orphaned-key", "fp", "dead-worker", 0) is None
+        assert asyncio.run(restarted.run("test", "orphaned-key", {"n": 1}, Response(), handler)) == {"id": 2}
+        print("[PASS] Idempotency keys shared across workers")
+    
+    def test_payment_intent_retry_single_stripe_call(self):
+        """Test retried payment intents reuse one Stripe intent"""
+        stub = StripeStub(latency_ms=20)
+        stub_gateway = StripeGateway(
+            "sk_test_stub", base_url="http://stripe.test",
+            transport=httpx.ASGITransport(app=stub.build_app())
+        )
+        app.dependency_overrides[get_payment_gateway] = lambda: stub_gateway
+        
+        async def retry_storm():
+            async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+                return await asyncio.gather(*[
+                    ac.post("/api/stripe/create-payment-intent",
+                            json={"amount": 20.0, "order_data": {"table": 2}},
+                            headers={"Idempotency-Key": "intent-retry-1"})
+                    for _ in range(4)
+                ])
+        
+        try:
+            responses = asyncio.run(retry_storm())
+        finally:
+            app.dependency_overrides.pop(get_payment_gateway, None)
+        assert all(r.status_code == 200 for r in responses)
+        assert len({r.json()["paymentIntentId"] for r in responses}) == 1
+        assert len(stub.intents) == 1
+        print("[PASS] Payment intent retries deduplicated")
+
+class TestPaymentReconciliation:
+    """Test the bulk reconciliation job against the local Stripe stub"""
+    
+    def make_gateway(self, stub):
+        return StripeGateway(
+            "sk_test_stub", base_url="http://stripe.test",
+            transport=httpx.ASGITransport(app=stub.build_app())
+        )
+    
+    def order(self):
+        return client.post("/api/orders", json={"table_number": 6, "items": [{"id": 5}]}).json()
+    
+    def intent(self, stub, order, status, amount=None):
+        gateway = self.make_gateway(stub)
+        amount = round(order["total"] * 100) if amount is None else amount
+        intent = asyncio.run(gateway.create_payment_intent(amount, "usd", {"order_id": str(order["id"])}))
+        stub.set_status(intent.id, status)
+        return intent.id
+    
+    def payment_status(self, payment_id):
+        with pool.connection() as conn:
+            return conn.execute('SELECT status, transaction_id FROM payments WHERE id = ?', (payment_id,)).fetchone()
+    
+    def test_reconcile_endpoint(self):
+        """Test pending payments settle from their intents and missing payments are recorded"""
+        stub = StripeStub()
+        by_order = self.order()
+        local = client.post("/api/payments", json={"order_id": by_order["id"], "amount": by_order["total"]}).json()
+        paid_intent = self.intent(stub, by_order, "succeeded")
+        
+        canceled = self.order()
+        canceled_intent = self.intent(stub, canceled, "canceled")
+        with pool.connection() as conn:
+            canceled_payment = conn.execute(
+                "INSERT INTO payments (order_id, amount, status, transaction_id) VALUES (?, 3.2, 'pending', ?)",
+                (canceled["id"], canceled_intent)
+            ).lastrowid
+            conn.commit()
+        
+        unrecorded = self.order()
+        unrecorded_intent = self.intent(stub, unrecorded, "succeeded")
+        
+        app.dependency_overrides[get_payment_gateway] = lambda: self.make_gateway(stub)
+        try:
+            dry_run = client.post("/api/payments/reconcile", json={"dry_run": True}).json()
+            assert (dry_run["intents"], dry_run["completed"], dry_run["failed"], dry_run["recorded"]) == (3, 1, 1, 1)
+            assert self.payment_status(local["id"])[0] == "pending"
+            
+            report = client.post("/api/payments/reconcile", json={}).json()
+            assert (report["completed"], report["failed"], report["recorded"]) == (1, 1, 1)
+            again = client.post("/api/payments/reconcile", json={}).json()
+            assert (again["completed"], again["failed"], again["recorded"]) == (0, 0, 0)
+        finally:
+            app.dependency_overrides.pop(get_payment_gateway, None)
+        
+        assert self.payment_status(local["id"]) == ("completed", paid_intent)
+        assert self.payment_status(canceled_payment)[0] == "failed"
+        with pool.connection() as conn:
+            statuses = dict(conn.execute('SELECT id, status FROM orders').fetchall())
+            assert statuses[by_order["id"]] == "paid"
+            assert statuses[unrecorded["id"]] == "paid"
+            assert statuses[canceled["id"]] == "pending"
+            assert conn.execute(
+                'SELECT COUNT(*) FROM payments WHERE transaction_id = ?', (unrecorded_intent,)
+            ).fetchone()[0] == 1
+        print("[PASS] Payments reconciled")
+    
+    def test_paging_and_batches(self):
+        """Test small gateway pages, retrieves and batches cover every payment"""
+        stub = StripeStub()
+        orders = [self.order() for _ in range(5)]
+        with pool.connection() as conn:
+            payment_ids = [
+                conn.execute(
+                    "INSERT INTO payments (order_id, amount, status, transaction_id) VALUES (?, 3.2, 'pending', ?)",
+                    (order["id"], self.intent(stub, order, "succeeded"))
+                ).lastrowid
+                for order in orders
+            ]
+            conn.commit()
+        # Two intents fall outside the listed window and must be retrieved
+        for intent in list(stub.intents.values())[:2]:
+            intent["created"] -= 10 * 86400
+        
+        reconciler = Reconciler(db, self.make_gateway(stub), page_size=2, batch_size=2, concurrency=2)
+        report = asyncio.run(reconciler.run())
+        assert report.intents == 3
+        assert report.retrieved >= 2
+        assert report.completed == 5
+        assert all(self.payment_status(payment_id)[0] == "completed" for payment_id in payment_ids)
+        print("[PASS] Reconciliation paging")
+    
+    def test_order_matches_page_by_page(self):
+        """Test listed intents are matched to payments without an intent id one page at a time"""
+        stub = StripeStub()
+        orders = [self.order() for _ in range(5)]
+        payments = [
+            client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+            for order in orders
+        ]
+        intents = [self.intent(stub, order, "succeeded") for order in orders]
+        
+        pages = query_count("reconcile_order_matches")
+        report = asyncio.run(Reconciler(db, self.make_gateway(stub), page_size=2).run())
+        assert query_count("reconcile_order_matches") - pages == 3
+        assert (report.intents, report.completed, report.recorded) == (5, 5, 0)
+        assert [self.payment_status(p["id"]) for p in payments] == [("completed", intent) for intent in intents]
+        print("[PASS] Order matches reconciled page by page")
+    
+    def test_amount_mismatch_held_for_review(self):
+        """Test an intent that collected less than the order total doesn't mark the order paid"""
+        stub = StripeStub()
+        order = self.order()
+        short_intent = self.intent(stub, order, "succeeded", amount=round(order["total"] * 100) - 100)
+        
+        report = asyncio.run(Reconciler(db, self.make_gateway(stub)).run())
+        assert (report.recorded, report.review) == (0, 1)
+        with pool.connection() as conn:
+            assert conn.execute('SELECT status FROM orders WHERE id = ?', (order["id"],)).fetchone()[0] == "pending"
+            assert conn.execute(
+                'SELECT status FROM payments WHERE transaction_id = ?', (short_intent,)
+            ).fetchone()[0] == "review"
+        print("[PASS] Short intent held for review")
+
+class TestWebhookInbox:
+    """Test Stripe webhooks are stored durably and applied by the worker"""
+    
+    SECRET = "whsec_test_inbox"
+    
+    @pytest.fixture(autouse=True)
+    def webhook_secret(self, monkeypatch):
+        monkeypatch.setenv("STRIPE_WEBHOOK_SECRET", self.SECRET)
+    
+    def deliver(self, event=None, content=None, secret=SECRET):
+        """POST a delivery signed the way Stripe signs them"""
+        payload = content if content is not None else json.dumps(event).encode()
+        timestamp = int(time.time())
+        signature = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+        return client.post("/api/stripe/webhook", content=payload, headers={
+            "Content-Type": "application/json", "Stripe-Signature": f"t={timestamp},v1={signature}"
+        })
+    
+    def intent_event(self, event_id, event_type, intent_id, order):
+        amount = round(order["total"] * 100)
+        return {
+            "id": event_id,
+            "type": event_type,
+            "data": {"object": {
+                "id": intent_id, "amount": amount, "amount_received": amount,
+                "metadata": {"order_id": str(order["id"])}
+            }}
+        }
+    
+    def inbox_row(self, event_id):
+        with pool.connection() as conn:
+            return conn.execute(
+                'SELECT status, attempts, processed_at FROM webhook_events WHERE event_id = ?', (event_id,)
+            ).fetchone()
+    
+    def test_webhook_acknowledged_and_deduplicated(self):
+        """Test deliveries are stored once and acknowledged without processing"""
+        event = {"id": "evt_inbox_dup", "type": "customer.created", "data": {"object": {}}}
+        for _ in range(2):
+            response = self.deliver(event)
+            assert response.status_code == 200
+            assert response.json() == {"status": "success"}
+        with pool.connection() as conn:
+            count = conn.execute(
+                'SELECT COUNT(*) FROM webhook_events WHERE event_id = ?', ("evt_inbox_dup",)
+            ).fetchone()[0]
+        assert count == 1
+        assert self.inbox_row("evt_inbox_dup")[2] is None
+        print("[PASS] Webhook stored once")
+    
+    def test_payment_succeeded_marks_order_paid(self):
+        """Test the worker records the payment and marks the order paid"""
+        order = client.post("/api/orders", json={
+            "table_number": 9, "items": [{"id": 5, "qty": 1}], "status": "pending"
+        }).json()
+        event = self.intent_event("evt_inbox_paid", "payment_intent.succeeded", "pi_inbox_paid", order)
+        self.deliver(event)
+        self.deliver(event)
+        
+        asyncio.run(webhook_worker.drain())
+        
+        assert self.inbox_row("evt_inbox_paid")[0] == "processed"
+        with pool.connection() as conn:
+            order_status = conn.execute('SELECT status FROM orders WHERE id = ?', (order["id"],)).fetchone()[0]
+            payments = conn.execute(
+                'SELECT amount, status FROM payments WHERE transaction_id = ?', ("pi_inbox_paid",)
+            ).fetchall()
+        assert order_status == "paid"
+        assert payments == [(order["total"], "completed")]
+        print(f"[PASS] Webhook applied - Order {order['id']} paid")
+    
+    def test_late_failure_keeps_completed_payment(self, monkeypatch):
+        """Test a payment_failed arriving after succeeded for the same intent changes nothing"""
+        order = client.post("/api/orders", json={"table_number": 9, "items": [{"id": 5, "qty": 1}]}).json()
+        self.deliver(self.intent_event("evt_inbox_late_ok", "payment_intent.succeeded", "pi_inbox_late", order))
+        self.deliver(self.intent_event("evt_inbox_late_fail", "payment_intent.payment_failed", "pi_inbox_late", order))
+        
+        published = []
+        monkeypatch.setattr(broker, "publish", lambda event_type, *args, **fields: published.append(event_type))
+        asyncio.run(webhook_worker.drain())
+        
+        assert self.inbox_row("evt_inbox_late_fail")[0] == "processed"
+        assert published == ["order.paid"]
+        with pool.connection() as conn:
+            assert conn.execute('SELECT status FROM orders WHERE id = ?', (order["id"],)).fetchone()[0] == "paid"
+            payment_id, status = conn.execute(
+                'SELECT id, status FROM payments WHERE transaction_id = ?', ("pi_inbox_late",)
+            ).fetchone()
+        assert status == "completed"
+        assert client.put(f"/api/payments/{payment_id}/reject").status_code == 409
+        print("[PASS] Late failure ignored for completed payment")
+    
+    def test_amount_mismatch_held_for_review(self):
+        """Test an intent for less than the order total doesn't mark the order paid"""
+        order = client.post("/api/orders", json={"table_number": 9, "items": [{"id": 6, "qty": 2}]}).json()
+        event = self.intent_event("evt_inbox_short", "payment_intent.succeeded", "pi_inbox_short", order)
+        event["data"]["object"]["amount"] = event["data"]["object"]["amount_received"] = 1
+        self.deliver(event)
+        
+        asyncio.run(webhook_worker.drain())
+        
+        with pool.connection() as conn:
+            order_status = conn.execute('SELECT status FROM orders WHERE id = ?', (order["id"],)).fetchone()[0]
+            payment_status = conn.execute(
+                'SELECT status FROM payments WHERE transaction_id = ?', ("pi_inbox_short",)
+            ).fetchone()[0]
+        assert order_status == "pending"
+        assert payment_status == "review"
+        print("[PASS] Short payment held for review")
+    
+    def test_unsigned_events_rejected(self, monkeypatch):
+        """Test deliveries without a valid signature never reach the inbox"""
+        order = client.post("/api/orders", json={"table_number": 9, "items": [{"id": 5}]}).json()
+        event = self.intent_event("evt_inbox_forged", "payment_intent.succeeded", "pi_inbox_forged", order)
+        assert client.post("/api/stripe/webhook", json=event).status_code == 400
+        assert self.deliver(event, secret="whsec_wrong").status_code == 400
+        monkeypatch.delenv("STRIPE_WEBHOOK_SECRET")
+        assert client.post("/api/stripe/webhook", json=event).status_code == 503
+        assert self.inbox_row("evt_inbox_forged") is None
+        print("[PASS] Unsigned webhooks rejected")
+    
+    def test_batch_isolates_failures(self):
+        """Test a bad event is marked failed without rolling back its batch, and can be replayed"""
+        order = client.post("/api/orders", json={
+            "table_number": 9, "items": [{"id": 5, "qty": 1}], "status": "pending"
+        }).json()
+        self.deliver({"id": "evt_inbox_bad", "type": "payment_intent.succeeded", "data": {}})
+        self.deliver(self.intent_event(
+            "evt_inbox_failed", "payment_intent.payment_failed", "pi_inbox_failed", order
+        ))
+        
+        with pool.connection() as conn:
+            handled, notifications = process_batch(conn, batch_size=100)
+        assert handled >= 2
+        assert self.inbox_row("evt_inbox_bad")[0] == "failed"
+        assert self.inbox_row("evt_inbox_failed")[0] == "processed"
+        assert ("payment.failed", order["id"]) in [(n[0], n[1]) for n in notifications]
+        
+        response = client.post("/api/stripe/webhook/replay", json={"event_ids": ["evt_inbox_bad"]})
+        assert response.json() == {"requeued": 1}
+        status, attempts, processed_at = self.inbox_row("evt_inbox_bad")
+        assert status == "pending" and attempts == 1 and processed_at is None
+        asyncio.run(webhook_worker.drain())
+        assert self.inbox_row("evt_inbox_bad")[:2] == ("failed", 2)
+        print("[PASS] Failed webhook isolated and replayed")
+    
+    def test_invalid_payload_rejected(self):
+        """Test malformed deliveries are rejected before reaching the inbox"""
+        response = self.deliver(content=b"not json")
+        assert response.status_code == 400
+        response = self.deliver({"type": "payment_intent.succeeded"})
+        assert response.status_code == 400
+        print("[PASS] Invalid webhooks rejected")
+
+class TestSerialization:
+    """Test list endpoints encode rows directly without losing their schema"""
+    
+    def test_list_endpoints_match_models(self):
+        """Test row-encoded responses validate against the documented models"""
+        client.post("/api/orders", json={"table_number": 2, "items": [{"id": 1, "qty": 1}]})
+        for path, model in (("/api/orders", Order), ("/api/tables", Table), ("/api/payments", Payment)):
+            response = client.get(path)
+            assert response.status_code == 200
+            assert response.headers["content-type"] == "application/json"
+            rows = response.json()
+            assert isinstance(rows, list)
+            for row in rows:
+                assert model(**row).model_dump() == row
+        print("[PASS] Row-encoded lists match their models")
+    
+    def test_openapi_schema_kept(self):
+        """Test response_model still documents the list endpoints"""
+        spec = client.get("/openapi.json").json()
+        for path, name in (("/api/orders", "Order"), ("/api/tables", "Table"), ("/api/payments", "Payment")):
+            schema = spec["paths"][path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+            assert schema["items"]["$ref"] == f"#/components/schemas/{name}"
+        print("[PASS] OpenAPI schemas kept")
+    
+    def test_dumps(self):
+        """Test the encoder output is compact UTF-8 JSON"""
+        from serialization import dumps
+        body = dumps({"name": "Jalapeño Nachos", "price": 8.5, "tags": [None, True]})
+        assert body == '{"name":"Jalapeño Nachos","price":8.5,"tags":[null,true]}'.encode("utf-8")
+        print("[PASS] Compact JSON encoding")
+    
+    def test_benchmark_paths_agree(self):
+        """Test the serialization benchmark runs and both paths produce the same JSON"""
+        from benchmarks.serialization_bench import run
+        results = run([20], repeat=1)
+        assert set(results) == {"orders/20", "payments/20", "tables/20"}
+        assert all(r["rows_us_per_row"] > 0 for r in results.values())
+        print(f"[PASS] Serialization benchmark - orders {results['orders/20']['speedup']}x")
+
 class TestAPIDocumentation:
     """Test API documentation endpoints"""
     
@@ -189,6 +1654,402 @@ class TestAPIDocumentation:
         assert response.status_code == 200
         print("[PASS] Swagger documentation available")
 
+class TestMultiWorker:
+    """Test settings that keep per-process state in step across workers"""
+    
+    def test_menu_cache_expires(self):
+        """Test menu snapshots reload after the TTL even without an invalidation"""
+        cache = MenuCache(db, ttl=0)
+        before = query_count("load_menu")
+        asyncio.run(cache.get())
+        asyncio.run(cache.get())
+        assert query_count("load_menu") == before + 2
+        
+        cache = MenuCache(db, ttl=60)
+        asyncio.run(cache.get())
+        asyncio.run(cache.get())
+        assert query_count("load_menu") == before + 3
+        print("[PASS] Menu cache TTL")
+    
+    def test_worker_environment(self, monkeypatch):
+        """Test kitchen queue refresh is only turned on for several workers"""
+        monkeypatch.delenv("SEATSERVE_KITCHEN_REFRESH_SECONDS", raising=False)
+        prepare_environment(1)
+        assert "SEATSERVE_KITCHEN_REFRESH_SECONDS" not in os.environ
+        prepare_environment(4)
+        assert os.environ["SEATSERVE_KITCHEN_REFRESH_SECONDS"] == "30"
+        monkeypatch.setenv("SEATSERVE_KITCHEN_REFRESH_SECONDS", "2")
+        prepare_environment(4)
+        assert os.environ["SEATSERVE_KITCHEN_REFRESH_SECONDS"] == "2"
+        print("[PASS] Multi-worker environment defaults")
+    
+    def test_worker_count_default(self, monkeypatch):
+        """Test serve.py runs a worker per CPU unless told otherwise"""
+        import importlib
+        import serve
+        monkeypatch.delenv("SEATSERVE_WORKERS", raising=False)
+        assert importlib.reload(serve).WORKERS == (os.cpu_count() or 1)
+        monkeypatch.setenv("SEATSERVE_WORKERS", "1")
+        assert importlib.reload(serve).WORKERS == 1
+        print("[PASS] One worker per CPU by default")
+    
+    def test_events_relayed_between_workers(self):
+        """Test an event published in one worker reaches another worker's subscribers and listeners once"""
+        from order_events import OrderEventBroker, EventRelay
+        first, second = OrderEventBroker(), OrderEventBroker()
+        heard = []
+        second.add_listener(heard.append)
+        
+        async def main():
+            relays = [EventRelay(db, first, interval=0.01), EventRelay(db, second, interval=0.01)]
+            for relay in relays:
+                await relay.start()
+            here = first.subscribe(table_topic(9023))
+            there = second.subscribe(table_topic(9023))
+            first.publish("order.created", 9023001, 9023, "pending")
+            received = await asyncio.wait_for(there.get(), 1)
+            await asyncio.sleep(0.05)
+            for relay in relays:
+                await relay.stop()
+            return received, here.queue.qsize(), there.queue.qsize()
+        
+        received, here_left, there_left = asyncio.run(main())
+        assert received["type"] == "order.created"
+        assert received["order_id"] == 9023001
+        assert [event["order_id"] for event in heard] == [9023001]
+        # The publisher's own subscriber got it once, directly, and no echo came back
+        assert here_left == 1
+        assert there_left == 0
+        print("[PASS] Order events relayed between workers")
+    
+    def test_kitchen_follows_other_workers(self):
+        """Test relayed claims and completions update another worker's kitchen queues"""
+        from kitchen import KitchenQueues
+        queues = KitchenQueues()
+        paid = {"type": "order.paid", "order_id": 9024001, "table_number": 4, "status": "paid",
+                "stand": "kq-relay", "paid_at": "2026-10-17T12:00:00", "prep_seconds": 60}
+        queues.on_event(paid)
+        queues.on_event({**paid, "type": "order.preparing", "status": "preparing"})
+        snapshot = queues.snapshot("kq-relay", 10)
+        assert snapshot["waiting"] == 0
+        assert [t["order_id"] for t in snapshot["in_progress"]] == [9024001]
+        queues.on_event({**paid, "type": "order.ready", "status": "ready"})
+        assert queues.snapshot("kq-relay", 10)["in_progress"] == []
+        print("[PASS] Kitchen queues follow other workers")
+    
+    def test_complete_claim_from_other_worker(self):
+        """Test an order claimed through another worker can be completed here"""
+        from kitchen import kitchen
+        order = client.post("/api/orders", json={"table_number": 4, "stand": "kq-elsewhere", "items": [{"id": 5}]}).json()
+        payment = client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+        assert client.put(f"/api/payments/{payment['id']}/confirm").status_code == 200
+        # Another worker claimed it; this one hasn't heard yet
+        with pool.connection() as conn:
+            conn.execute("UPDATE orders SET status = 'preparing' WHERE id = ?", (order["id"],))
+            conn.commit()
+        assert kitchen.in_progress("kq-elsewhere", order["id"]) is None
+        
+        response = client.post(f"/api/kitchen/kq-elsewhere/orders/{order['id']}/complete")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ready"
+        assert client.get("/api/kitchen/kq-elsewhere/queue").json()["waiting"] == 0
+        print("[PASS] Completing another worker's claim")
+
+class TestDatabasePool:
+    """Test pooled SQLite connections"""
+    
+    def test_connection_pragmas(self):
+        """Test pooled connections are tuned for concurrent access"""
+        with pool.connection() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+            assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+            assert conn.execute("PRAGMA busy_timeout").fetchone()[0] > 0
+            assert conn.execute("PRAGMA journal_size_limit").fetchone()[0] > 0
+            # Writers take the lock up front so other processes' commits can't fail them
+            assert conn.isolation_level == "IMMEDIATE"
+        print("[PASS] Pooled connection pragmas")
+    
+    def test_connection_reused(self):
+        """Test a released connection is handed out again"""
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            assert second is first
+        print("[PASS] Pooled connection reuse")
+    
+    def test_rollback_on_error(self):
+        """Test an exception releases the connection and rolls back"""
+        with pytest.raises(RuntimeError):
+            with pool.connection() as conn:
+                conn.execute("UPDATE restaurant_tables SET seats = -1")
+                raise RuntimeError("boom")
+        with pool.connection() as conn:
+            assert not conn.in_transaction
+            count = conn.execute("SELECT COUNT(*) FROM restaurant_tables WHERE seats = -1").fetchone()[0]
+            assert count == 0
+        print("[PASS] Pooled connection rollback on error")
+    
+    def test_warm_and_reopen(self, tmp_path):
+        """Test warming opens the whole pool up front and a closed pool can be reopened"""
+        warm_pool = ConnectionPool(str(tmp_path / "warm.db"), size=3)
+        assert warm_pool.warm() == 3
+        assert warm_pool.warm() == 0
+        warm_pool.close()
+        with pytest.raises(RuntimeError):
+            warm_pool.acquire()
+        warm_pool.open()
+        with warm_pool.connection() as conn:
+            assert conn.execute("SELECT 1").fetchone() == (1,)
+        warm_pool.close()
+        print("[PASS] Pool warm-up and reopen")
+
+class TestDatabaseAccess:
+    """Test the async database access layer"""
+    
+    def test_queries_run_off_event_loop(self):
+        """Test database work executes on a worker thread"""
+        def current_thread_name(conn):
+            return threading.current_thread().name
+        
+        async def main():
+            return threading.current_thread().name, await db.run(current_thread_name)
+        
+        loop_thread, worker_thread = asyncio.run(main())
+        assert worker_thread != loop_thread
+        assert worker_thread.startswith("seatserve-db")
+        print(f"[PASS] Database work runs on {worker_thread}")
+    
+    def test_concurrency_limit(self):
+        """Test no more than max_concurrency queries run at once"""
+        limited = Database(pool, max_concurrency=2)
+        lock = threading.Lock()
+        running = [0, 0]  # current, peak
+        
+        def slow_query(conn):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            conn.execute("SELECT COUNT(*) FROM menu_items").fetchone()
+            threading.Event().wait(0.05)
+            with lock:
+                running[0] -= 1
+        
+        async def main():
+            await asyncio.gather(*(limited.run(slow_query) for _ in range(6)))
+        
+        before = query_count("slow_query")
+        asyncio.run(main())
+        limited._executor.shutdown()
+        assert running[1] <= 2
+        assert query_count("slow_query") == before + 6
+        print(f"[PASS] Concurrency limit - peak {running[1]} concurrent queries")
+    
+    def test_query_timings_recorded(self):
+        """Test endpoint queries are timed by name"""
+        before = query_count("get_tables")
+        client.get("/api/tables")
+        timings = db_query_duration.labels("get_tables")
+        assert timings.count == before + 1
+        assert timings.sum >= 0
+        print(f"[PASS] Query timings - get_tables avg {timings.sum / timings.count * 1000:.2f} ms")
+    
+    def test_payment_for_missing_order(self):
+        """Test errors raised inside database work reach the client"""
+        response = client.post("/api/payments", json={"order_id": 999999, "amount": 5.0})
+        assert response.status_code == 404
+        print("[PASS] Payment for missing order rejected")
+
+class TestMigrations:
+    """Test schema migrations and the indexes they add"""
+    
+    # Hot queries and the index each one must use
+    QUERY_PLANS = [
+        ("SELECT id FROM orders ORDER BY timestamp DESC, id DESC LIMIT 50", "idx_orders_timestamp"),
+        ("SELECT id FROM orders WHERE status = 'paid' ORDER BY timestamp DESC, id DESC LIMIT 50",
+         "idx_orders_status_timestamp"),
+        ("SELECT id FROM orders WHERE table_number = 3 ORDER BY timestamp DESC, id DESC LIMIT 50",
+         "idx_orders_table_timestamp"),
+        ("SELECT id FROM orders WHERE status IN ('paid', 'preparing') AND paid_at IS NOT NULL", "idx_orders_kitchen"),
+        ("SELECT id FROM orders WHERE status IN ('paid', 'ready') AND timestamp < '2001' LIMIT 500",
+         "idx_orders_status_timestamp"),
+        ("SELECT * FROM order_items WHERE order_id IN (1, 2) ORDER BY order_id, line_no", "idx_order_items_order"),
+        ("SELECT id FROM payments ORDER BY timestamp DESC", "idx_payments_timestamp"),
+        ("SELECT id FROM payments WHERE timestamp >= '2001' ORDER BY timestamp, id LIMIT 1000", "idx_payments_timestamp"),
+        ("SELECT 1 FROM payments WHERE order_id = 1 AND status = 'completed'", "idx_payments_order"),
+        ("SELECT id FROM payments WHERE status = 'pending' AND id > 0 ORDER BY id LIMIT 100", "idx_payments_pending"),
+        ("SELECT id FROM payments WHERE transaction_id = 'pi_1'", "idx_payments_transaction"),
+    ]
+    
+    @staticmethod
+    def plan(conn, sql):
+        return " / ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+    
+    def test_database_at_head(self):
+        """Test init_db leaves the database at the latest revision"""
+        assert current_revision(pool.path) == head_revision()
+        print("[PASS] Database at the latest revision")
+    
+    def test_query_plans_use_indexes(self):
+        """Test order and payment queries search an index instead of scanning"""
+        with pool.connection() as conn:
+            for sql, index in self.QUERY_PLANS:
+                assert index in self.plan(conn, sql), sql
+        print("[PASS] Query plans use indexes")
+    
+    def test_downgrade_and_upgrade(self, tmp_path):
+        """Test index revisions can be rolled back and applied again"""
+        path = str(tmp_path / "migrations.db")
+        upgrade_schema(path)
+        assert current_revision(path) == head_revision()
+        
+        downgrade_schema(path, "0001")
+        assert current_revision(path) == "0001"
+        conn = sqlite3.connect(path)
+        try:
+            for sql, index in self.QUERY_PLANS:
+                assert index not in self.plan(conn, sql)
+            assert "SCAN orders" in self.plan(conn, self.QUERY_PLANS[0][0])
+        finally:
+            conn.close()
+        
+        upgrade_schema(path)
+        conn = sqlite3.connect(path)
+        try:
+            assert current_revision(path) == head_revision()
+            assert "idx_orders_timestamp" in self.plan(conn, self.QUERY_PLANS[0][0])
+        finally:
+            conn.close()
+        print("[PASS] Migrations downgrade and upgrade")
+
+class TestOrderArchive:
+    """Test archiving old closed orders with read-through lookups"""
+    
+    # Cutoff that only reaches orders backdated by these tests
+    OLDER_THAN_HOURS = 24 * 365 * 10
+    
+    def old_order(self, paid=True):
+        order = client.post("/api/orders", json={"table_number": 3, "items": [{"id": 7, "qty": 1}]}).json()
+        payment = client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+        if paid:
+            client.put(f"/api/payments/{payment['id']}/confirm")
+        with pool.connection() as conn:
+            conn.execute("UPDATE orders SET timestamp = '2001-01-01T12:00:00' WHERE id = ?", (order["id"],))
+            conn.commit()
+        return order, payment
+    
+    def live(self, order_id):
+        with pool.connection() as conn:
+            return (
+                conn.execute('SELECT COUNT(*) FROM orders WHERE id = ?', (order_id,)).fetchone()[0],
+                conn.execute('SELECT COUNT(*) FROM order_items WHERE order_id = ?', (order_id,)).fetchone()[0],
+                conn.execute('SELECT COUNT(*) FROM payments WHERE order_id = ?', (order_id,)).fetchone()[0],
+            )
+    
+    def test_archive_and_read_through(self):
+        """Test closed orders move out of the live tables and stay readable by id"""
+        order, payment = self.old_order()
+        pending, _ = self.old_order(paid=False)
+        
+        response = client.post("/api/archive/run", json={"older_than_hours": self.OLDER_THAN_HOURS})
+        assert response.status_code == 200
+        assert response.json()["archived"] >= 1
+        assert self.live(order["id"]) == (0, 0, 0)
+        assert self.live(pending["id"]) == (1, 1, 1)
+        
+        archived = client.get(f"/api/orders/{order['id']}").json()
+        assert archived["status"] == "paid"
+        assert archived["items"][0]["name"] == "Greek Salad"
+        assert client.get(f"/api/payments/{payment['id']}").json()["status"] == "completed"
+        assert client.get(f"/api/orders/{pending['id']}").json()["status"] == "pending"
+        assert client.get("/api/orders/999999").status_code == 404
+        assert client.get("/api/payments/999999").status_code == 404
+        print("[PASS] Orders archived and read through")
+    
+    def test_batches(self):
+        """Test the job keeps going batch by batch until nothing is left"""
+        orders = [self.old_order()[0] for _ in range(5)]
+        archived = asyncio.run(order_archive.run(self.OLDER_THAN_HOURS, batch_size=2))
+        assert archived == 5
+        assert all(self.live(order["id"]) == (0, 0, 0) for order in orders)
+        assert asyncio.run(order_archive.run(self.OLDER_THAN_HOURS, batch_size=2)) == 0
+        print("[PASS] Archive batches")
+    
+    def test_unsettled_payments_stay_live(self):
+        """Test a pending payment on an archived order stays in the live database"""
+        order, payment = self.old_order()
+        retry = client.post("/api/payments", json={"order_id": order["id"], "amount": order["total"]}).json()
+        asyncio.run(order_archive.run(self.OLDER_THAN_HOURS))
+        assert self.live(order["id"]) == (0, 0, 1)
+        assert client.get(f"/api/payments/{retry['id']}").json()["status"] == "pending"
+        assert client.get(f"/api/payments/{payment['id']}").json()["status"] == "completed"
+        print("[PASS] Unsettled payments kept live")
+    
+    def test_exports_include_archive(self):
+        """Test exports merge archived and live rows in keyset order"""
+        order, payment = self.old_order()
+        asyncio.run(order_archive.run(self.OLDER_THAN_HOURS))
+        assert self.live(order["id"]) == (0, 0, 0)
+        
+        orders = [json.loads(line) for line in client.get("/api/orders/export").text.splitlines()]
+        assert [(o["timestamp"], o["id"]) for o in orders] == sorted((o["timestamp"], o["id"]) for o in orders)
+        exported = next(o for o in orders if o["id"] == order["id"])
+        assert exported["items"][0]["name"] == "Greek Salad"
+        payments = [json.loads(line) for line in client.get("/api/payments/export").text.splitlines()]
+        assert payment["id"] in {p["id"] for p in payments}
+        assert len({p["id"] for p in payments}) == len(payments)
+        
+        async def collect(chunk_size):
+            return b"".join([
+                chunk async for chunk in stream_export(db, "orders", "ndjson", None, None, chunk_size, order_archive.path)
+            ])
+        assert asyncio.run(collect(2)) == asyncio.run(collect(100000))
+        print("[PASS] Exports read through the archive")
+    
+    def test_archive_schema_created_once(self, tmp_path):
+        """Test attaching the archive only creates its schema the first time"""
+        from archive import attached_archive
+        path = str(tmp_path / "attach_archive.db")
+        statements = []
+        with pool.connection() as conn:
+            conn.set_trace_callback(statements.append)
+            try:
+                with attached_archive(conn, path):
+                    pass
+                created = sum("CREATE" in statement for statement in statements)
+                statements.clear()
+                with attached_archive(conn, path):
+                    assert conn.execute("SELECT COUNT(*) FROM archive.orders").fetchone()[0] == 0
+            finally:
+                conn.set_trace_callback(None)
+        assert created > 0
+        assert not any("CREATE" in statement for statement in statements)
+        print("[PASS] Archive schema created once per process")
+
+class TestStartup:
+    """Test the lifespan warm-up and readiness gate"""
+    
+    def test_ready_after_warm_up(self, monkeypatch):
+        """Test startup warms the menu and tables before reporting ready, and shutdown fails readiness"""
+        monkeypatch.setattr(archive_worker, "interval", 0)
+        assert client.get("/ready").status_code == 503
+        try:
+            with TestClient(app) as started:
+                response = started.get("/ready")
+                assert response.status_code == 200
+                assert response.json()["startup_ms"] > 0
+                
+                # Served from the snapshots loaded at startup
+                loads = (query_count("load_menu"), query_count("load_table_index"))
+                assert started.get("/api/menu").status_code == 200
+                assert started.get("/api/tables/available?party_size=2").status_code == 200
+                assert (query_count("load_menu"), query_count("load_table_index")) == loads
+            assert client.get("/ready").status_code == 503
+        finally:
+            # Shutdown closed the shared pools; later tests keep using them
+            db.open()
+            order_archive.open()
+        print("[PASS] Lifespan warm-up and readiness")
+
 def run_all_tests():
     """Run all tests and return summary"""
     print("\n" + "="*50)
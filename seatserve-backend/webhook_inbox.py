@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+SeatServe Backend - Webhook Inbox
+Durable Stripe webhook inbox, drained in batches by a background worker
+"""
+
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+
+from database import db
+from order_events import broker
+from payments import Notification, intent_order_id, settle_payment
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = int(os.getenv('SEATSERVE_WEBHOOK_BATCH_SIZE', '100'))
+# Fallback poll interval; new deliveries wake the worker immediately
+WEBHOOK_POLL_SECONDS = float(os.getenv('SEATSERVE_WEBHOOK_POLL_SECONDS', '5'))
+
+
+def enqueue_event(conn: sqlite3.Connection, event: dict, payload: bytes) -> bool:
+    """Append a verified event to the inbox; False if it was already delivered"""
+    cursor = conn.execute('''
+        INSERT OR IGNORE INTO webhook_events (event_id, type, payload, received_at)
+        VALUES (?, ?, ?, ?)
+    ''', (event['id'], event['type'], payload.decode(), datetime.now().isoformat()))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def requeue_events(conn: sqlite3.Connection, event_ids: Optional[Iterable[str]] = None) -> int:
+    """Mark events for processing again; by default every failed event"""
+    if event_ids is None:
+        cursor = conn.execute(
+            "UPDATE webhook_events SET processed_at = NULL, status = 'pending' WHERE status = 'failed'"
+        )
+    else:
+        cursor = conn.executemany(
+            "UPDATE webhook_events SET processed_at = NULL, status = 'pending' WHERE event_id = ?",
+            [(event_id,) for event_id in event_ids]
+        )
+    conn.commit()
+    return cursor.rowcount
+
+
+def _intent_payments(conn: sqlite3.Connection, intent: dict) -> List[Tuple[int, int]]:
+    """(payment id, order id) rows for an intent, recording a payment if only the order is known"""
+    rows = conn.execute(
+        'SELECT id, order_id FROM payments WHERE transaction_id = ?', (intent['id'],)
+    ).fetchall()
+    if rows:
+        return rows
+    order_id = intent_order_id(intent.get('metadata'))
+    if order_id is None or conn.execute('SELECT 1 FROM orders WHERE id = ?', (order_id,)).fetchone() is None:
+        return []
+    cursor = conn.execute('''
+        INSERT INTO payments (order_id, amount, payment_method, status, transaction_id, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (order_id, _intent_amount(intent) / 100, 'card', 'pending', intent['id'], datetime.now().isoformat()))
+    return [(cursor.lastrowid, order_id)]
+
+
+def _intent_amount(intent: dict) -> int:
+    return intent.get('amount_received') or intent.get('amount') or 0
+
+
+def _apply_event(conn: sqlite3.Connection, event: dict) -> Tuple[str, List[Notification]]:
+    """Apply one event inside the caller's transaction; returns (inbox status, notifications)"""
+    event_type = event['type']
+    if event_type not in ('payment_intent.succeeded', 'payment_intent.payment_failed'):
+        return 'ignored', []
+
+    intent = event['data']['object']
+    payments = _intent_payments(conn, intent)
+    if not payments:
+        return 'unmatched', []
+
+    if event_type == 'payment_intent.succeeded':
+        outcome, amount_cents = 'completed', _intent_amount(intent)
+    else:
+        outcome, amount_cents = 'failed', None
+    notifications = []
+    for payment_id, order_id in payments:
+        notification = settle_payment(conn, payment_id, order_id, outcome, amount_cents)
+        if notification is not None:
+            notifications.append(notification)
+    return 'processed', notifications
+
+
+def process_batch(conn: sqlite3.Connection, batch_size: int = WEBHOOK_BATCH_SIZE) -> Tuple[int, List[Notification]]:
+    """Apply up to ``batch_size`` pending events in one transaction.
+
+    Each event runs under its own savepoint, so an event that fails is
+    marked ``failed`` (and can be requeued) without undoing the rest of
+    the batch. Returns the number of events handled and the order events
+    to publish after commit.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('''
+            SELECT event_id, payload FROM webhook_events
+            WHERE processed_at IS NULL
+            ORDER BY rowid
+            LIMIT ?
+        ''', (batch_size,)).fetchall()
+
+        notifications: List[Notification] = []
+        processed_at = datetime.now().isoformat()
+        for event_id, payload in rows:
+            conn.execute('SAVEPOINT webhook_event')
+            try:
+                status, event_notifications = _apply_event(conn, json.loads(payload))
+                conn.execute('RELEASE webhook_event')
+                error = None
+                notifications.extend(event_notifications)
+            except Exception as e:
+                conn.execute('ROLLBACK TO webhook_event')
+                conn.execute('RELEASE webhook_event')
+                status, error = 'failed', str(e)
+                logger.error(f"❌ Error procesando evento de webhook {event_id}: {error}")
+            conn.execute('''
+                UPDATE webhook_events
+                SET status = ?, error = ?, attempts = attempts + 1, processed_at = ?
+                WHERE event_id = ?
+            ''', (status, error, processed_at, event_id))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return len(rows), notifications
+
+
+class WebhookWorker:
+    """Background task draining the webhook inbox.
+
+    Runs on the app's event loop and hands each batch to the database
+    runner, so webhook deliveries only pay for one INSERT. ``notify()``
+    wakes it as soon as an event lands; the poll interval picks up
+    anything left behind by a restart.
+    """
+
+    def __init__(self, database, broker, batch_size: int = WEBHOOK_BATCH_SIZE, interval: float = WEBHOOK_POLL_SECONDS):
+        self.database = database
+        self.broker = broker
+        self.batch_size = batch_size
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def drain(self) -> int:
+        """Process pending events until the inbox is empty; returns how many were handled"""
+        total = 0
+        while True:
+            handled, notifications = await self.database.run(process_batch, self.batch_size, name="webhook_batch")
+            for event_type, order_id, table_number, status, fields in notifications:
+                self.broker.publish(event_type, order_id, table_number, status, **fields)
+            total += handled
+            if handled < self.batch_size:
+                return total
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                handled = await self.drain()
+                if handled:
+                    logger.info(f"🔔 Eventos de webhook procesados: {handled}")
+            except Exception as e:
+                logger.error(f"❌ Error en el worker de webhooks: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def notify(self) -> None:
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            # The worker's event loop is gone
+            pass
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        self._loop = None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+
+webhook_worker = WebhookWorker(db, broker)